@@ -19,6 +19,7 @@
 """Variance generators in real and reciprocal space for fluctuation electron microscopy."""
 
 import numpy as np
+import dask.array as da
 from hyperspy.signals import Signal2D
 from hyperspy.api import stack
 
@@ -27,7 +28,8 @@ from pyxem.utils._signals import (
     _transfer_navigation_axes_to_signal_axes,
     _transfer_signal_axes,
 )
-from pyxem.utils._deprecated import deprecated
+from pyxem.utils._deprecated import deprecated, deprecated_argument
+from pyxem.utils._dask import _get_navigation_moments
 
 
 class VarianceGenerator:
@@ -57,6 +59,7 @@ class VarianceGenerator:
         alternative="pyxem.signals.diffraction2d.get_variance",
         removal="1.0.0",
     )
+    @deprecated_argument(name="set_data_type", since="0.20", removal="1.0.0")
     def get_diffraction_variance(self, dqe, set_data_type=None):
         """Calculates the variance in scattered intensity as a function of
         scattering vector.
@@ -66,13 +69,9 @@ class VarianceGenerator:
         dqe : float
             Detective quantum efficiency of the detector for Poisson noise
             correction.
-        data_type : numpy data type.
-            For numpy data types, see
-            https://docs.scipy.org/doc/numpy-1.13.0/user/basics.types.html.
-            This is incorporated as squaring the numbers in meansq_dp results
-            in considerably larger than the ones in the original array. This can
-            result in an overflow error that is difficult to distinguish. Hence
-            the data can be converted to a different data type to accommodate.
+        set_data_type : numpy data type.
+            Deprecated and ignored. The statistics are always calculated in
+            float64 without squaring the data, so they can no longer overflow.
 
         Returns
         -------
@@ -82,13 +81,13 @@ class VarianceGenerator:
         """
 
         dp = self.signal
-        mean_dp = dp.mean((0, 1))
-        if set_data_type is None:
-            meansq_dp = Signal2D(np.square(dp.data)).mean((0, 1))
-        else:
-            meansq_dp = Signal2D(np.square(dp.data.astype(set_data_type))).mean((0, 1))
+        # the moments are calculated in float64 in a single pass so the squared
+        # data is never created and `set_data_type` is no longer needed
+        count, mean, m2 = da.compute(*_get_navigation_moments(dp.data, (0, 1)))
+        mean_dp = Signal2D(mean)
+        meansq_dp = Signal2D(m2 / count + np.square(mean))
 
-        normvar = (meansq_dp.data / np.square(mean_dp.data)) - 1.0
+        normvar = (m2 / count) / np.square(mean)
         var_dp = Signal2D(normvar)
         corr_var_array = var_dp.data - (np.divide(dqe, mean_dp.data))
         corr_var_array[np.isinf(corr_var_array)] = 0
@@ -133,9 +132,10 @@ class VarianceGenerator:
             DP.
         """
         im = self.signal.T
-        mean_im = im.mean((0, 1))
-        meansq_im = Signal2D(np.square(im.data)).mean((0, 1))
-        normvar = (meansq_im.data / np.square(mean_im.data)) - 1.0
+        count, mean, m2 = da.compute(*_get_navigation_moments(im.data, (0, 1)))
+        mean_im = Signal2D(mean)
+        meansq_im = Signal2D(m2 / count + np.square(mean))
+        normvar = (m2 / count) / np.square(mean)
         var_im = Signal2D(normvar)
         corr_var_array = normvar - (np.divide(dqe, mean_im.data))
         corr_var_array[np.invert(np.isfinite(corr_var_array))] = 0
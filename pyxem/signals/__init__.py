@@ -25,7 +25,7 @@ from .correlation2d import Correlation2D, LazyCorrelation2D
 from .diffraction_variance1d import DiffractionVariance1D
 from .diffraction_variance2d import DiffractionVariance2D, ImageVariance
 from .diffraction_vectors import DiffractionVectors
-from .diffraction_vectors2d import DiffractionVectors2D
+from .diffraction_vectors2d import DiffractionVectors2D, LazyDiffractionVectors2D
 from .diffraction_vectors1d import DiffractionVectors1D
 from .beam_shift import BeamShift, LazyBeamShift
 from .differential_phase_contrast import (
@@ -50,7 +50,10 @@ from .correlation1d import Correlation1D, LazyCorrelation1D
 from .tensor_field import DisplacementGradientMap
 from .virtual_dark_field_image import VirtualDarkFieldImage
 from .insitu_diffraction2d import InSituDiffraction2D
-from .labeled_diffraction_vectors2d import LabeledDiffractionVectors2D
+from .labeled_diffraction_vectors2d import (
+    LabeledDiffractionVectors2D,
+    LazyLabeledDiffractionVectors2D,
+)
 
 
 __all__ = [
@@ -71,6 +74,7 @@ __all__ = [
     "DiffractionVectors",
     "DiffractionVectors1D",
     "DiffractionVectors2D",
+    "LazyDiffractionVectors2D",
     "Diffraction1D",
     "LazyDiffraction1D",
     "LazyDiffraction2D",
@@ -97,5 +101,6 @@ __all__ = [
     "VirtualDarkFieldImage",
     "InSituDiffraction2D",
     "LabeledDiffractionVectors2D",
+    "LazyLabeledDiffractionVectors2D",
     "OrientationMap",
 ]
@@ -16,8 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+
 import numpy as np
+import dask
 import dask.array as da
+from dask.diagnostics import ProgressBar
 
 from hyperspy.api import interactive
 from hyperspy.misc.utils import isiterable
@@ -31,6 +35,10 @@ from tlz import concat
 if CUPY_INSTALLED:
     import cupy as cp
 from pyxem.utils.virtual_images_utils import normalize_virtual_images
+from pyxem.utils._dask import _get_navigation_moments, _plan_chunks
+from pyxem.utils._chunkwise import _apply_to_frames_inplace
+
+_logger = logging.getLogger(__name__)
 
 
 OUT_SIGNAL_AXES_DOCSTRING = """out_signal_axes : None, iterable of int or string
@@ -299,10 +307,257 @@ class CommonDiffraction:
             self.metadata.add_node("Navigation_signals")
         self.metadata.Navigation_signals.add_dictionary(dict_signal)
 
-    def _map_blocks_prepare(self, navigation_chunks="auto"):
+    def _get_navigation_moments(self, navigation_axes=None):
+        """Get the mean and M2 (sum of squared differences from the mean) over
+        some navigation axes in a single pass over the data.
+
+        Parameters
+        ----------
+        navigation_axes : None or list
+            The axes to reduce over. The default is to use all of the navigation axes.
+
+        Returns
+        -------
+        count : int
+            The number of patterns reduced.
+        mean, m2 : BaseSignal
+            The mean and the M2 signals. The variance is ``m2 / count``.
+
+        See Also
+        --------
+        pyxem.utils._dask._get_navigation_moments
+        """
+        if navigation_axes is None:
+            axes = self.axes_manager.navigation_axes
+        else:
+            axes = self.axes_manager[navigation_axes]
+            if not np.iterable(axes):
+                axes = (axes,)
+        count, mean, m2 = _get_navigation_moments(
+            self.data, tuple(ax.index_in_array for ax in axes)
+        )
+        if not self._lazy:
+            mean, m2 = da.compute(mean, m2)
+        signals = []
+        for data in (mean, m2):
+            s = self._deepcopy_with_new_data(None)
+            s.data = data
+            s._remove_axis([ax.index_in_axes_manager for ax in axes])
+            signals.append(s)
+        return (count,) + tuple(signals)
+
+    def _get_chunk_axes(self, operation):
+        """Get the array indices of the axes which an operation needs to have
+        in a single chunk.
+
+        Parameters
+        ----------
+        operation : str or iterable
+            "frame" for operations on each diffraction pattern (all signal axes),
+            "navigation" for operations along all the navigation axes, or the
+            axes (index or name) to keep in one chunk.
+        """
+        if isinstance(operation, str) and operation == "frame":
+            axes = self.axes_manager.signal_axes
+        elif isinstance(operation, str) and operation == "navigation":
+            axes = self.axes_manager.navigation_axes
+        else:
+            try:
+                axes = self.axes_manager[operation]
+            except (ValueError, IndexError, KeyError, TypeError):
+                raise ValueError(
+                    f"The operation '{operation}' is not known. Use 'frame', "
+                    "'navigation' or a list of axes."
+                )
+            if not np.iterable(axes):
+                axes = (axes,)
+        return tuple(ax.index_in_array for ax in axes)
+
+    def plan_chunks(
+        self, operation="frame", chunk_bytes=None, memory_limit=None, num_workers=None
+    ):
+        """Plan the chunking of the data for an operation, without computing
+        anything.
+
+        The axes which the operation needs are kept in a single chunk and the other
+        axes are split so that each chunk fits in ``chunk_bytes`` and the work is
+        spread over the workers. The current chunks of a lazy signal are kept when
+        they already fit, so consecutive operations do not rechunk the data.
+
+        Parameters
+        ----------
+        operation : str or iterable
+            "frame" (default) for operations on each diffraction pattern, such as
+            polar transforms, integrations or template matching. "navigation" for
+            operations along all of the navigation axes. Alternatively the axes
+            (index or name) which should be kept in one chunk.
+        chunk_bytes : int or str, optional
+            The maximum size of each chunk, e.g. "64MiB". Default is dask's
+            "array.chunk-size" setting.
+        memory_limit : int or str, optional
+            The memory available, e.g. "16GiB". The chunks are made small enough
+            for every worker to hold the input and output of one chunk.
+        num_workers : int, optional
+            The number of workers. Default is the number of CPUs.
+
+        Returns
+        -------
+        plan : pyxem.utils._dask.ChunkPlan
+            Named tuple with the planned ``chunks``, the size of the largest chunk
+            ``chunk_bytes``, the number of chunks ``n_chunks``, the estimated peak
+            ``memory`` in bytes and if the data would be rechunked ``rechunk``.
+
+        Examples
+        --------
+        >>> s = pxm.data.dummy_data.get_cbed_signal().as_lazy()
+        >>> plan = s.plan_chunks("frame", memory_limit="4GiB", num_workers=4)
+        >>> plan.memory  # estimated peak memory in bytes
+        """
+        chunks = self.data.chunks if self._lazy else None
+        return _plan_chunks(
+            self.data.shape,
+            self.data.dtype,
+            whole_axes=self._get_chunk_axes(operation),
+            chunks=chunks,
+            chunk_bytes=chunk_bytes,
+            memory_limit=memory_limit,
+            num_workers=num_workers,
+        )
+
+    def _rechunk_for(self, operation="frame", **kwargs):
+        """Get a lazy version of the signal chunked for an operation, see
+        :meth:`plan_chunks`. The signal is only rechunked if needed."""
+        plan = self.plan_chunks(operation, **kwargs)
+        _logger.info(
+            f"Planned {plan.n_chunks} chunks of up to {plan.chunk_bytes} bytes, "
+            f"estimated peak memory {plan.memory} bytes"
+        )
+        if not self._lazy:
+            s_input = self.as_lazy()
+            s_input.data = da.from_array(self.data, chunks=plan.chunks)
+        elif plan.rechunk:
+            s_input = self._deepcopy_with_new_data(self.data.rechunk(plan.chunks))
+        else:
+            s_input = self
+        return s_input
+
+    def _can_map_inplace(self, inplace, output_dtype=None, args=(), kwargs=None):
+        """Check if :meth:`_map_inplace` can be used instead of
+        :meth:`hyperspy.api.signals.BaseSignal.map` with the given arguments."""
+        if kwargs is None:
+            kwargs = {}
+        map_only = ("ragged", "output_signal_size", "output_dtype", "navigation_chunks")
+        return (
+            inplace
+            and not self._lazy
+            and not kwargs.get("lazy_output", False)
+            and not args
+            and not any(key in kwargs for key in map_only)
+            and (output_dtype is None or np.dtype(output_dtype) == self.data.dtype)
+        )
+
+    def _map_inplace(
+        self,
+        function,
+        iterating_kwargs=None,
+        chunk_bytes=None,
+        num_workers=None,
+        show_progressbar=None,
+        lazy_output=None,
+        **kwargs,
+    ):
+        """Apply a single frame function to every diffraction pattern, writing the
+        result of each chunk straight back into the data of this (non-lazy) signal.
+
+        Unlike :meth:`hyperspy.api.signals.BaseSignal.map` with ``inplace=True``,
+        no full size temporary array is created: the peak memory is one frame per
+        worker on top of the data itself.
+
+        Parameters
+        ----------
+        function : callable
+            Function applied to each frame, returning an array with the same shape.
+            The result is cast to the dtype of the signal using NumPy's "unsafe"
+            casting, i.e. floating point results are truncated when the signal has
+            an integer dtype.
+        iterating_kwargs : dict, optional
+            Arrays or signals with the same navigation shape as this signal. The
+            value at each navigation position is passed to ``function``.
+        chunk_bytes : int or str, optional
+            The size of the chunks which are processed in parallel.
+        num_workers : int, optional
+            The number of workers.
+        show_progressbar : bool, optional
+            If a progress bar is shown.
+        lazy_output : None or False
+            Only for compatibility with :meth:`hyperspy.api.signals.BaseSignal.map`,
+            the output is never lazy.
+        **kwargs : dict
+            Passed to ``function``.
+        """
+        if self._lazy or lazy_output:
+            raise ValueError("In place writing is only possible for non-lazy signals")
+        nav_shape = self.axes_manager._navigation_shape_in_array
+        iterating = {}
+        if iterating_kwargs is not None:
+            for key, value in iterating_kwargs.items():
+                if isinstance(value, hs.signals.BaseSignal):
+                    value = value.data
+                value = np.asarray(value)
+                if value.shape[: len(nav_shape)] != nav_shape:
+                    raise ValueError(
+                        f"The navigation shape of {key}, {value.shape}, does not "
+                        f"match the navigation shape of the signal, {nav_shape}"
+                    )
+                iterating[key] = value
+        plan = self.plan_chunks(
+            "frame", chunk_bytes=chunk_bytes, num_workers=num_workers
+        )
+        tasks = []
+        for nav_slice in da.core.slices_from_chunks(plan.chunks[: len(nav_shape)]):
+            tasks.append(
+                dask.delayed(_apply_to_frames_inplace, pure=False)(
+                    self.data[nav_slice],
+                    function,
+                    {key: value[nav_slice] for key, value in iterating.items()},
+                    **kwargs,
+                )
+            )
+        if show_progressbar is None:
+            from hyperspy.defaults_parser import preferences
+
+            show_progressbar = preferences.General.show_progressbar
+        # The tasks write into views of the data, so they have to run in this
+        # process whatever scheduler is configured: with processes or a distributed
+        # client the views would be copied and the results lost.
+        if show_progressbar:
+            with ProgressBar():
+                dask.compute(*tasks, scheduler="threads", num_workers=num_workers)
+        else:
+            dask.compute(*tasks, scheduler="threads", num_workers=num_workers)
+        self.events.data_changed.trigger(obj=self)
+
+    def _map_blocks_prepare(
+        self, navigation_chunks="auto", plan_chunks=False, num_workers=None
+    ):
         """Prepare the signal for mapping blocks.  This function will check if the signal
         is chunked correctly and rechunk if necessary.
+
+        By default only the signal axes are merged into a single chunk, the chunks of
+        the navigation axes of a lazy signal are kept.
+
+        Parameters
+        ----------
+        navigation_chunks : str or tuple
+            The navigation chunks of a signal which is not lazy.
+        plan_chunks : bool
+            If True, the signal is chunked as planned by :meth:`plan_chunks` for an
+            operation on each diffraction pattern instead.
+        num_workers : int, optional
+            The number of workers used by the plan.
         """
+        if plan_chunks:
+            return self._rechunk_for("frame", num_workers=num_workers)
         if not self._lazy:
             s_input = self.as_lazy()
             s_input.rechunk(nav_chunks=navigation_chunks)
@@ -330,6 +585,7 @@ class CommonDiffraction:
         ragged=False,
         num_workers=None,
         meta=None,
+        plan_chunks=False,
         **kwargs,
     ):
         """Apply a function to each block of the signal. This function might change in the
@@ -345,6 +601,10 @@ class CommonDiffraction:
             The shape of the signal.
         dtype: np.dtype
             The type of the signal.
+        plan_chunks : bool
+            If True, the blocks are chunked as planned by :meth:`plan_chunks` for
+            ``num_workers`` instead of only merging the signal axes. See
+            :meth:`_map_blocks_prepare`.
         **kwargs : dict
             The keyword arguments to pass to the function.
 
@@ -362,7 +622,9 @@ class CommonDiffraction:
         if lazy_output is None:
             lazy_output = self._lazy
         new_shape = navigation_shape + signal_shape
-        old_sig = self._map_blocks_prepare()
+        old_sig = self._map_blocks_prepare(
+            plan_chunks=plan_chunks, num_workers=num_workers
+        )
         if meta is None:
             meta = old_sig.data._meta
 
@@ -430,3 +692,59 @@ class CommonDiffraction:
         if not lazy_output and not data_stored:
             sig.data = sig.data.compute(num_workers=num_workers)
         return sig
+
+    def _map_chunkwise(
+        self,
+        function,
+        output_signal_size=None,
+        output_dtype=None,
+        inplace=False,
+        lazy_output=None,
+        num_workers=None,
+        show_progressbar=None,
+        **kwargs,
+    ):
+        """Apply a batched function once per chunk of the signal.
+
+        This is the chunkwise equivalent of :meth:`hyperspy.api.signals.BaseSignal.map`
+        for the kernels in :mod:`pyxem.utils._chunkwise`.
+
+        Parameters
+        ----------
+        function : callable
+            Function taking an array with shape ``navigation_shape + (H, W)`` and
+            returning an array with shape ``navigation_shape + output_signal_size``.
+        output_signal_size : tuple, optional
+            The signal shape of the output in array order. Default is the signal
+            shape of this signal.
+        output_dtype : numpy.dtype, optional
+            The data type of the output. If None, it is found by applying the
+            function to a single frame of ones.
+        inplace : bool
+            If the signal is overwritten or copied to a new signal
+        lazy_output : bool, optional
+            If the output is lazy. By default the output is lazy if the signal is.
+        num_workers : int, optional
+            Number of workers used when computing the result.
+        show_progressbar : None
+            Ignored, kept for compatibility with the per-frame methods.
+        **kwargs : dict
+            Passed to ``function``.
+        """
+        if output_dtype is None:
+            frame = np.ones(
+                (1,) + self.axes_manager._signal_shape_in_array, dtype=self.data.dtype
+            )
+            with np.errstate(all="ignore"):
+                output_dtype = function(frame, **kwargs).dtype
+        if output_signal_size is not None:
+            output_signal_size = tuple(output_signal_size)
+        return self._blockwise(
+            function,
+            signal_shape=output_signal_size,
+            dtype=output_dtype,
+            inplace=inplace,
+            lazy_output=lazy_output,
+            num_workers=num_workers,
+            **kwargs,
+        )
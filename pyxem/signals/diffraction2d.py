@@ -53,6 +53,14 @@ from pyxem.utils.diffraction import (
 from pyxem.utils._azimuthal_integrations import (
     _slice_radial_integrate,
     _slice_radial_integrate1d,
+    _get_csr_matrix1d,
+    _get_csr_matrix2d,
+    _mask_csr_matrix,
+    _mask_factors1d,
+    _mask_factors2d,
+    _slice_radial_integrate1d_moments,
+    _integrate_csr_moments,
+    _integrate_csr,
 )
 from pyxem.utils._dask import (
     _get_dask_array,
@@ -74,6 +82,16 @@ from pyxem.utils._background_subtraction import (
     _subtract_hdome,
     _subtract_radial_median,
 )
+from pyxem.utils._chunkwise import (
+    _apply_to_frames,
+    _beam_center_blur_chunk,
+    _center_of_mass_chunk,
+    _gain_normalise_chunk,
+    _subtract_dog_chunk,
+    _subtract_median_chunk,
+    _subtract_radial_median_chunk,
+    _threshold_and_mask_chunk,
+)
 from pyxem.utils.calibration import Calibration
 
 from pyxem import CUPY_INSTALLED
@@ -143,7 +161,9 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             the input, if False, casting to higher precision may occur.
         inplace : bool
             If True (default), this signal is overwritten. Otherwise, returns a
-            new signal.
+            new signal. For a non-lazy signal where the output has the same dtype
+            as the signal (``keep_dtype=True`` or float64 data), each chunk is
+            written straight back into the existing array, see :ref:`inplace-processing`.
         *args:
             Arguments to be passed to :meth:`hyperspy.api.signals.BaseSignal.map`.
         **kwargs:
@@ -170,6 +190,15 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         else:
             out_dtype = self.data.dtype
 
+        if self._can_map_inplace(inplace, out_dtype, args, kwargs):
+            if isinstance(transformation, BaseSignal):
+                kwargs["iterating_kwargs"] = {"transformation": transformation}
+            else:
+                kwargs["transformation"] = transformation
+            return self._map_inplace(
+                apply_transformation, order=order, keep_dtype=keep_dtype, **kwargs
+            )
+
         return self.map(
             apply_transformation,
             transformation=transformation,
@@ -207,10 +236,11 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             non-zero order might lead to artifacts. See the docstring in
             scipy.ndimage.shift for more information. Default 1.
         inplace : bool
-            If True (default), the data is replaced by the result. Useful when
-            working with very large datasets, as this avoids doubling the
-            amount of memory needed. If False, a new signal with the results
-            is returned.
+            If True, the data is replaced by the result. Useful when
+            working with very large datasets, as for a non-lazy signal each chunk
+            is written straight back into the existing array, which avoids doubling
+            the amount of memory needed. See :ref:`inplace-processing`.
+            If False (default), a new signal with the results is returned.
         show_progressbar : bool
             Default True.
 
@@ -240,6 +270,13 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             shift_x, shift_y = pst._make_centre_array_from_signal(
                 self, x=shift_x, y=shift_y
             )
+        if self._can_map_inplace(inplace):
+            return self._map_inplace(
+                pst._shift_single_frame,
+                iterating_kwargs={"shift_x": shift_x, "shift_y": shift_y},
+                show_progressbar=show_progressbar,
+                interpolation_order=interpolation_order,
+            )
         s_shift_x = BaseSignal(shift_x).T
         s_shift_y = BaseSignal(shift_y).T
 
@@ -255,7 +292,7 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         if not inplace:
             return s_shift
 
-    def rotate_diffraction(self, angle, show_progressbar=True):
+    def rotate_diffraction(self, angle, show_progressbar=True, inplace=False):
         """
         Rotate the diffraction dimensions.
 
@@ -265,10 +302,15 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             Clockwise rotation in degrees.
         show_progressbar : bool
             Default True
+        inplace : bool
+            If True, the data is replaced by the result. For a non-lazy signal each
+            chunk is written straight back into the existing array, see
+            :ref:`inplace-processing`. Default False.
 
         Returns
         -------
         rotated_signal : Diffraction2D class
+            Only returned if ``inplace=False``.
 
         Examples
         --------
@@ -276,14 +318,23 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         >>> s_rot = s.rotate_diffraction(30, show_progressbar=False)
 
         """
+        if self._can_map_inplace(inplace):
+            return self._map_inplace(
+                rotate,
+                angle=-angle,
+                reshape=False,
+                show_progressbar=show_progressbar,
+            )
         s_rotated = self.map(
             rotate,
             ragged=False,
             angle=-angle,
             reshape=False,
-            inplace=False,
+            inplace=inplace,
             show_progressbar=show_progressbar,
         )
+        if inplace:
+            return
         if self._lazy:
             s_rotated.compute(show_progressbar=show_progressbar)
         return s_rotated
@@ -370,7 +421,13 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         return signal_mask
 
     def apply_gain_normalisation(
-        self, dark_reference, bright_reference, inplace=True, *args, **kwargs
+        self,
+        dark_reference,
+        bright_reference,
+        inplace=True,
+        *args,
+        chunkwise=False,
+        **kwargs,
     ):
         """Apply gain normalization to experimentally acquired electron
         diffraction patterns.
@@ -384,12 +441,34 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         inplace : bool
             If True (default), this signal is overwritten. Otherwise, returns a
             new signal.
+        chunkwise : bool
+            If True, the normalisation is applied to every chunk of the data at
+            once instead of frame by frame. See :ref:`chunkwise-processing`.
+            Default False.
         *args:
             Arguments to be passed to :meth:`hyperspy.api.signals.BaseSignal.map`.
         **kwargs:
             Keyword arguments to be passed to :meth:`hyperspy.api.signal.BaseSignal.map`.
 
         """
+        if chunkwise:
+            references = []
+            for reference in (dark_reference, bright_reference):
+                if isinstance(reference, BaseSignal):
+                    if reference.axes_manager.navigation_dimension != 0:
+                        raise ValueError(
+                            "chunkwise=True only supports references without a "
+                            "navigation dimension."
+                        )
+                    reference = reference.data
+                references.append(reference)
+            return self._map_chunkwise(
+                _gain_normalise_chunk,
+                dref=references[0],
+                bref=references[1],
+                inplace=inplace,
+                **kwargs,
+            )
         return self.map(
             gain_normalise,
             dref=dark_reference,
@@ -403,7 +482,7 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         name="lazy_result", alternative="lazy_output", since="0.15.0", removal="1.0.0"
     )
     def subtract_diffraction_background(
-        self, method="median kernel", inplace=False, **kwargs
+        self, method="median kernel", inplace=False, chunkwise=False, **kwargs
     ):
         """Background subtraction of the diffraction data.
 
@@ -424,6 +503,13 @@ class Diffraction2D(CommonDiffraction, Signal2D):
 
             For `h-dome` the parameter h detemines the relative height of local peaks that
             are supressed.
+        inplace : bool
+            If True, this signal is overwritten. Otherwise, returns a new signal.
+        chunkwise : bool
+            If True, the background is subtracted from every chunk of the data at
+            once instead of frame by frame. The 'h-dome' method has no batched
+            implementation and is looped over the frames of each chunk.
+            See :ref:`chunkwise-processing`. Default False.
         **kwargs :
                 To be passed to the method chosen: min_sigma/max_sigma, footprint,
                 centre_x,centre_y / h
@@ -454,6 +540,23 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             )
         subtraction_function = method_dict[method]
 
+        if chunkwise:
+            chunk_dict = {
+                "difference of gaussians": _subtract_dog_chunk,
+                "median kernel": _subtract_median_chunk,
+                "radial median": _subtract_radial_median_chunk,
+            }
+            if method in chunk_dict:
+                return self._map_chunkwise(
+                    chunk_dict[method], inplace=inplace, **kwargs
+                )
+            return self._map_chunkwise(
+                _apply_to_frames,
+                frame_function=subtraction_function,
+                output_dtype=float,
+                inplace=inplace,
+                **kwargs,
+            )
         return self.map(subtraction_function, inplace=inplace, **kwargs)
 
     @deprecated_argument(
@@ -593,8 +696,9 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         lazy_output : bool, optional
             When working lazily, determines if the result is computed. Default is True (ie. no .compute)
         inplace : bool, optional
-            When working in memory, determines if operation is performed inplace, default is True. When
-            working lazily the result will NOT be inplace.
+            When working in memory, determines if operation is performed inplace, default is True.
+            Each chunk is then written straight back into the existing array, see
+            :ref:`inplace-processing`. When working lazily the result will NOT be inplace.
         *args :
             passed to :meth:`hyperspy.api.signals.BaseSignal.map` if working in memory
         **kwargs :
@@ -616,7 +720,14 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         find_hot_pixels
 
         """
-        return self.map(remove_bad_pixels, bad_pixels=bad_pixel_array, **kwargs)
+        inplace = kwargs.pop("inplace", True)
+        if self._can_map_inplace(inplace, kwargs=kwargs):
+            return self._map_inplace(
+                remove_bad_pixels, bad_pixels=bad_pixel_array, **kwargs
+            )
+        return self.map(
+            remove_bad_pixels, bad_pixels=bad_pixel_array, inplace=inplace, **kwargs
+        )
 
     """ Direct beam and peak finding tools """
 
@@ -629,6 +740,7 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         lazy_output=None,
         signal_slice=None,
         half_square_width=None,
+        chunkwise=False,
         **kwargs,
     ):
         """Estimate the direct beam position in each experimentally acquired
@@ -665,6 +777,11 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             diffracted spots brighter than the direct beam. Crops the diffraction
             pattern to `half_square_width` pixels around the center of the diffraction
             pattern. Only one of `half_square_width` or signal_slice can be defined.
+        chunkwise : bool
+            If True, the beam position is found for every chunk of the data at once
+            instead of frame by frame. The "blur" and "center_of_mass" methods are
+            batched, the other methods are looped over the frames of each chunk.
+            See :ref:`chunkwise-processing`. Default False.
         **kwargs:
             Additional arguments accepted by :func:`pyxem.utils.diffraction.find_beam_center_blur`,
             :func:`pyxem.utils.diffraction.find_beam_center_interpolate`,
@@ -746,7 +863,48 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             method, method_dict, print_help=False, **kwargs
         )
 
-        if method == "cross_correlate":
+        if method == "center_of_mass" and "mask" in kwargs and signal_slice is not None:
+            # Shifts mask into coordinate space of sliced signal
+            x, y, r = kwargs["mask"]
+            x = x - signal_slice[0]
+            y = y - signal_slice[2]
+            kwargs["mask"] = (x, y, r)
+
+        if chunkwise:
+            if method == "center_of_mass":
+                mask = kwargs.pop("mask", None)
+                if mask is not None:
+                    x, y, r = mask
+                    mask = pst._make_circular_mask(x, y, *signal_shape, r)
+                centers = signal._map_chunkwise(
+                    _center_of_mass_chunk,
+                    output_signal_size=(2,),
+                    output_dtype=float,
+                    lazy_output=lazy_output,
+                    mask=mask,
+                    **kwargs,
+                )
+            elif method == "blur":
+                centers = signal._map_chunkwise(
+                    _beam_center_blur_chunk,
+                    output_signal_size=(2,),
+                    lazy_output=lazy_output,
+                    **kwargs,
+                )
+            else:
+                centers = signal._map_chunkwise(
+                    _apply_to_frames,
+                    frame_function=method_function,
+                    output_signal_size=(2,),
+                    output_dtype=float,
+                    lazy_output=lazy_output,
+                    **kwargs,
+                )
+            if method == "cross_correlate":
+                shifts = centers
+            else:
+                shifts = -centers + origin_coordinates
+        elif method == "cross_correlate":
             shifts = signal.map(
                 method_function,
                 inplace=False,
@@ -776,12 +934,6 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             )
             shifts = -centers + origin_coordinates
         elif method == "center_of_mass":
-            if "mask" in kwargs and signal_slice is not None:
-                # Shifts mask into coordinate space of sliced signal
-                x, y, r = kwargs["mask"]
-                x = x - signal_slice[0]
-                y = y - signal_slice[2]
-                kwargs["mask"] = (x, y, r)
             centers = find_center_of_mass(
                 signal,
                 lazy_output=lazy_output,
@@ -817,6 +969,7 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         align_kwargs=None,
         inplace=True,
         *args,
+        chunkwise=False,
         **kwargs,
     ):
         """Estimate the direct beam position in each experimentally acquired
@@ -847,6 +1000,9 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         align_kwargs : dict
             Parameters passed to the alignment function. See scipy.ndimage.shift
             for more information about the parameters.
+        chunkwise : bool
+            If True, the direct beam position is found chunk by chunk, see
+            :meth:`get_direct_beam_position`. Default False.
         *args, **kwargs :
             Additional arguments accepted by :func:`pyxem.utils.diffraction.find_beam_center_blur`,
             :func:`pyxem.utils.diffraction.find_beam_center_interpolate`,
@@ -884,7 +1040,7 @@ class Diffraction2D(CommonDiffraction, Signal2D):
 
         if shifts is None:
             shifts = self.get_direct_beam_position(
-                method=method, lazy_output=lazy_output, **kwargs
+                method=method, lazy_output=lazy_output, chunkwise=chunkwise, **kwargs
             )
         if "order" not in align_kwargs:
             if subpixel:
@@ -908,7 +1064,9 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         else:
             return aligned
 
-    def threshold_and_mask(self, threshold=None, mask=None, show_progressbar=True):
+    def threshold_and_mask(
+        self, threshold=None, mask=None, show_progressbar=True, chunkwise=False
+    ):
         """Get a thresholded and masked of the signal.
 
         Useful for figuring out optimal settings when using 'center_of_mass' in
@@ -923,6 +1081,9 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             Round mask centered on x and y, with radius r.
         show_progressbar : bool
             Default True
+        chunkwise : bool
+            If True, every chunk of the data is thresholded at once instead of
+            frame by frame. See :ref:`chunkwise-processing`. Default False.
 
         Returns
         -------
@@ -952,6 +1113,14 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             x, y, r = mask
             im_x, im_y = self.axes_manager.signal_shape
             mask = pst._make_circular_mask(x, y, im_x, im_y, r)
+        if chunkwise:
+            return self._map_chunkwise(
+                _threshold_and_mask_chunk,
+                inplace=False,
+                show_progressbar=show_progressbar,
+                threshold=threshold,
+                mask=mask,
+            )
         s_out = self.map(
             function=pst._threshold_and_mask_single_frame,
             ragged=False,
@@ -1583,27 +1752,23 @@ class Diffraction2D(CommonDiffraction, Signal2D):
                 " https://doi.org/10.1016/j.ultramic.2010.05.010"
             )
 
+        if method in ["Omega", "r", "re"]:
+            # integrate the intensity and the squared intensity in a single pass
+            sums, squares, weights = self._get_azimuthal_moments1d(npt=npt, **kwargs)
+            weights = weights + np.finfo(np.float32).eps
+            one_d_integration = sums / weights
+            integration_squared = squares / weights
+
         if method == "Omega":
-            one_d_integration = self.get_azimuthal_integral1d(
-                npt=npt, mean=True, **kwargs
-            )
             variance = (
                 (one_d_integration**2).mean(axis=navigation_axes)
                 / one_d_integration.mean(axis=navigation_axes) ** 2
             ) - 1
             if dqe is not None:
-                sum_points = self.get_azimuthal_integral1d(npt=npt, **kwargs).mean(
-                    axis=navigation_axes
-                )
+                sum_points = sums.mean(axis=navigation_axes)
                 variance = variance - ((sum_points**-1) * dqe)
 
         elif method == "r":
-            one_d_integration = self.get_azimuthal_integral1d(
-                npt=npt, mean=True, **kwargs
-            )
-            integration_squared = (self**2).get_azimuthal_integral1d(
-                mean=True, npt=npt, **kwargs
-            )
             # Full variance is the same as the unshifted phi=0 term in angular correlation
             full_variance = (integration_squared / one_d_integration**2) - 1
 
@@ -1616,29 +1781,22 @@ class Diffraction2D(CommonDiffraction, Signal2D):
                 return variance, full_variance
 
         elif method == "re":
-            one_d_integration = self.get_azimuthal_integral1d(
-                npt=npt, mean=True, **kwargs
-            ).mean(axis=navigation_axes)
-            integration_squared = (
-                (self**2)
-                .get_azimuthal_integral1d(npt=npt, mean=True, **kwargs)
-                .mean(axis=navigation_axes)
-            )
+            one_d_integration = one_d_integration.mean(axis=navigation_axes)
+            integration_squared = integration_squared.mean(axis=navigation_axes)
             variance = (integration_squared / one_d_integration**2) - 1
 
             if dqe is not None:
-                sum_int = self.get_azimuthal_integral1d(npt=npt, **kwargs).mean()
+                sum_int = sums.mean()
                 variance = variance - (sum_int**-1) * (1 / dqe)
 
         elif method == "VImage":
-            variance_image = (
-                (self**2).mean(axis=navigation_axes)
-                / self.mean(axis=navigation_axes) ** 2
-            ) - 1
+            # <I^2>/<I>^2 - 1 == Var(I)/<I>^2, calculated in a single pass
+            count, mean_image, m2_image = self._get_navigation_moments(navigation_axes)
+            variance_image = (m2_image / count) / mean_image**2
             if dqe is not None:
-                variance_image = variance_image - (
-                    self.sum(axis=navigation_axes) ** -1
-                ) * (1 / dqe)
+                variance_image = variance_image - ((mean_image * count) ** -1) * (
+                    1 / dqe
+                )
             variance = variance_image.get_azimuthal_integral1d(
                 npt=npt, mean=True, **kwargs
             )
@@ -1646,12 +1804,160 @@ class Diffraction2D(CommonDiffraction, Signal2D):
 
     """ Methods associated with radial integration """
 
+    def _integrate_csr(
+        self,
+        matrix,
+        output_shape,
+        mask=None,
+        mean=False,
+        inplace=False,
+        masked_normalization=True,
+        lazy_output=None,
+        num_workers=None,
+        show_progressbar=None,
+    ):
+        """Integrate every chunk of the signal by multiplying it with the sparse
+        integration matrix.
+
+        Parameters
+        ----------
+        matrix : scipy.sparse.csr_matrix
+            The integration matrix with shape (bins, pixels)
+        output_shape : tuple
+            The signal shape of the output in array order
+        mask : None or np.ndarray
+            A static boolean mask. The masked pixels are removed from the matrix.
+        mean : bool
+            If True the mean of each bin is returned rather than the sum
+        inplace : bool
+            If the signal is overwritten or copied to a new signal
+        masked_normalization : bool
+            If True the masked pixels are excluded when normalizing the mean
+        """
+        if isinstance(mask, BaseSignal):
+            raise ValueError(
+                "The 'csr' method only supports a static mask. Use method='numba' "
+                "for a navigation dependent mask."
+            )
+        unmasked_matrix = matrix
+        if mask is not None:
+            matrix = _mask_csr_matrix(matrix, mask)
+        normalization = None
+        if mean:
+            if masked_normalization:
+                normalization = (
+                    np.finfo(np.float32).eps + np.asarray(matrix.sum(axis=1)).ravel()
+                )
+            else:
+                normalization = np.asarray(unmasked_matrix.sum(axis=1)).ravel()
+        return self._blockwise(
+            _integrate_csr,
+            matrix=matrix,
+            output_shape=output_shape,
+            normalization=normalization,
+            signal_shape=tuple(output_shape),
+            dtype=float,
+            inplace=inplace,
+            lazy_output=lazy_output,
+            num_workers=num_workers,
+        )
+
+    def _get_azimuthal_moments1d(
+        self,
+        npt,
+        mask=None,
+        radial_range=None,
+        method="numba",
+        **kwargs,
+    ):
+        """Integrate the sum, the sum of squares and the pixel weight for each radial
+        bin while only reading each diffraction pattern once.
+
+        Parameters
+        ----------
+        npt : int
+            The number of radial points to calculate
+        mask :  boolean array or BaseSignal
+            A boolean mask to apply to the data to exclude some points.
+            If mask is a BaseSignal then it is iterated over as well.
+        radial_range : None or (float, float)
+            The radial range over which to perform the integration. Default is
+            the full frame
+        method : "numba" or "csr"
+            See :meth:`get_azimuthal_integral1d`
+        **kwargs : dict
+            Passed to :meth:`hyperspy.api.signals.BaseSignal.map`
+
+        Returns
+        -------
+        sums, squares, weights : Diffraction1D
+            The integrated intensity, squared intensity and (unmasked) pixel weight.
+            The mean is ``sums / weights`` and the mean of the squared intensity is
+            ``squares / weights``.
+        """
+        indexes, facts, factor_slices, radial_range = self.calibration.get_slices1d(
+            npt, radial_range=radial_range
+        )
+        if mask is None:
+            mask = self.calibration.mask
+        if method == "csr":
+            if isinstance(mask, BaseSignal):
+                raise ValueError(
+                    "The 'csr' method only supports a static mask. Use "
+                    "method='numba' for a navigation dependent mask."
+                )
+            matrix = _get_csr_matrix1d(
+                indexes, facts, factor_slices, self.calibration.shape
+            )
+            if mask is not None:
+                matrix = _mask_csr_matrix(matrix, mask)
+            kwargs.pop("show_progressbar", None)
+            moments = self._blockwise(
+                _integrate_csr_moments,
+                matrix=matrix,
+                signal_shape=(3, npt),
+                dtype=float,
+                **kwargs,
+            )
+        elif method == "numba":
+            if not isinstance(mask, BaseSignal):
+                facts, _ = _mask_factors1d(indexes, facts, factor_slices, mask)
+                mask = None
+            moments = self.map(
+                _slice_radial_integrate1d_moments,
+                indexes=indexes,
+                factors=facts,
+                factor_slices=factor_slices,
+                mask=mask,
+                inplace=False,
+                output_dtype=float,
+                output_signal_size=(3, npt),
+                **kwargs,
+            )
+        else:
+            raise ValueError(f"Method {method} must be one of ['numba', 'csr']")
+        signals = []
+        for i in range(3):
+            s = moments.isig[:, i]
+            s.set_signal_type("diffraction")
+            ax = UniformDataAxis(
+                name="Radius",
+                units=self.axes_manager.signal_axes[0].units,
+                size=npt,
+                scale=(radial_range[1] - radial_range[0]) / npt,
+                offset=radial_range[0],
+            )
+            s.axes_manager.set_axis(ax, -1)
+            signals.append(s)
+        return tuple(signals)
+
     def get_azimuthal_integral1d(
         self,
         npt,
         mask=None,
         radial_range=None,
         inplace=False,
+        method="numba",
         **kwargs,
     ):
         """Creates a polar reprojection using pyFAI's azimuthal integrate 2d. This method is designed
@@ -1674,6 +1980,12 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             from -pi to pi
         inplace : bool
             If the signal is overwritten or copied to a new signal
+        method : "numba" or "csr"
+            If "numba" each pattern is integrated separately using a numba
+            function. If "csr" the integration is described by a sparse CSR matrix
+            and each chunk of patterns is integrated with a single sparse matrix
+            multiplication. This is faster for large datasets but only supports a
+            static mask.
 
 
         Other Parameters
@@ -1714,24 +2026,46 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         --------
         pyxem.signals.Diffraction2D.get_azimuthal_integral2d
         """
-        # get_slices1d should be sped up in the future by
-        # getting rid of shapely and using numba on the for loop
         indexes, facts, factor_slices, radial_range = self.calibration.get_slices1d(
             npt, radial_range=radial_range
         )
         if mask is None:
             mask = self.calibration.mask
-        integration = self.map(
-            _slice_radial_integrate1d,
-            indexes=indexes,
-            factors=facts,
-            factor_slices=factor_slices,
-            inplace=inplace,
-            mask=mask,
-            output_dtype=float,
-            output_signal_size=(npt,),
-            **kwargs,
-        )
+        if method == "csr":
+            matrix = _get_csr_matrix1d(
+                indexes, facts, factor_slices, self.calibration.shape
+            )
+            integration = self._integrate_csr(
+                matrix,
+                output_shape=(npt,),
+                mask=mask,
+                inplace=inplace,
+                masked_normalization=True,
+                **kwargs,
+            )
+        elif method == "numba":
+            normalization = None
+            if not isinstance(mask, BaseSignal):
+                # fold a static mask into the factors once rather than masking
+                # every pattern
+                facts, normalization = _mask_factors1d(
+                    indexes, facts, factor_slices, mask, kwargs.get("mean", False)
+                )
+                mask = None
+            integration = self.map(
+                _slice_radial_integrate1d,
+                indexes=indexes,
+                factors=facts,
+                factor_slices=factor_slices,
+                inplace=inplace,
+                mask=mask,
+                normalization=normalization,
+                output_dtype=float,
+                output_signal_size=(npt,),
+                **kwargs,
+            )
+        else:
+            raise ValueError(f"Method {method} must be one of ['numba', 'csr']")
         s = self if inplace else integration
         ax = UniformDataAxis(
             name="Radius",
@@ -1752,6 +2086,7 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         radial_range=None,
         azimuth_range=None,
         inplace=False,
+        method="numba",
         **kwargs,
     ):
         """Creates a polar reprojection using pyFAI's azimuthal integrate 2d. This method is designed
@@ -1776,6 +2111,12 @@ class Diffraction2D(CommonDiffraction, Signal2D):
             from -pi to pi
         inplace: bool
             If the signal is overwritten or copied to a new signal
+        method: "numba" or "csr"
+            If "numba" each pattern is integrated separately using a numba
+            function. If "csr" the integration is described by a sparse CSR matrix
+            and each chunk of patterns is integrated with a single sparse matrix
+            multiplication. This is faster for large datasets but only supports a
+            static mask. Ignored for data on the GPU.
         sum: bool
             If true the radial integration is returned rather then the Azimuthal Integration.
         correctSolidAngle: bool
@@ -1827,8 +2168,6 @@ class Diffraction2D(CommonDiffraction, Signal2D):
         if azimuth_range is None:
             azimuth_range = (-np.pi, np.pi)
 
-        # get_slices2d should be sped up in the future by
-        # getting rid of shapely and using numba on the for loop
         slices, factors, factors_slice, radial_range = self.calibration.get_slices2d(
             npt,
             npt_azim,
@@ -1856,9 +2195,31 @@ class Diffraction2D(CommonDiffraction, Signal2D):
                 dtype=float,
                 **kwargs,
             )
-        else:
+        elif method == "csr":
+            if mask is None:
+                mask = self.calibration.mask
+            matrix = _get_csr_matrix2d(
+                slices, factors, factors_slice, self.calibration.shape
+            )
+            integration = self._integrate_csr(
+                matrix,
+                output_shape=(npt, npt_azim),
+                mask=mask,
+                inplace=inplace,
+                masked_normalization=False,
+                **kwargs,
+            )
+        elif method == "numba":
             if mask is None:
                 mask = self.calibration.mask
+            normalization = None
+            if not isinstance(mask, BaseSignal):
+                # fold a static mask into the factors once rather than masking
+                # every pattern
+                factors, normalization = _mask_factors2d(
+                    slices, factors, factors_slice, mask, kwargs.get("mean", False)
+                )
+                mask = None
             integration = self.map(
                 _slice_radial_integrate,
                 slices=slices,
@@ -1870,8 +2231,11 @@ class Diffraction2D(CommonDiffraction, Signal2D):
                 output_dtype=float,  # upcast to float (maybe we should force conversion)
                 output_signal_size=(npt, npt_azim),
                 mask=mask,
+                normalization=normalization,
                 **kwargs,
             )
+        else:
+            raise ValueError(f"Method {method} must be one of ['numba', 'csr']")
 
         s = self if inplace else integration
         s.set_signal_type("polar_diffraction")
@@ -23,6 +23,7 @@ import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 from scipy.spatial import distance_matrix
+import dask
 import dask.array as da
 
 from hyperspy.signals import BaseSignal, Signal1D
@@ -45,11 +46,17 @@ from pyxem.utils.vectors import (
 )
 
 from pyxem.utils._slicers import Slicer
+from pyxem.utils._cluster_tools import _cluster_tiled, _get_tile_overlap
+from pyxem.utils._ragged_vectors import (
+    RaggedVectors,
+    _flatten_vectors,
+)
 
 from pyxem.utils._subpixel_finding import (
     _conventional_xc_map,
     _center_of_mass_map,
     _get_simulated_disc,
+    _subpixel_refine_chunk,
     _wrap_columns,
 )
 
@@ -262,15 +269,22 @@ class DiffractionVectors(BaseSignal):
             column_names = list(column_names) + ["intensity"]
             units = list(units) + ["a.u."]
 
-        vectors = peaks.map(
-            lambda x, cen, cal: (x + cen) * cal,
-            cal=calibration,
-            cen=center,
-            inplace=False,
-            ragged=True,
-            output_signal_size=(),
-            output_dtype=object,
-        )
+        if peaks.ragged and not isinstance(peaks, LazySignal):
+            store = RaggedVectors.from_object_array(peaks.data)
+            store = store.with_vectors(
+                (store.vectors + center) * calibration, squeeze=store.squeeze
+            )
+            vectors = peaks._deepcopy_with_new_data(store.to_object_array())
+        else:
+            vectors = peaks.map(
+                lambda x, cen, cal: (x + cen) * cal,
+                cal=calibration,
+                cen=center,
+                inplace=False,
+                ragged=True,
+                output_signal_size=(),
+                output_dtype=object,
+            )
         vectors.set_signal_type("diffraction_vectors")
         if isinstance(peaks, LazySignal):
             vectors = vectors.as_lazy()
@@ -290,6 +304,7 @@ class DiffractionVectors(BaseSignal):
         upsample_factor=2,
         square_size=10,
         columns=None,
+        chunkwise=False,
         **kwargs,
     ):
         """
@@ -312,8 +327,15 @@ class DiffractionVectors(BaseSignal):
             The size of the square used for both the center-of-mass and cross-correlation methods.
         columns : list
             The columns for the pixels of interest. If None, the first two columns are used.
+        chunkwise : bool
+            If True, the vectors of all of the diffraction patterns in a chunk of the
+            signal are refined at once instead of pattern by pattern. The squares
+            around all of the vectors are cut out together and the center of mass or
+            cross-correlation is computed for the whole stack of squares. See
+            :ref:`chunkwise-processing`. Default False.
         kwargs : dict
-            Additional keyword arguments to be passed to the map method.
+            Additional keyword arguments to be passed to the map method. With
+            ``chunkwise=True`` only ``lazy_output`` and ``num_workers`` are used.
 
         Returns
         -------
@@ -347,25 +369,79 @@ class DiffractionVectors(BaseSignal):
             square_size=square_size,
             columns=columns,
         )
-        method_func = partial(_wrap_columns, f=funct, columns=columns)
-
-        _wrap_columns
-        refined_vectors = signal.map(
-            method_func,
-            vectors=pixels,
-            inplace=False,
-            ragged=True,
-            offsets=offsets,
-            scales=scales,
-            columns=columns,
-            **kwargs,
-        )
+        if chunkwise:
+            refined_vectors = self._subpixel_refine_chunkwise(
+                signal,
+                pixels,
+                f=funct,
+                offsets=offsets,
+                scales=scales,
+                columns=columns,
+                **kwargs,
+            )
+        else:
+            method_func = partial(_wrap_columns, f=funct, columns=columns)
+            refined_vectors = signal.map(
+                method_func,
+                vectors=pixels,
+                inplace=False,
+                ragged=True,
+                offsets=offsets,
+                scales=scales,
+                columns=columns,
+                **kwargs,
+            )
         refined_vectors.set_signal_type("diffraction_vectors")
         refined_vectors._set_up_vector(
             scales=self.scales, column_names=self.column_names
         )
         return refined_vectors
 
+    @staticmethod
+    def _subpixel_refine_chunkwise(
+        signal,
+        pixels,
+        lazy_output=None,
+        num_workers=None,
+        show_progressbar=None,
+        **kwargs,
+    ):
+        """Refine the vectors once per chunk of the signal, see :meth:`subpixel_refine`."""
+        if lazy_output is None:
+            lazy_output = signal._lazy
+        nav_dim = signal.axes_manager.navigation_dimension
+        patterns = da.asarray(signal.data)
+        # each block holds whole diffraction patterns
+        patterns = patterns.rechunk({nav_dim: -1, nav_dim + 1: -1})
+        nav_chunks = patterns.chunks[:nav_dim]
+        if isinstance(pixels.data, da.Array):
+            vectors = pixels.data.rechunk(nav_chunks)
+        else:
+            vectors = da.from_array(pixels.data, chunks=nav_chunks)
+        nav_index = tuple(range(nav_dim))
+        refined = da.blockwise(
+            _subpixel_refine_chunk,
+            nav_index,
+            patterns,
+            nav_index + (nav_dim, nav_dim + 1),
+            vectors,
+            nav_index,
+            concatenate=True,
+            dtype=object,
+            meta=np.empty((0,) * nav_dim, dtype=object),
+            **kwargs,
+        )
+        if not lazy_output:
+            refined = refined.compute(num_workers=num_workers)
+        refined_vectors = signal._deepcopy_with_new_data(refined)
+        refined_vectors.axes_manager.__init__(
+            signal.axes_manager._get_navigation_axes_dicts()
+        )
+        refined_vectors.axes_manager._ragged = True
+        refined_vectors._lazy = lazy_output
+        refined_vectors._assign_subclass()
+        return refined_vectors
+
     @property
     def pixel_vectors(self):
         return self.get_pixel_vectors()
@@ -416,6 +492,30 @@ class DiffractionVectors(BaseSignal):
         )
         return pixels
 
+    def to_ragged_vectors(self):
+        """Stack the vectors of all navigation positions in one array.
+
+        Returns
+        -------
+        pyxem.utils._ragged_vectors.RaggedVectors
+            The vectors as a (n_vectors, n_columns) array and the offsets of the
+            vectors of each flattened navigation position.
+        """
+        if not self.ragged:
+            raise ValueError("Only ragged vectors can be stacked.")
+        data = self.data.compute() if self._lazy else self.data
+        return RaggedVectors.from_object_array(data)
+
+    def _from_ragged_vectors(self, vectors):
+        """A copy of the signal with the vectors of ``vectors``."""
+        return self._deepcopy_with_new_data(vectors.to_object_array())
+
+    def _use_ragged_vectors(self, *args, **kwargs):
+        """Whether a method can operate on the stacked vectors instead of mapping
+        a function over the navigation positions. Lazy signals and calls with
+        arguments for map are mapped."""
+        return self.ragged and not self._lazy and not args and not kwargs
+
     @property
     def _is_object_dtype(self):
         try:
@@ -621,9 +721,8 @@ class DiffractionVectors(BaseSignal):
         self.metadata.VectorMetadata["detector_shape"] = value
 
     def _get_navigation_positions(self, flatten=False, real_units=True):
-        nav_indexes = np.array(
-            list(np.ndindex(self.axes_manager._navigation_shape_in_array))
-        )
+        shape = self.axes_manager._navigation_shape_in_array
+        nav_indexes = np.indices(shape).reshape(len(shape), -1).T
         if not real_units:
             scales = [1 for a in self.axes_manager.navigation_axes]
             offsets = [0 for a in self.axes_manager.navigation_axes]
@@ -631,21 +730,9 @@ class DiffractionVectors(BaseSignal):
             scales = [a.scale for a in self.axes_manager.navigation_axes[::-1]]
             offsets = [a.offset for a in self.axes_manager.navigation_axes[::-1]]
 
-        if flatten:
-            real_nav = np.array(
-                [
-                    np.array(ind) * scales + offsets
-                    for ind in np.array(list(nav_indexes))
-                ]
-            )
-        else:
-            real_nav = np.reshape(
-                [
-                    np.array(ind) * scales + offsets
-                    for ind in np.array(list(nav_indexes))
-                ],
-                self.axes_manager._navigation_shape_in_array + (-1,),
-            )
+        real_nav = nav_indexes * scales + offsets
+        if not flatten:
+            real_nav = np.reshape(real_nav, shape + (-1,))
         return real_nav
 
     @property
@@ -672,55 +759,42 @@ class DiffractionVectors(BaseSignal):
         real_units: bool
             If the navigation dimension should be flattened based on the pixel position
             or the real value as determined by the scale and offset.
+
+        Returns
+        -------
+        DiffractionVectors2D or LazyDiffractionVectors2D
+            The flattened vectors. For lazy signals the vectors are computed once
+            and flattened block by block, and the flattened blocks are kept in
+            memory as the number of vectors is only known once they are computed.
+            The flattened vectors are always floating point.
         """
-        from pyxem.signals.diffraction_vectors2d import DiffractionVectors2D
+        from pyxem.signals.diffraction_vectors2d import (
+            DiffractionVectors2D,
+            LazyDiffractionVectors2D,
+        )
 
         if self.axes_manager._navigation_shape_in_array == ():
             return self
 
         if self._is_object_dtype:
+            # the navigation columns are in the order of the navigation axes
             nav_positions = self._get_navigation_positions(
                 flatten=False, real_units=real_units
-            )
-            if self.num_columns == 1:
-                vectors = np.vstack(
-                    [
-                        np.hstack(
-                            [
-                                np.tile(
-                                    nav_positions[ind][::-1], (len(self.data[ind]), 1)
-                                ),
-                                self.data[ind][:, np.newaxis],
-                            ]
-                        )
-                        for ind in np.ndindex(
-                            self.axes_manager._navigation_shape_in_array
-                        )
-                    ]
-                )
+            )[..., ::-1]
+            if self._lazy:
+                vectors = _flatten_vectors_lazy(self.data, nav_positions)
             else:
-                vectors = np.vstack(
-                    [
-                        np.hstack(
-                            [
-                                np.tile(
-                                    nav_positions[ind][::-1], (len(self.data[ind]), 1)
-                                ),
-                                self.data[ind],
-                            ]
-                        )
-                        for ind in np.ndindex(
-                            self.axes_manager._navigation_shape_in_array
-                        )
-                    ]
-                )
+                vectors = _flatten_vectors(self.data, nav_positions)
         else:
             nav_positions = self._get_navigation_positions(
                 flatten=True, real_units=real_units
-            )
+            )[:, ::-1]
             navs = np.repeat(nav_positions, self.num_rows, axis=0)
             data = self.data.reshape((-1, self.num_columns))
-            vectors = np.vstack((navs, data))
+            if self._lazy:
+                vectors = da.hstack((da.from_array(navs), data))
+            else:
+                vectors = np.hstack((navs, data))
         if real_units:
             scales = [a.scale for a in self.axes_manager.navigation_axes]
             offsets = [a.offset for a in self.axes_manager.navigation_axes]
@@ -745,20 +819,32 @@ class DiffractionVectors(BaseSignal):
         column_offsets = np.append(column_offsets, offsets)
         column_scale = np.append(column_scale, scales)
 
+        # the number of columns of lazy vectors is taken from the flattened vectors
+        num_columns = vectors.shape[1] - len(self.axes_manager.navigation_axes)
+        vector_column_names = self.metadata.VectorMetadata["column_names"]
+        if vector_column_names is None:
+            vector_column_names = [None] * num_columns
         column_names = np.append(
-            [a.name for a in self.axes_manager.navigation_axes], self.column_names
+            [a.name for a in self.axes_manager.navigation_axes], vector_column_names
         )
 
+        vector_units = self.metadata.VectorMetadata["units"]
+        if vector_units is None:
+            vector_units = [None] * num_columns
         if real_units:
             units = np.append(
-                [a.units for a in self.axes_manager.navigation_axes], self.units
+                [a.units for a in self.axes_manager.navigation_axes], vector_units
             )
         else:
             units = np.append(
-                ["pixels"] * len(self.axes_manager.navigation_axes), self.units
+                ["pixels"] * len(self.axes_manager.navigation_axes), vector_units
             )
 
-        return DiffractionVectors2D(
+        if self._lazy:
+            signal_class = LazyDiffractionVectors2D
+        else:
+            signal_class = DiffractionVectors2D
+        return signal_class(
             vectors,
             column_offsets=column_offsets,
             column_scale=column_scale,
@@ -963,6 +1049,10 @@ class DiffractionVectors(BaseSignal):
         if columns is None:
             columns = [0, 1]
 
+        if self._use_ragged_vectors(*args, **kwargs):
+            vectors = self.to_ragged_vectors().get_magnitudes(columns)
+            return self._from_ragged_vectors(vectors)
+
         def get_magnitude(x):
             return np.linalg.norm(x[:, columns], axis=-1)
 
@@ -1014,6 +1104,11 @@ class DiffractionVectors(BaseSignal):
         column_scale_factors=None,
         min_vectors=None,
         remove_nan=True,
+        tile_size=None,
+        tile_overlap=None,
+        tile_columns=(0, 1),
+        scheduler="processes",
+        num_workers=None,
     ):
         """This method clusters a list of vectors both in reciprocal space and in real space.
         The output is a list of vectors with a "label" which defines the cluster that each vector
@@ -1032,6 +1127,26 @@ class DiffractionVectors(BaseSignal):
             vectors
         remove_nan: bool
             If True, vectors with NaN values are removed before clustering
+        tile_size: float or list, optional
+            If given, the vectors are bucketed into a grid of tiles of this size along
+            ``tile_columns``, which are clustered in parallel and then stitched
+            together. Only the vectors of the tiles being clustered need to fit in
+            memory, which makes it possible to cluster the flattened vectors of large
+            datasets, see :meth:`flatten_diffraction_vectors`. The clusters are
+            numbered from 0.
+        tile_overlap: float or list, optional
+            The width by which each tile is extended on all sides, in the units of
+            ``tile_columns``. Clusters of different tiles which share a core vector in
+            the overlap are joined. By default twice the ``eps`` of the method
+            (e.g. DBSCAN), scaled by the ``column_scale_factors``, for which the tiled
+            clustering is the same as clustering all vectors at once.
+        tile_columns: tuple
+            The columns along which the vectors are tiled. By default the first two
+            columns, which are the navigation positions of flattened vectors.
+        scheduler: str
+            The dask scheduler used to cluster the tiles.
+        num_workers: int, optional
+            The number of workers used to cluster the tiles.
         """
         if column_scale_factors is None:
             column_scale_factors = [
@@ -1040,6 +1155,25 @@ class DiffractionVectors(BaseSignal):
         if columns is None:
             columns = list(range(self.data.shape[-1]))
 
+        if tile_size is not None:
+            if self.ragged or self.axes_manager.navigation_dimension > 0:
+                raise ValueError(
+                    "Clustering in tiles is only supported for a list of vectors, "
+                    "see `flatten_diffraction_vectors`."
+                )
+            return self._cluster_tiled(
+                method,
+                columns=columns,
+                column_scale_factors=column_scale_factors,
+                min_vectors=min_vectors,
+                remove_nan=remove_nan,
+                tile_size=tile_size,
+                tile_overlap=tile_overlap,
+                tile_columns=tile_columns,
+                scheduler=scheduler,
+                num_workers=num_workers,
+            )
+
         if self.ragged:
             signal_shape = ()
             dtype = object
@@ -1067,6 +1201,59 @@ class DiffractionVectors(BaseSignal):
 
         return new_signal
 
+    def _cluster_tiled(
+        self,
+        method,
+        columns,
+        column_scale_factors,
+        min_vectors,
+        remove_nan,
+        tile_size,
+        tile_overlap,
+        tile_columns,
+        scheduler,
+        num_workers,
+    ):
+        """Cluster a list of vectors in tiles, see :meth:`cluster`."""
+        data = self.data
+        if remove_nan:
+            is_number = ~np.isnan(data[:, columns]).any(axis=1)
+            if self._lazy:
+                is_number = is_number.compute()
+            data = data[is_number]
+        positions = data[:, list(tile_columns)]
+        if self._lazy:
+            positions = positions.compute()
+        if tile_overlap is None:
+            tile_overlap = _get_tile_overlap(
+                method, data.shape[1], columns, column_scale_factors, tile_columns
+            )
+        vectors = data[:, columns] / np.array(column_scale_factors)
+        labels = _cluster_tiled(
+            positions,
+            vectors,
+            method,
+            tile_size,
+            tile_overlap,
+            scheduler=scheduler,
+            num_workers=num_workers,
+        )
+        if min_vectors is not None:
+            label, counts = np.unique(labels, return_counts=True)
+            below_min_v = label[counts < min_vectors]
+            labels[np.isin(labels, below_min_v)] = -1
+        if self._lazy:
+            labels = da.from_array(labels[:, np.newaxis], chunks=(data.chunks[0], 1))
+            vectors_and_labels = da.hstack([data, labels])
+        else:
+            vectors_and_labels = np.hstack([data, labels[:, np.newaxis]])
+        new_signal = self._deepcopy_with_new_data(vectors_and_labels)
+        new_signal.get_dimensions_from_data()
+        new_signal.column_names = np.append(self.column_names, ["cluster"])
+        new_signal.units = np.append(self.units, ["n.a."])
+        new_signal.set_signal_type("labeled_diffraction_vectors")
+        return new_signal
+
     @property
     def has_navigation_axis(self):
         return False
@@ -1140,6 +1327,12 @@ class DiffractionVectors(BaseSignal):
             Diffraction vectors within allowed magnitude tolerances.
         """
 
+        if self._use_ragged_vectors(*args, **kwargs):
+            vectors = self.to_ragged_vectors().filter_magnitude(
+                min_magnitude, max_magnitude
+            )
+            return self._from_ragged_vectors(vectors)
+
         if self.ragged:
             kwargs["output_signal_size"] = ()
             kwargs["output_dtype"] = object
@@ -1228,6 +1421,11 @@ class DiffractionVectors(BaseSignal):
             self.scales[1] * (self.detector_shape[1] / 2)
             - self.scales[1] * exclude_width
         )
+        if self._use_ragged_vectors(*args, **kwargs):
+            vectors = self.to_ragged_vectors().filter_detector_edge(
+                x_threshold, y_threshold
+            )
+            return self._from_ragged_vectors(vectors)
         filtered_vectors = self.map(
             filter_vectors_edge_ragged,
             x_threshold=x_threshold,
@@ -1256,13 +1454,17 @@ class DiffractionVectors(BaseSignal):
         polar_vectors : DiffractionVectors
             Diffraction vectors in polar coordinates.
         """
-        polar_vectors = self.map(
-            vectors_to_polar,
-            inplace=False,
-            ragged=self.ragged,
-            columns=columns,
-            **kwargs,
-        )
+        if self._use_ragged_vectors(**kwargs):
+            vectors = self.to_ragged_vectors().to_polar(columns)
+            polar_vectors = self._from_ragged_vectors(vectors)
+        else:
+            polar_vectors = self.map(
+                vectors_to_polar,
+                inplace=False,
+                ragged=self.ragged,
+                columns=columns,
+                **kwargs,
+            )
         polar_vectors.set_signal_type("polar_vectors")
         polar_vectors.column_names[0] = "r"
         polar_vectors.column_names[1] = "theta"
@@ -1383,5 +1585,31 @@ class DiffractionVectors(BaseSignal):
         )
 
 
+def _flatten_vectors_lazy(data, nav_positions):
+    """Flatten a dask array of vectors block by block, see
+    :func:`pyxem.utils._ragged_vectors._flatten_vectors`.
+
+    The number of vectors in each block is only known once the vectors are
+    computed. The flattened blocks are computed together and kept in memory, so
+    that the vectors (e.g. a lazy peak finding) are only computed once. The
+    number of columns is also taken from the computed blocks.
+    """
+    # blocks spanning all but the first axis keep the vectors in C order
+    data = data.rechunk({axis: -1 for axis in range(1, data.ndim)})
+    # the dtype of the vectors is unknown before they are computed
+    dtype = np.result_type(nav_positions, np.float64)
+    blocks = []
+    for block, slices in zip(
+        data.to_delayed().ravel(), da.core.slices_from_chunks(data.chunks)
+    ):
+        flattened = dask.delayed(_flatten_vectors)(
+            block, nav_positions[slices], dtype=dtype
+        )
+        shape = (np.nan, np.nan)
+        blocks.append(da.from_delayed(flattened, shape=shape, dtype=dtype))
+    blocks = dask.persist(*blocks)
+    return da.concatenate([block.compute_chunk_sizes() for block in blocks])
+
+
 class LazyDiffractionVectors(LazySignal, DiffractionVectors):
     pass
@@ -20,12 +20,13 @@
 import numpy as np
 from warnings import warn
 
-from scipy.spatial import distance_matrix
 from sklearn.cluster import DBSCAN
 
 from hyperspy.signals import Signal2D
+from hyperspy._signals.lazy import LazySignal
 from hyperspy.roi import CircleROI
 from pyxem.signals import DiffractionVectors
+from pyxem.utils._cluster_tools import _merge_close_vectors
 import hyperspy.api as hs
 
 
@@ -69,7 +70,7 @@ class DiffractionVectors2D(DiffractionVectors, Signal2D):
             'distance_comparison' checks the distance between vectors to
             determine if some should belong to the same unique vector,
             and if so, the unique vector is iteratively updated to the
-            average value.
+            average value. The close vectors are found with a KD-tree.
             'DBSCAN' relies on the DBSCAN [1] clustering algorithm, and
             uses the Eucledian distance metric.
         min_samples : int, optional
@@ -110,32 +111,9 @@ class DiffractionVectors2D(DiffractionVectors, Signal2D):
 
         elif method == "distance_comparison":
             unique_vectors, unique_counts = np.unique(data, axis=0, return_counts=True)
-
-            unique_peaks = np.array([[0, 0]])
-            unique_peaks_counts = np.array([0])
-
-            while unique_vectors.shape[0] > 0:
-                unique_vector = unique_vectors[0]
-                distances = distance_matrix(np.array([unique_vector]), unique_vectors)
-                indices = np.where(distances < distance_threshold)[1]
-
-                new_count = indices.size
-                new_unique_peak = np.array(
-                    [
-                        np.average(
-                            unique_vectors[indices],
-                            weights=unique_counts[indices],
-                            axis=0,
-                        )
-                    ]
-                )
-
-                unique_peaks = np.append(unique_peaks, new_unique_peak, axis=0)
-
-                unique_peaks_counts = np.append(unique_peaks_counts, new_count)
-                unique_vectors = np.delete(unique_vectors, indices, axis=0)
-                unique_counts = np.delete(unique_counts, indices, axis=0)
-            unique_peaks = np.delete(unique_peaks, [0], axis=0)
+            unique_peaks, _ = _merge_close_vectors(
+                unique_vectors, unique_counts, distance_threshold
+            )
 
         elif method == "DBSCAN":
             # All peaks are clustered by DBSCAN so that peaks within
@@ -266,3 +244,7 @@ class DiffractionVectors2D(DiffractionVectors, Signal2D):
             return rois, texts
         else:
             return rois
+
+
+class LazyDiffractionVectors2D(LazySignal, DiffractionVectors2D):
+    pass
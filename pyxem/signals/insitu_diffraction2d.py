@@ -326,12 +326,16 @@ class InSituDiffraction2D(Diffraction2D):
         g2kt: Signal2D or Correlation2D
             k resolved time correlation signal
         """
+        s_ = self
+        if self._lazy:
+            # Every k-point needs the full real space and time axes
+            s_ = self._rechunk_for("navigation")
         if time_axis != 2:
-            transposed_signal = self.roll_time_axis(time_axis).transpose(
+            transposed_signal = s_.roll_time_axis(time_axis).transpose(
                 navigation_axes=[0, 1]
             )
         else:
-            transposed_signal = self.transpose(navigation_axes=[0, 1])
+            transposed_signal = s_.transpose(navigation_axes=[0, 1])
 
         g2kt = transposed_signal.map(
             _g2_2d,
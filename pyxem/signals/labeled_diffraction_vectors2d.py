@@ -23,6 +23,7 @@ import matplotlib.pyplot as plt
 
 
 import hyperspy.api as hs
+from hyperspy._signals.lazy import LazySignal
 
 from pyxem.utils.vectors import (
     column_mean,
@@ -31,6 +32,7 @@ from pyxem.utils.vectors import (
     points_to_polygon,
 )
 from pyxem.utils.vectors import only_signal_axes
+from pyxem.utils._cluster_tools import _cluster_tiled, _get_tile_overlap
 
 
 class LabeledDiffractionVectors2D(DiffractionVectors2D):
@@ -178,7 +180,15 @@ class LabeledDiffractionVectors2D(DiffractionVectors2D):
 
     @only_signal_axes
     def cluster_labeled_vectors(
-        self, method, columns=None, preprocessing="mean", **kwargs
+        self,
+        method,
+        columns=None,
+        preprocessing="mean",
+        tile_size=None,
+        tile_overlap=None,
+        scheduler="processes",
+        num_workers=None,
+        **kwargs,
     ):
         """A function to cluster the labeled vectors in the dataset.
 
@@ -192,6 +202,19 @@ class LabeledDiffractionVectors2D(DiffractionVectors2D):
             The function to be applied to each label clustering. If 'mean', the mean of the
             vectors is used. If callable, the function is applied to each label and the result
             is used for clustering.
+        tile_size: float or list, optional
+            If given, the preprocessed labels are bucketed into a grid of tiles of this
+            size along their first two columns, which are clustered in parallel and
+            then stitched together, see :meth:`DiffractionVectors.cluster`.
+        tile_overlap: float or list, optional
+            The width by which each tile is extended on all sides. By default twice
+            the ``eps`` of the method.
+        scheduler: str
+            The dask scheduler used to cluster the tiles.
+        num_workers: int, optional
+            The number of workers used to cluster the tiles.
+        kwargs:
+            Passed to the preprocessing function.
         """
         if columns is None:
             columns = [0, 1]
@@ -211,8 +234,24 @@ class LabeledDiffractionVectors2D(DiffractionVectors2D):
         not_nan = np.logical_not(np.any(np.isnan(to_cluster_vectors), axis=1))
         num_labels = len(to_cluster_vectors)
         to_cluster_vectors = to_cluster_vectors[not_nan]
-        clustering = method.fit(to_cluster_vectors)
-        labels = clustering.labels_
+        if tile_size is None:
+            labels = method.fit(to_cluster_vectors).labels_
+        else:
+            tile_columns = [0, 1]
+            if tile_overlap is None:
+                n_columns = to_cluster_vectors.shape[1]
+                tile_overlap = _get_tile_overlap(
+                    method, n_columns, range(n_columns), [1] * n_columns, tile_columns
+                )
+            labels = _cluster_tiled(
+                to_cluster_vectors[:, tile_columns],
+                to_cluster_vectors,
+                method,
+                tile_size,
+                tile_overlap,
+                scheduler=scheduler,
+                num_workers=num_workers,
+            )
         initial_labels = self.data[:, -1].astype(int)
         # Replace the values with the original
         actual_labels = np.full(num_labels, -1)
@@ -266,3 +305,7 @@ class LabeledDiffractionVectors2D(DiffractionVectors2D):
             )
             return points, polygons
         return points
+
+
+class LazyLabeledDiffractionVectors2D(LazySignal, LabeledDiffractionVectors2D):
+    pass
@@ -17,16 +17,30 @@
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import numpy as np
 from hyperspy.signals import Signal2D
 from hyperspy._signals.lazy import LazySignal
 from numpy import rad2deg
 
+from dask.diagnostics import ProgressBar
+
 from pyxem.signals.common_diffraction import CommonDiffraction
 from pyxem.utils._correlations import _correlation, _power, _pearson_correlation
 from pyxem.utils._deprecated import deprecated
+from pyxem.utils._dask import _store_with_checkpoint
 from pyxem.utils.indexation_utils import (
     _mixed_matching_lib_to_polar,
+    _mixed_matching_lib_to_polar_chunk,
+    _hierarchical_matching_lib_to_polar_chunk,
+    _seeded_matching_lib_to_polar_chunk,
+    get_template_search_index,
+    _check_n_best_search_index,
+    _get_max_n,
+    _check_correlation_method,
+    _get_template_spectra,
     _get_integrated_polar_templates,
+    _get_array_fingerprint,
+    _get_simulation_fingerprint,
     _norm_rows,
 )
 
@@ -317,6 +331,15 @@ class PolarDiffraction2D(CommonDiffraction, Signal2D):
         frac_keep=0.1,
         n_best=1,
         normalize_templates=True,
+        chunkwise=True,
+        correlation="auto",
+        search="exhaustive",
+        n_coarse_best=3,
+        seed_step=4,
+        fallback_threshold=0.9,
+        template_bank=None,
+        precision=np.float64,
+        checkpoint=None,
         **kwargs,
     ):
         """Match the orientation with some simulated diffraction patterns using
@@ -334,9 +357,73 @@ class PolarDiffraction2D(CommonDiffraction, Signal2D):
         frac_keep : float
             The fraction of the best matching orientations to keep.
         n_best : int
-            The number of best matching orientations to keep.
+            The number of best matching orientations to keep. Must not be larger than
+            the number of templates kept by ``n_keep`` or ``frac_keep``.
         normalize_templates : bool
             Normalize the templates to the same intensity..
+        chunkwise : bool
+            If True (default), all of the diffraction patterns in a chunk are matched
+            at the same time: the fast template filter is a single matrix product and
+            the in-plane correlation loops over the templates outermost. If False,
+            every diffraction pattern is matched separately using
+            :meth:`~hyperspy.signal.BaseSignal.map`. Both give the same result. Data
+            on the GPU is always matched pattern by pattern.
+        correlation : str
+            How the in-plane correlation is computed when ``chunkwise=True``.
+            "direct" sums the shifted rows of the polar pattern for every template
+            spot. "fft" multiplies the Fourier transforms of the rings of the polar
+            pattern and of the templates along the azimuthal axis, which is faster
+            for templates with many spots and a fine azimuthal sampling. "auto"
+            chooses the cheaper of the two. All give the same result.
+        search : str
+            "exhaustive" (default) compares every pattern to all of the templates
+            passing the ``n_keep`` or ``frac_keep`` filter. "hierarchical" first
+            compares the patterns to a coarse subset of the templates, with the
+            ``n_keep`` or ``frac_keep`` filter applied to the coarse templates, and
+            then only to the templates in the neighbourhood of the ``n_coarse_best``
+            best coarse templates. The neighbourhoods are given by
+            :func:`pyxem.utils.indexation_utils.get_template_search_index`, which is
+            built once and stored with the simulation. This is much faster for large
+            template libraries, but might miss the best template if the coarse
+            search fails. Requires ``chunkwise=True``.
+            "seeded" uses the full search for a sparse grid of seed positions with a
+            spacing of ``seed_step``. The other positions are only compared to the
+            templates in the neighbourhoods of the best templates of the surrounding
+            seeds, in the same chunk. When the best correlation of a position is less
+            than ``fallback_threshold`` times the best correlation of the surrounding
+            seeds, the full search is used. How each pattern was matched is stored
+            in ``orientation.metadata.search_type``: 0 for a seed, 1 for the seeded
+            search and 2 for a fallback to the full search. Requires
+            ``chunkwise=True``.
+        n_coarse_best : int
+            The number of coarse templates whose neighbourhoods are searched when
+            ``search="hierarchical"``.
+        seed_step : int
+            The spacing of the seed positions along each navigation axis when
+            ``search="seeded"``.
+        fallback_threshold : float
+            The fraction of the correlation of the surrounding seeds below which the
+            full search is used when ``search="seeded"``.
+        template_bank : PolarTemplateBank, optional
+            The templates of ``simulation`` prepared for the polar grid of this
+            signal, see :class:`pyxem.utils.indexation_utils.PolarTemplateBank`.
+            This skips building the polar templates, which is useful when mapping
+            several datasets with the same library. A ValueError is raised if the
+            bank was built from a different simulation or polar grid, or with a
+            different ``normalize_templates``.
+        precision : np.float32 or np.float64
+            The floating point type of the polar patterns, the templates and the
+            correlations during the matching. Single precision halves the memory
+            traffic of the matching and usually gives the same best templates, but
+            the correlations differ by rounding errors. The returned orientation map
+            is always double precision.
+        checkpoint : str or pathlib.Path, optional
+            A zarr directory to which the result of each chunk is written as soon
+            as it is computed. If the mapping is interrupted, calling this method
+            again with the same ``checkpoint`` only matches the chunks which are not
+            done yet. The returned orientation map is lazy and reads the results
+            from the store. A ValueError is raised if the store was written with
+            a different simulation, polar grid or parameters.
         kwargs : dict
             Any additional options for the :meth:`~hyperspy.signal.BaseSignal.map` function.
         Returns
@@ -363,22 +450,86 @@ class PolarDiffraction2D(CommonDiffraction, Signal2D):
             .. bibliography::
 
         """
-        (
-            r_templates,
-            theta_templates,
-            intensities_templates,
-        ) = simulation.polar_flatten_simulations(
-            radial_axes=self.axes_manager.signal_axes[1].axis,
-            azimuthal_axes=self.axes_manager.signal_axes[0].axis,
-        )
-        radius = self.axes_manager.signal_axes[1].size  # number radial pixels
-        integrated_templates = _get_integrated_polar_templates(
-            radius, r_templates, intensities_templates, normalize_templates
-        )
-        if normalize_templates:
-            intensities_templates = _norm_rows(intensities_templates)
-        orientation = self.map(
-            _mixed_matching_lib_to_polar,
+        if template_bank is not None:
+            template_bank.check_simulation(simulation, normalize_templates)
+            template_bank.check_axes(
+                self.axes_manager.signal_axes[1].axis,
+                self.axes_manager.signal_axes[0].axis,
+            )
+            r_templates = template_bank.r_templates
+            theta_templates = template_bank.theta_templates
+            intensities_templates = template_bank.intensities_templates
+            integrated_templates = template_bank.integrated_templates
+        else:
+            (
+                r_templates,
+                theta_templates,
+                intensities_templates,
+            ) = simulation.polar_flatten_simulations(
+                radial_axes=self.axes_manager.signal_axes[1].axis,
+                azimuthal_axes=self.axes_manager.signal_axes[0].axis,
+            )
+            radius = self.axes_manager.signal_axes[1].size  # number radial pixels
+            integrated_templates = _get_integrated_polar_templates(
+                radius, r_templates, intensities_templates, normalize_templates
+            )
+            if normalize_templates:
+                intensities_templates = _norm_rows(intensities_templates)
+        integrated_templates = integrated_templates.astype(precision, copy=False)
+        intensities_templates = intensities_templates.astype(precision, copy=False)
+        kwargs["precision"] = precision
+        if search != "hierarchical":
+            n_kept = _get_max_n(r_templates.shape[0], n_keep, frac_keep)
+            if n_best > n_kept:
+                raise ValueError(
+                    f"n_best ({n_best}) is larger than the number of templates kept "
+                    f"by n_keep or frac_keep ({n_kept})."
+                )
+        chunkwise = chunkwise and not self._gpu
+        if chunkwise:
+            # the FFT of the templates is computed once for all chunks
+            n_shifts = self.axes_manager.signal_axes[0].size
+            correlation = _check_correlation_method(correlation, r_templates, n_shifts)
+            if correlation == "fft":
+                kwargs["template_spectra"] = _get_template_spectra(
+                    r_templates, theta_templates, intensities_templates, n_shifts
+                )
+        n_columns = 4
+        if search not in ("exhaustive", "hierarchical", "seeded"):
+            raise ValueError(
+                "search must be 'exhaustive', 'hierarchical' or 'seeded', "
+                f"not '{search}'"
+            )
+        if search != "exhaustive":
+            if not chunkwise:
+                raise ValueError(
+                    f"The {search} search requires `chunkwise=True` and data "
+                    "on the CPU"
+                )
+            mapping = self._map_chunkwise
+            kwargs["correlation"] = correlation
+            kwargs["search_index"] = get_template_search_index(simulation)
+            _check_n_best_search_index(n_best, kwargs["search_index"])
+        if search == "hierarchical":
+            matching_function = _hierarchical_matching_lib_to_polar_chunk
+            kwargs["n_coarse_best"] = n_coarse_best
+        elif search == "seeded":
+            matching_function = _seeded_matching_lib_to_polar_chunk
+            kwargs["seed_step"] = seed_step
+            kwargs["fallback_threshold"] = fallback_threshold
+            # the last column is how each pattern was matched
+            n_columns = 5
+        elif chunkwise:
+            mapping = self._map_chunkwise
+            matching_function = _mixed_matching_lib_to_polar_chunk
+            kwargs["correlation"] = correlation
+        else:
+            mapping = self.map
+            matching_function = _mixed_matching_lib_to_polar
+        if checkpoint is not None:
+            kwargs["lazy_output"] = True
+        orientation = mapping(
+            matching_function,
             integrated_templates=integrated_templates,
             r_templates=r_templates,
             theta_templates=theta_templates,
@@ -388,24 +539,55 @@ class PolarDiffraction2D(CommonDiffraction, Signal2D):
             n_best=n_best,
             inplace=False,
             transpose=True,
-            output_signal_size=(n_best, 4),
+            output_signal_size=(n_best, n_columns),
             output_dtype=float,
             **kwargs,
         )
+        if checkpoint is not None:
+            signal_axes = self.axes_manager.signal_axes
+            attrs = dict(
+                simulation=_get_simulation_fingerprint(simulation).tobytes().hex(),
+                n_templates=r_templates.shape[0],
+                polar_grid=_get_array_fingerprint(
+                    signal_axes[1].axis, signal_axes[0].axis
+                ),
+                n_keep=n_keep,
+                frac_keep=frac_keep,
+                n_best=n_best,
+                normalize_templates=normalize_templates,
+                search=search,
+                n_coarse_best=n_coarse_best,
+                seed_step=seed_step,
+                fallback_threshold=fallback_threshold,
+                precision=np.dtype(precision).name,
+            )
+            with ProgressBar():
+                orientation.data = _store_with_checkpoint(
+                    orientation.data, checkpoint, attrs=attrs
+                )
+        if search == "seeded":
+            search_type = orientation.isig[4, 0].T
+            search_type.set_signal_type("")
+            search_type.metadata.General.title = "Search type"
+            orientation = orientation.isig[:4]
+            orientation.metadata.set_item("search_type", search_type)
 
         # Translate in-plane rotation from index to degrees
         # by using the calibration of the axis
         def rotation_index_to_degrees(data, axis):
             data = data.copy()
-            ind = data[:, 2].astype(int)
-            data[:, 2] = rad2deg(axis[ind])
+            ind = data[..., 2].astype(int)
+            data[..., 2] = rad2deg(axis[ind])
             return data
 
         orientation.axes_manager.signal_axes[0].name = "n-best"
         orientation.axes_manager.signal_axes[1].name = "columns"
 
-        orientation.map(
-            rotation_index_to_degrees, axis=self.axes_manager.signal_axes[0].axis
+        mapping = orientation._map_chunkwise if chunkwise else orientation.map
+        mapping(
+            rotation_index_to_degrees,
+            axis=self.axes_manager.signal_axes[0].axis,
+            inplace=True,
         )
 
         orientation.set_signal_type("orientation_map")
@@ -19,6 +19,7 @@
 import pytest
 import numpy as np
 
+from pyxem.common import VisibleDeprecationWarning
 from pyxem.generators import VarianceGenerator
 from pyxem.signals import ElectronDiffraction2D, DiffractionVariance2D, ImageVariance
 
@@ -265,8 +266,8 @@ class TestVarianceGenerator:
         assert np.allclose(vardps.data[1, 1], corr_var_dp, atol=1e-14, equal_nan=True)
 
     def test_set_data_type(self):
-        # set 8 bit data type which will result in an incorrect mean square
-        # pattern if not changed.
+        # 8 bit data would overflow if it was squared, the moments are calculated
+        # in float64 so setting the data type is not needed.
 
         dp_array = np.array(
             [
@@ -280,12 +281,13 @@ class TestVarianceGenerator:
 
         vardps_8 = vargen.get_diffraction_variance(dqe=1)
         assert isinstance(vardps_8, DiffractionVariance2D)
-        corr_var_dp_8 = np.array([[-0.08, -0.66857143], [-0.92213333, -0.88666667]])
+        corr_var_dp_8 = np.array([[-0.08, 0.16734694], [0.30666667, -0.0333333]])
         assert np.allclose(
             vardps_8.data[1, 1], corr_var_dp_8, atol=1e-6, equal_nan=True
         )
 
-        vardps_16 = vargen.get_diffraction_variance(dqe=1, set_data_type=np.uint16)
+        with pytest.warns(VisibleDeprecationWarning, match="set_data_type"):
+            vardps_16 = vargen.get_diffraction_variance(dqe=1, set_data_type=np.uint16)
         assert isinstance(vardps_16, DiffractionVariance2D)
         corr_var_dp_16 = np.array([[-0.08, 0.16734694], [0.30666667, -0.0333333]])
 
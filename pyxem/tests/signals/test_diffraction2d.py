@@ -16,8 +16,11 @@
 # You should have received a copy of the GNU General Public License
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
+import tracemalloc
+
 import pytest
 import numpy as np
+import dask
 import dask.array as da
 import hyperspy.api as hs
 from matplotlib import pyplot as plt
@@ -31,6 +34,7 @@ from pyxem.signals import (
     LazyDiffraction2D,
     PolarDiffraction2D,
     DiffractionVectors,
+    BeamShift,
 )
 from pyxem.data.dummy_data import make_diffraction_test_data as mdtd
 
@@ -250,6 +254,57 @@ class TestAzimuthalIntegral1d:
         assert s.axes_manager.shape == output_signal_shape
         assert s.data.shape == output_data_shape
 
+    @pytest.mark.parametrize("mean", [True, False])
+    @pytest.mark.parametrize("masked", [True, False])
+    def test_csr_method(self, mean, masked):
+        rng = np.random.default_rng(0)
+        s = Diffraction2D(rng.random((3, 4, 20, 16)))
+        s.calibration(scale=0.1, center=None)
+        mask = None
+        if masked:
+            mask = np.zeros((20, 16), dtype=bool)
+            mask[0:5, 0:5] = True
+        az = s.get_azimuthal_integral1d(npt=10, mean=mean, mask=mask)
+        az_csr = s.get_azimuthal_integral1d(npt=10, mean=mean, mask=mask, method="csr")
+        assert isinstance(az_csr, Diffraction1D)
+        assert az_csr.axes_manager.shape == az.axes_manager.shape
+        np.testing.assert_array_almost_equal(az.data, az_csr.data)
+
+    @pytest.mark.parametrize(
+        "shape", [(20, 16), (3, 20, 16), (4, 3, 20, 16), (6, 4, 3, 20, 16)]
+    )
+    def test_csr_method_lazy_shapes(self, shape):
+        chunks = [5] * len(shape)
+        s = LazyDiffraction2D(da.ones(shape, chunks=chunks))
+        npt = 10
+        s_a = s.get_azimuthal_integral1d(npt=npt, method="csr")
+        assert s_a._lazy
+        assert s_a.axes_manager.shape == s.axes_manager.shape[:-2] + (npt,)
+        s_a.compute()
+        assert s_a.data.shape == shape[:-2] + (npt,)
+
+    @pytest.mark.parametrize("mean", [True, False])
+    def test_static_mask_matches_signal_mask(self, mean):
+        rng = np.random.default_rng(0)
+        s = Diffraction2D(rng.random((3, 20, 16)))
+        s.calibration(scale=0.1, center=None)
+        mask = np.zeros((20, 16), dtype=bool)
+        mask[0:5, 0:8] = True
+        # a navigation dependent mask is applied to every pattern
+        mask_signal = Diffraction2D(np.broadcast_to(mask, (3, 20, 16)).copy())
+        az = s.get_azimuthal_integral1d(npt=10, mean=mean, mask=mask)
+        az_signal = s.get_azimuthal_integral1d(npt=10, mean=mean, mask=mask_signal)
+        np.testing.assert_array_almost_equal(az.data, az_signal.data)
+
+    def test_csr_method_signal_mask(self, ones):
+        mask = Diffraction2D(np.zeros((10, 10), dtype=bool))
+        with pytest.raises(ValueError):
+            ones.get_azimuthal_integral1d(npt=10, mask=mask, method="csr")
+
+    def test_wrong_method(self, ones):
+        with pytest.raises(ValueError):
+            ones.get_azimuthal_integral1d(npt=10, method="wrong")
+
 
 class TestVariance:
     @pytest.fixture
@@ -278,6 +333,39 @@ class TestVariance:
         ones_diff.calibration(scale=0.1, center=None)
         return ones_diff
 
+    @pytest.mark.parametrize("method", ["numba", "csr"])
+    def test_azimuthal_moments(self, bulls_eye_noisy, method):
+        sums, squares, weights = bulls_eye_noisy._get_azimuthal_moments1d(
+            npt=10, method=method
+        )
+        assert isinstance(sums, Diffraction1D)
+        assert sums.axes_manager.shape == (5, 5, 10)
+        integration = bulls_eye_noisy.get_azimuthal_integral1d(npt=10)
+        np.testing.assert_array_almost_equal(sums.data, integration.data)
+        squared = (bulls_eye_noisy**2).get_azimuthal_integral1d(npt=10)
+        np.testing.assert_array_almost_equal(squares.data, squared.data)
+        mean = bulls_eye_noisy.get_azimuthal_integral1d(npt=10, mean=True)
+        np.testing.assert_array_almost_equal(
+            (sums / (weights + np.finfo(np.float32).eps)).data, mean.data
+        )
+
+    @pytest.mark.parametrize("lazy", [True, False])
+    def test_FEM_VImage_single_pass(self, bulls_eye_noisy, lazy):
+        s = bulls_eye_noisy.as_lazy() if lazy else bulls_eye_noisy
+        variance = s.get_variance(npt=10, method="VImage", dqe=1)
+        data = bulls_eye_noisy.data.astype(float)
+        variance_image = (
+            (data**2).mean(axis=(0, 1)) / data.mean(axis=(0, 1)) ** 2
+            - 1
+            - 1 / data.sum(axis=(0, 1))
+        )
+        expected = Diffraction2D(variance_image)
+        expected.calibration(scale=0.1, center=None)
+        expected = expected.get_azimuthal_integral1d(npt=10, mean=True)
+        if lazy:
+            variance.compute()
+        np.testing.assert_array_almost_equal(variance.data, expected.data)
+
     def test_FEM_Omega(self, ones, ones_zeros):
         ones_variance = ones.get_variance(npt=5, method="Omega")
         # assert ones_variance.axes_manager[0].units == "2th_deg"
@@ -474,6 +562,42 @@ class TestAzimuthalIntegral2d:
         )
         assert np.allclose(quadrant.data[~np.isnan(quadrant.data)], expected_output)
 
+    @pytest.mark.parametrize("mean", [True, False])
+    @pytest.mark.parametrize("masked", [True, False])
+    def test_csr_method(self, ring, mean, masked):
+        ring.calibration(scale=1, center=None)
+        mask = None
+        if masked:
+            mask = np.zeros((100, 100), dtype=bool)
+            mask[40:60, 0:50] = True
+        s = hs.stack([ring, ring * 2])
+        az = s.get_azimuthal_integral2d(npt=40, npt_azim=100, mean=mean, mask=mask)
+        az_csr = s.get_azimuthal_integral2d(
+            npt=40, npt_azim=100, mean=mean, mask=mask, method="csr"
+        )
+        assert isinstance(az_csr, PolarDiffraction2D)
+        assert az_csr.axes_manager.shape == az.axes_manager.shape
+        np.testing.assert_array_almost_equal(az.data, az_csr.data)
+
+    @pytest.mark.parametrize("mean", [True, False])
+    def test_static_mask_matches_signal_mask(self, ring, mean):
+        ring.calibration(scale=1, center=None)
+        mask = np.zeros((100, 100), dtype=bool)
+        mask[40:60, 0:50] = True
+        s = hs.stack([ring, ring * 2])
+        mask_signal = Diffraction2D(np.stack([mask, mask]))
+        az = s.get_azimuthal_integral2d(npt=20, npt_azim=30, mean=mean, mask=mask)
+        az_signal = s.get_azimuthal_integral2d(
+            npt=20, npt_azim=30, mean=mean, mask=mask_signal
+        )
+        np.testing.assert_array_almost_equal(az.data, az_signal.data)
+
+    def test_csr_method_lazy_inplace(self, ring):
+        s = hs.stack([ring, ring * 2]).as_lazy()
+        s.get_azimuthal_integral2d(npt=20, npt_azim=30, method="csr", inplace=True)
+        assert s.data.shape == (2, 20, 30)
+        assert s._lazy
+
 
 class TestVirtualImaging:
     # Tests that virtual imaging runs without failure
@@ -673,6 +797,36 @@ class TestGetDirectBeamPosition:
         assert hasattr(s_shift.data, "compute")
         s_shift.compute()
 
+    @pytest.mark.parametrize(
+        "method,kwargs",
+        [
+            ("cross_correlate", {"radius_start": 0, "radius_finish": 2}),
+            ("blur", {"sigma": 1}),
+            ("interpolate", {"sigma": 1, "upsample_factor": 2, "kind": "nearest"}),
+            ("center_of_mass", {"mask": (10, 13, 10)}),
+            ("center_of_mass", {"threshold": 1}),
+        ],
+    )
+    @pytest.mark.parametrize("sig_slice", (None, (2, 18, 2, 24)))
+    def test_chunkwise(self, method, kwargs, sig_slice):
+        s = self.s
+        expected = s.get_direct_beam_position(
+            method=method, signal_slice=sig_slice, **kwargs
+        )
+        s_shift = s.get_direct_beam_position(
+            method=method, signal_slice=sig_slice, chunkwise=True, **kwargs
+        )
+        assert isinstance(s_shift, BeamShift)
+        np.testing.assert_allclose(s_shift.data, expected.data)
+
+    def test_chunkwise_non_uniform_chunks(self):
+        s = LazyDiffraction2D(da.from_array(self.s.data, chunks=(8, 7, 10, 12)))
+        s_shift = s.get_direct_beam_position(method="blur", sigma=1, chunkwise=True)
+        assert s_shift._lazy
+        s_shift.compute()
+        expected = self.s.get_direct_beam_position(method="blur", sigma=1)
+        np.testing.assert_allclose(s_shift.data, expected.data)
+
     def test_non_uniform_chunks(self):
         s = LazyDiffraction2D(da.from_array(self.s.data, chunks=(8, 7, 10, 12)))
         s_shift = s.get_direct_beam_position(method="blur", sigma=1, lazy_output=True)
@@ -1336,6 +1490,27 @@ class TestSubtractingDiffractionBackground:
         assert isinstance(subtracted, Diffraction2D)
         assert subtracted.data.shape == self.data.shape
 
+    @pytest.mark.parametrize("methods", method1)
+    @pytest.mark.parametrize("lazy", [False, True])
+    def test_chunkwise(self, methods, lazy):
+        if methods == "h-dome":
+            kwargs = {"h": 0.25}
+        elif methods == "radial median":
+            kwargs = {"center_x": 7, "center_y": 10}
+        else:
+            kwargs = {}
+        s = self.dp
+        if lazy:
+            s = LazyDiffraction2D(da.from_array(self.data, chunks=(2, 1, 20, 15)))
+        expected = self.dp.subtract_diffraction_background(method=methods, **kwargs)
+        subtracted = s.subtract_diffraction_background(
+            method=methods, chunkwise=True, **kwargs
+        )
+        assert subtracted._lazy == lazy
+        if lazy:
+            subtracted.compute()
+        np.testing.assert_allclose(subtracted.data, expected.data)
+
     def test_exception_not_implemented_method(self):
         s = Diffraction2D(np.zeros((2, 2, 10, 10)))
         with pytest.raises(NotImplementedError):
@@ -1626,3 +1801,139 @@ class TestBlockwise:
         assert new_s.data.shape == (2, 2)
         assert new_s.axes_manager.signal_shape == ()
         assert new_s.data[0, 0].shape == (3, 4)
+
+
+class TestChunkwise:
+    def setup_method(self):
+        rng = default_rng(0)
+        self.s = Diffraction2D(rng.random((4, 3, 16, 18)))
+
+    def test_gain_normalisation(self):
+        dark = np.full((16, 18), 0.1)
+        bright = np.linspace(1, 2, 16 * 18).reshape(16, 18)
+        expected = self.s.apply_gain_normalisation(dark, bright, inplace=False)
+        s_out = self.s.apply_gain_normalisation(
+            Diffraction2D(dark), Diffraction2D(bright), inplace=False, chunkwise=True
+        )
+        np.testing.assert_allclose(s_out.data, expected.data)
+
+    def test_gain_normalisation_navigation_reference(self):
+        with pytest.raises(ValueError):
+            self.s.apply_gain_normalisation(self.s, self.s, chunkwise=True)
+
+    @pytest.mark.parametrize("mask", [None, (8, 7, 5)])
+    def test_threshold_and_mask(self, mask):
+        expected = self.s.threshold_and_mask(threshold=1.2, mask=mask)
+        s_out = self.s.threshold_and_mask(threshold=1.2, mask=mask, chunkwise=True)
+        np.testing.assert_array_equal(s_out.data, expected.data)
+
+    @pytest.mark.parametrize("mask", [None, (8, 7, 5)])
+    def test_threshold_and_mask_negative_mean(self, mask):
+        # e.g. background subtracted data
+        s = self.s - 0.6
+        s.data[0, 0] -= 1
+        expected = s.threshold_and_mask(threshold=1.2, mask=mask)
+        s_out = s.threshold_and_mask(threshold=1.2, mask=mask, chunkwise=True)
+        np.testing.assert_array_equal(s_out.data, expected.data)
+
+    def test_center_direct_beam(self):
+        expected = self.s.center_direct_beam(method="blur", sigma=1, inplace=False)
+        s_out = self.s.center_direct_beam(
+            method="blur", sigma=1, inplace=False, chunkwise=True
+        )
+        np.testing.assert_allclose(s_out.data, expected.data)
+
+
+class TestMapInplace:
+    def setup_method(self):
+        rng = default_rng(0)
+        self.s = Diffraction2D((rng.random((6, 5, 32, 32)) * 1000).astype(np.uint16))
+        self.shift_x = rng.random((6, 5))
+        self.shift_y = rng.random((6, 5))
+
+    def test_shift_diffraction(self):
+        expected = self.s.shift_diffraction(
+            self.shift_x, self.shift_y, inplace=False, show_progressbar=False
+        )
+        data = self.s.data
+        self.s.shift_diffraction(
+            self.shift_x, self.shift_y, inplace=True, show_progressbar=False
+        )
+        assert self.s.data is data
+        np.testing.assert_array_equal(self.s.data, expected.data)
+
+    def test_shift_diffraction_processes_scheduler(self):
+        expected = self.s.shift_diffraction(
+            self.shift_x, self.shift_y, inplace=False, show_progressbar=False
+        )
+        # the chunks are written in place, so they must not be sent to other processes
+        with dask.config.set(scheduler="processes"):
+            self.s.shift_diffraction(
+                self.shift_x, self.shift_y, inplace=True, show_progressbar=False
+            )
+        np.testing.assert_array_equal(self.s.data, expected.data)
+
+    def test_rotate_diffraction(self):
+        expected = self.s.rotate_diffraction(13, show_progressbar=False)
+        data = self.s.data
+        assert self.s.rotate_diffraction(13, inplace=True) is None
+        assert self.s.data is data
+        np.testing.assert_array_equal(self.s.data, expected.data)
+
+    def test_rotate_diffraction_lazy(self):
+        s = self.s.as_lazy()
+        s.rotate_diffraction(13, inplace=True)
+        expected = self.s.rotate_diffraction(13, show_progressbar=False)
+        s.compute()
+        np.testing.assert_array_equal(s.data, expected.data)
+
+    @pytest.mark.parametrize("signal", [False, True])
+    def test_apply_affine_transformation(self, signal):
+        D = np.array([[1.02, 0.01, 0], [0, 0.98, 0], [0, 0, 1]])
+        if signal:
+            D = hs.signals.Signal2D(np.tile(D, (6, 5, 1, 1)))
+        expected = self.s.apply_affine_transformation(D, keep_dtype=True, inplace=False)
+        data = self.s.data
+        self.s.apply_affine_transformation(D, keep_dtype=True)
+        assert self.s.data is data
+        np.testing.assert_array_equal(self.s.data, expected.data)
+
+    def test_apply_affine_transformation_change_dtype(self):
+        D = np.array([[1.02, 0.01, 0], [0, 0.98, 0], [0, 0, 1]])
+        self.s.apply_affine_transformation(D, keep_dtype=False)
+        assert self.s.data.dtype == float
+
+    def test_correct_bad_pixels(self):
+        bad_pixels = np.zeros((32, 32), dtype=bool)
+        bad_pixels[5, 6] = True
+        expected = self.s.correct_bad_pixels(bad_pixels, inplace=False)
+        data = self.s.data
+        self.s.correct_bad_pixels(bad_pixels)
+        assert self.s.data is data
+        np.testing.assert_array_equal(self.s.data, expected.data)
+
+    def test_iterating_kwargs_wrong_shape(self):
+        with pytest.raises(ValueError):
+            self.s._map_inplace(
+                lambda x, y: x, iterating_kwargs={"y": np.zeros((2, 2))}
+            )
+
+    @pytest.mark.parametrize(
+        "method, args",
+        [
+            ("shift_diffraction", (1.5, 2)),
+            ("rotate_diffraction", (10,)),
+            ("correct_bad_pixels", (np.zeros((64, 64), dtype=bool),)),
+        ],
+    )
+    def test_peak_memory(self, method, args):
+        s = Diffraction2D(np.ones((40, 40, 64, 64), dtype=np.float32))
+        getattr(s, method)(*args, inplace=True, show_progressbar=False)
+        tracemalloc.start()
+        try:
+            getattr(s, method)(*args, inplace=True, show_progressbar=False)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # No full size temporary, only a few frames per worker
+        assert peak < 0.25 * s.data.nbytes
@@ -26,11 +26,18 @@ from hyperspy.signals import Signal2D
 from hyperspy.signal import BaseSignal
 
 
-from pyxem.signals import DiffractionVectors, DiffractionVectors2D
+from pyxem.signals import (
+    DiffractionVectors,
+    DiffractionVectors2D,
+    LazyDiffractionVectors2D,
+)
 from pyxem.utils._subpixel_finding import (
     _center_of_mass_hs,
+    _center_of_mass_squares,
     _get_experimental_square,
+    _get_experimental_squares,
     _conventional_xc,
+    _conventional_xc_squares,
 )
 from pyxem.data import tilt_boundary_data
 from hyperspy.axes import UniformDataAxis
@@ -376,6 +383,75 @@ class TestSubpixelRefinement:
         cen = _conventional_xc(sq, kernel, upsample_factor=1)
         assert np.allclose(np.array(cen), (-2.0, 0.0))
 
+    def test_batched_squares(self):
+        rng = np.random.default_rng(0)
+        dp = rng.random((2, 64, 64))
+        vectors = rng.integers(10, 54, (20, 2))
+        indexes = rng.integers(0, 2, 20)
+        squares = _get_experimental_squares(dp, vectors, 10, indexes=indexes)
+        assert squares.shape == (20, 11, 11)
+        kernel = disk2(radius=3)[:-1, :-1]
+        shifts = _conventional_xc_squares(squares, kernel, upsample_factor=2)
+        centers = _center_of_mass_squares(squares)
+        for i, (vector, index) in enumerate(zip(vectors, indexes)):
+            sq = _get_experimental_square(dp[index], vector, 10)
+            np.testing.assert_array_equal(squares[i], sq)
+            np.testing.assert_array_equal(
+                shifts[i], _conventional_xc(sq, kernel, upsample_factor=2)
+            )
+            np.testing.assert_allclose(centers[i], _center_of_mass_hs(sq.copy()))
+
+    def test_batched_squares_edges(self):
+        dp = np.random.default_rng(0).random((64, 64))
+        vectors = np.array([[62, 30], [30, 63], [1, 30], [0, 0], [63, 63]])
+        squares = _get_experimental_squares(dp, vectors, 10)
+        assert squares.shape == (5, 11, 11)
+        # the part of the square inside the pattern is kept, the rest is 0
+        np.testing.assert_array_equal(squares[0, :7], dp[57:, 25:36])
+        assert not squares[0, 7:].any()
+        np.testing.assert_array_equal(squares[1, :, :6], dp[25:36, 58:])
+        assert not squares[1, :, 6:].any()
+        np.testing.assert_array_equal(squares[2, 4:], dp[:7, 25:36])
+        assert not squares[2, :4].any()
+        np.testing.assert_array_equal(squares[3, 5:, 5:], dp[:6, :6])
+        assert not squares[3, :5].any() and not squares[3, :, :5].any()
+        np.testing.assert_array_equal(squares[4, :6, :6], dp[58:, 58:])
+        # the center of mass matches the truncated square at the far edges
+        centers = _center_of_mass_squares(squares[:2])
+        for vector, center in zip(vectors[:2], centers):
+            sq = _get_experimental_square(dp, vector, 10)
+            np.testing.assert_allclose(center, _center_of_mass_hs(sq.copy()))
+
+    @pytest.mark.parametrize("method", ("center-of-mass", "cross-correlation"))
+    @pytest.mark.parametrize("lazy", (False, True))
+    def test_subpixel_refinement_chunkwise(self, method, lazy):
+        import pyxem.data.dummy_data.make_diffraction_test_data as mdtd
+
+        di = mdtd.DiffractionTestImage(intensity_noise=False)
+        di.add_disk(x=128, y=128, intensity=10.0)
+        di.add_cubic_disks(vx=20, vy=20, intensity=2.0, n=5)
+        di.add_background_lorentz()
+        dtd = mdtd.DiffractionTestDataset(4, 5, 256, 256)
+        dtd.add_diffraction_image(di)
+        s = dtd.get_signal()
+        temp = s.template_match_disk(disk_r=5, subtract_min=False)
+        dv = temp.get_diffraction_vectors(
+            threshold_abs=0.4, min_distance=5, get_intensity=True
+        )
+        expected = dv.subpixel_refine(s, method=method, disk_r=5)
+        if lazy:
+            s = s.as_lazy()
+            s.rechunk(nav_chunks=(2, 3))
+        refined = dv.subpixel_refine(s, method=method, disk_r=5, chunkwise=True)
+        assert refined._lazy == lazy
+        if lazy:
+            refined.compute()
+        assert isinstance(refined, DiffractionVectors)
+        assert refined.axes_manager.navigation_shape == (5, 4)
+        assert refined.data.shape == expected.data.shape
+        for vectors, expected_vectors in zip(refined.data.flat, expected.data.flat):
+            np.testing.assert_allclose(vectors, expected_vectors)
+
     @pytest.mark.parametrize("intensity", (True, False))
     def test_subpixel_refinement_com(self, intensity):
         import pyxem.data.dummy_data.make_diffraction_test_data as mdtd
@@ -491,6 +567,77 @@ class TestConvertVectors:
         assert np.min(flat.data[:, 1]) == dv.axes_manager[1].offset
         assert np.min(flat.data[:, 2]) == dv.axes_manager[2].offset
 
+    @pytest.mark.parametrize("num_columns", (1, 3))
+    def test_flatten_vectors_values(self, num_columns):
+        rng = np.random.default_rng(0)
+        data = np.empty((3, 4), dtype=object)
+        for i in np.ndindex(data.shape):
+            vectors = rng.random((rng.integers(0, 5), num_columns))
+            data[i] = vectors[:, 0] if num_columns == 1 else vectors
+        dv = DiffractionVectors(data)
+        dv.axes_manager[0].scale = 2
+        dv.axes_manager[1].offset = 5
+        expected = np.vstack(
+            [
+                np.hstack(
+                    [
+                        np.tile([i[1] * 2, i[0] + 5], (len(data[i]), 1)),
+                        data[i].reshape(len(data[i]), num_columns),
+                    ]
+                )
+                for i in np.ndindex(data.shape)
+            ]
+        )
+        flat = dv.flatten_diffraction_vectors()
+        np.testing.assert_array_equal(flat.data, expected)
+        positions = dv._get_navigation_positions(flatten=True)[:, ::-1]
+        np.testing.assert_array_equal(
+            dv.to_ragged_vectors().flatten(positions), expected
+        )
+
+        lazy = dv.as_lazy()
+        lazy.data = lazy.data.rechunk((2, 3))
+        lazy_flat = lazy.flatten_diffraction_vectors()
+        assert isinstance(lazy_flat, LazyDiffractionVectors2D)
+        assert lazy_flat.data.numblocks == (2, 1)
+        lazy_flat.compute()
+        np.testing.assert_array_equal(lazy_flat.data, expected)
+
+    def test_flatten_vectors_lazy_computes_once(self):
+        rng = np.random.default_rng(0)
+        data = np.empty((4, 4), dtype=object)
+        for i in np.ndindex(data.shape):
+            data[i] = rng.random((rng.integers(0, 5), 2))
+        calls = []
+
+        def find_vectors(block):
+            calls.append(block.shape)
+            return block
+
+        lazy = DiffractionVectors(data).as_lazy()
+        lazy.data = lazy.data.rechunk((2, 4)).map_blocks(find_vectors, dtype=object)
+        calls.clear()
+        flat = lazy.flatten_diffraction_vectors()
+        flat.compute()
+        # the vectors of each block are only computed once
+        assert len(calls) == 2
+        expected = DiffractionVectors(data).flatten_diffraction_vectors()
+        np.testing.assert_array_equal(flat.data, expected.data)
+
+    @pytest.mark.parametrize("lazy", (False, True))
+    def test_flatten_vectors_not_ragged(self, lazy):
+        data = np.random.default_rng(0).random((3, 4, 5, 2))
+        dv = DiffractionVectors2D(data)
+        if lazy:
+            dv = dv.as_lazy()
+        flat = dv.flatten_diffraction_vectors(real_units=False)
+        if lazy:
+            flat.compute()
+        assert flat.data.shape == (60, 4)
+        np.testing.assert_array_equal(flat.data[:, 2:], data.reshape(-1, 2))
+        np.testing.assert_array_equal(flat.data[5:10, :2], [[1, 0]] * 5)
+        np.testing.assert_array_equal(flat.data[20:25, :2], [[0, 1]] * 5)
+
     def test_flatten_vectors_with_set_metadata(self, diffraction_vectors_map):
         diffraction_vectors_map.scales = [0.1, 0.1]
         diffraction_vectors_map.offsets = [1, 1]
@@ -828,3 +975,74 @@ class TestMask:
         mask = vectors.to_mask(disk_r=12)
         masked_s = s * ~mask
         assert np.max(masked_s.data) < 2
+
+
+class TestRaggedVectors:
+    @pytest.fixture()
+    def vectors(self):
+        rng = np.random.default_rng(0)
+        data = np.empty((3, 4), dtype=object)
+        for i in np.ndindex(data.shape):
+            data[i] = rng.uniform(-1, 1, (rng.integers(0, 6), 3))
+        data[1, 2] = np.empty((0, 3))
+        # vectors at the origin are removed by the filters
+        data[0, 0][0, :2] = 0
+        v = DiffractionVectors(data)
+        v.detector_shape = (20, 20)
+        v.scales = [0.1, 0.1, 1]
+        return v
+
+    def test_round_trip(self, vectors):
+        # empty positions can be 1D
+        vectors.data[1, 2] = np.empty(0)
+        stacked = vectors.to_ragged_vectors()
+        assert stacked.vectors.shape == (stacked.offsets[-1], 3)
+        np.testing.assert_array_equal(
+            stacked.counts, [len(v) for v in vectors.data.ravel()]
+        )
+        data = stacked.to_object_array()
+        assert data.shape == (3, 4)
+        for i in np.ndindex(data.shape):
+            np.testing.assert_array_equal(data[i], vectors.data[i].reshape(-1, 3))
+        magnitudes = stacked.get_magnitudes().to_object_array()
+        assert magnitudes[0, 0].ndim == 1
+        assert len(magnitudes[0, 0]) == len(vectors.data[0, 0])
+
+    def test_to_ragged_vectors_not_ragged(self):
+        with pytest.raises(ValueError, match="ragged"):
+            DiffractionVectors(np.ones((2, 3, 2))).to_ragged_vectors()
+
+    @pytest.mark.parametrize(
+        "method, args",
+        [
+            ("filter_magnitude", (0.5, 1.2)),
+            ("filter_detector_edge", (2,)),
+            ("get_magnitudes", ()),
+            ("to_polar", ()),
+        ],
+    )
+    def test_same_as_map(self, vectors, method, args):
+        result = getattr(vectors, method)(*args)
+        # lazy signals are mapped over the navigation positions
+        expected = getattr(vectors.as_lazy(), method)(*args)
+        expected.compute()
+        assert type(result) is type(expected)
+        assert result.ragged
+        assert result.column_names == expected.column_names
+        for i in np.ndindex(vectors.data.shape):
+            np.testing.assert_array_equal(result.data[i], expected.data[i])
+
+    def test_from_peaks_same_as_map(self):
+        rng = np.random.default_rng(0)
+        data = np.empty((2, 3), dtype=object)
+        for i in np.ndindex(data.shape):
+            data[i] = rng.integers(0, 100, (rng.integers(1, 6), 3))
+        peaks = BaseSignal(data, ragged=True)
+        dv = DiffractionVectors.from_peaks(peaks, center=(50, 40), calibration=0.1)
+        lazy = DiffractionVectors.from_peaks(
+            peaks.as_lazy(), center=(50, 40), calibration=0.1
+        )
+        lazy.compute()
+        assert dv.has_intensity
+        for i in np.ndindex(data.shape):
+            np.testing.assert_array_equal(dv.data[i], lazy.data[i])
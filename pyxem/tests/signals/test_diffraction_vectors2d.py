@@ -24,7 +24,11 @@ from sklearn.cluster import DBSCAN
 from hyperspy.signals import Signal2D, BaseSignal, Signal1D
 import hyperspy.api as hs
 
-from pyxem.signals import DiffractionVectors2D, DiffractionVectors1D
+from pyxem.signals import (
+    DiffractionVectors2D,
+    DiffractionVectors1D,
+    LabeledDiffractionVectors2D,
+)
 
 
 class TestDiffractionVectors2D:
@@ -90,6 +94,53 @@ class TestSingleDiffractionVectors2D:
         assert clustered.ivec["cluster"].data.shape[0] == 8
         assert isinstance(clustered, DiffractionVectors2D)
 
+    @pytest.mark.parametrize("lazy", (False, True))
+    def test_cluster_tiled(self, lazy):
+        rng = np.random.default_rng(0)
+        centers = rng.uniform(0, 20, (10, 4))
+        data = np.concatenate([c + rng.normal(0, 0.2, (20, 4)) for c in centers])
+        vectors = DiffractionVectors2D(data)
+        vectors.column_names = ["x", "y", "kx", "ky"]
+        if lazy:
+            vectors = vectors.as_lazy()
+            vectors.data = vectors.data.rechunk((50, 4))
+        clustered = vectors.cluster(
+            DBSCAN(eps=1, min_samples=3),
+            column_scale_factors=[1, 1, 0.5, 0.5],
+            tile_size=5,
+            scheduler="threads",
+        )
+        expected = vectors.cluster(
+            DBSCAN(eps=1, min_samples=3), column_scale_factors=[1, 1, 0.5, 0.5]
+        )
+        assert clustered._lazy == lazy
+        if lazy:
+            clustered.compute()
+            expected.compute()
+        assert isinstance(clustered, LabeledDiffractionVectors2D)
+        assert clustered.data.shape == (200, 5)
+        assert list(clustered.column_names) == ["x", "y", "kx", "ky", "cluster"]
+        np.testing.assert_array_equal(clustered.data[:, :4], expected.data[:, :4])
+        labels, expected_labels = clustered.data[:, 4], expected.data[:, 4]
+        np.testing.assert_array_equal(labels < 0, expected_labels < 0)
+        assert labels.max() == expected_labels.max()
+        pairs = np.unique(np.stack([labels, expected_labels]), axis=1)
+        assert pairs.shape[1] == len(np.unique(labels))
+
+    def test_cluster_tiled_remove_nan(self):
+        data = np.random.default_rng(0).uniform(0, 10, (50, 2))
+        data[3, 1] = np.nan
+        vectors = DiffractionVectors2D(data)
+        clustered = vectors.cluster(DBSCAN(eps=1), tile_size=5, scheduler="threads")
+        assert clustered.data.shape == (49, 3)
+        assert clustered.axes_manager.signal_axes[0].size == 3
+        assert not np.isnan(clustered.data).any()
+
+    def test_cluster_tiled_navigation_error(self):
+        vectors = DiffractionVectors2D(np.ones((2, 5, 4)))
+        with pytest.raises(ValueError, match="flatten_diffraction_vectors"):
+            vectors.cluster(DBSCAN(), tile_size=1)
+
     def test_slice(self):
         slic = self.vector.ivec[:, self.vector.ivec[1] > 0]
         assert slic.data.shape[0] == 5
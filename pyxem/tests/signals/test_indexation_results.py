@@ -34,7 +34,11 @@ from orix.vector import Vector3d
 
 from pyxem.generators import TemplateIndexationGenerator
 from pyxem.signals import VectorMatchingResults, DiffractionVectors, OrientationMap
-from pyxem.utils.indexation_utils import OrientationResult
+from pyxem.utils.indexation_utils import (
+    OrientationResult,
+    TemplateSearchIndex,
+    PolarTemplateBank,
+)
 from pyxem.data import (
     si_grains,
     si_phase,
@@ -258,6 +262,197 @@ class TestOrientationResult:
         orientations = polar.get_orientation(sims, n_best=3)
         return orientations
 
+    def test_chunkwise_same_as_map(self):
+        s = si_grains()
+        s.calibration.center = None
+        polar = s.get_azimuthal_integral2d(
+            npt=100, npt_azim=180, inplace=False, mean=True
+        )
+        phase = si_phase()
+        generator = SimulationGenerator(200, minimum_intensity=0.05)
+        rotations = get_sample_reduced_fundamental(
+            resolution=3, point_group=phase.point_group
+        )
+        sims = generator.calculate_diffraction2d(
+            phase,
+            rotation=rotations,
+            max_excitation_error=0.1,
+            reciprocal_radius=2,
+        )
+        expected = polar.get_orientation(sims, n_best=3, chunkwise=False)
+        orientations = polar.get_orientation(sims, n_best=3)
+        assert isinstance(orientations, OrientationMap)
+        np.testing.assert_array_equal(orientations.data, expected.data)
+        lazy_orientations = polar.as_lazy().get_orientation(sims, n_best=3)
+        lazy_orientations.compute()
+        np.testing.assert_array_equal(lazy_orientations.data, expected.data)
+        for chunkwise in (True, False):
+            with pytest.raises(ValueError, match="n_keep"):
+                polar.get_orientation(sims, n_best=5, n_keep=3, chunkwise=chunkwise)
+
+    def test_template_bank(self, tmp_path):
+        s = si_grains()
+        s.calibration.center = None
+        polar = s.get_azimuthal_integral2d(
+            npt=100, npt_azim=180, inplace=False, mean=True
+        )
+        phase = si_phase()
+        generator = SimulationGenerator(200, minimum_intensity=0.05)
+        rotations = get_sample_reduced_fundamental(
+            resolution=3, point_group=phase.point_group
+        )
+        sims = generator.calculate_diffraction2d(
+            phase,
+            rotation=rotations,
+            max_excitation_error=0.1,
+            reciprocal_radius=2,
+        )
+        bank = PolarTemplateBank.from_simulation(
+            sims,
+            polar.axes_manager.signal_axes[1].axis,
+            polar.axes_manager.signal_axes[0].axis,
+        )
+        bank.save(tmp_path / "bank.npz")
+        bank = PolarTemplateBank.load(tmp_path / "bank.npz")
+        expected = polar.get_orientation(sims, n_best=3)
+        orientations = polar.get_orientation(sims, n_best=3, template_bank=bank)
+        # equivalent templates have equal correlations, so with the float32
+        # intensities only the best template is the same
+        np.testing.assert_array_equal(
+            orientations.data[:, :, 0, 0], expected.data[:, :, 0, 0]
+        )
+        np.testing.assert_allclose(orientations.data[..., 1], expected.data[..., 1])
+        with pytest.raises(ValueError, match="radial"):
+            polar.isig[:, :50].get_orientation(sims, template_bank=bank)
+        with pytest.raises(ValueError, match="normalize_templates"):
+            polar.get_orientation(sims, template_bank=bank, normalize_templates=False)
+        other_sims = generator.calculate_diffraction2d(
+            phase,
+            rotation=rotations[:-1],
+            max_excitation_error=0.1,
+            reciprocal_radius=2,
+        )
+        with pytest.raises(ValueError, match="templates"):
+            polar.get_orientation(other_sims, template_bank=bank)
+
+    @pytest.mark.parametrize("chunkwise", [True, False])
+    def test_single_precision(self, chunkwise):
+        s = si_grains()
+        s.calibration.center = None
+        polar = s.get_azimuthal_integral2d(
+            npt=100, npt_azim=180, inplace=False, mean=True
+        )
+        phase = si_phase()
+        generator = SimulationGenerator(200, minimum_intensity=0.05)
+        rotations = get_sample_reduced_fundamental(
+            resolution=3, point_group=phase.point_group
+        )
+        sims = generator.calculate_diffraction2d(
+            phase,
+            rotation=rotations,
+            max_excitation_error=0.1,
+            reciprocal_radius=2,
+        )
+        expected = polar.get_orientation(sims, n_best=3, chunkwise=chunkwise)
+        orientations = polar.get_orientation(
+            sims, n_best=3, chunkwise=chunkwise, precision=np.float32
+        )
+        assert orientations.data.dtype == np.float64
+        # the best templates are the same, the correlations differ by rounding.
+        # Equivalent templates have equal correlations, so the order of the next
+        # best templates can differ.
+        np.testing.assert_array_equal(
+            orientations.data[:, :, 0, 0], expected.data[:, :, 0, 0]
+        )
+        np.testing.assert_allclose(
+            orientations.data[..., 1], expected.data[..., 1], rtol=1e-5
+        )
+
+    def test_checkpoint(self, tmp_path):
+        s = si_grains()
+        s.calibration.center = None
+        polar = s.get_azimuthal_integral2d(
+            npt=100, npt_azim=180, inplace=False, mean=True
+        )
+        phase = si_phase()
+        generator = SimulationGenerator(200, minimum_intensity=0.05)
+        rotations = get_sample_reduced_fundamental(
+            resolution=3, point_group=phase.point_group
+        )
+        sims = generator.calculate_diffraction2d(
+            phase,
+            rotation=rotations,
+            max_excitation_error=0.1,
+            reciprocal_radius=2,
+        )
+        checkpoint = tmp_path / "orientation.zarr"
+        orientations = polar.get_orientation(sims, n_best=3, checkpoint=checkpoint)
+        assert orientations._lazy
+        orientations.compute()
+        expected = polar.get_orientation(sims, n_best=3)
+        np.testing.assert_array_equal(
+            orientations.data[:, :, 0, 0], expected.data[:, :, 0, 0]
+        )
+        np.testing.assert_allclose(orientations.data[..., 1], expected.data[..., 1])
+        # all the chunks are done, so the result is read from the store
+        resumed = polar.get_orientation(sims, n_best=3, checkpoint=checkpoint)
+        resumed.compute()
+        np.testing.assert_array_equal(resumed.data, orientations.data)
+        with pytest.raises(ValueError, match="different computation"):
+            polar.get_orientation(sims, n_best=2, checkpoint=checkpoint)
+        # a different library of the same size
+        other_sims = generator.calculate_diffraction2d(
+            phase,
+            rotation=~rotations,
+            max_excitation_error=0.1,
+            reciprocal_radius=2,
+        )
+        with pytest.raises(ValueError, match="different computation"):
+            polar.get_orientation(other_sims, n_best=3, checkpoint=checkpoint)
+        with pytest.raises(ValueError, match="different computation"):
+            polar.get_orientation(
+                sims, n_best=3, search="seeded", seed_step=2, checkpoint=checkpoint
+            )
+        shifted = polar.deepcopy()
+        shifted.axes_manager.signal_axes[1].offset += 0.01
+        with pytest.raises(ValueError, match="different computation"):
+            shifted.get_orientation(sims, n_best=3, checkpoint=checkpoint)
+
+    def test_hierarchical_and_seeded_search(self):
+        s = si_grains()
+        s.calibration.center = None
+        polar = s.get_azimuthal_integral2d(
+            npt=100, npt_azim=180, inplace=False, mean=True
+        )
+        phase = si_phase()
+        generator = SimulationGenerator(200, minimum_intensity=0.05)
+        rotations = get_sample_reduced_fundamental(
+            resolution=2, point_group=phase.point_group
+        )
+        sims = generator.calculate_diffraction2d(
+            phase,
+            rotation=rotations,
+            max_excitation_error=0.1,
+            reciprocal_radius=2,
+        )
+        expected = polar.get_orientation(sims, frac_keep=1.0)
+        orientations = polar.get_orientation(sims, frac_keep=1.0, search="hierarchical")
+        assert isinstance(sims.template_search_index, TemplateSearchIndex)
+        assert isinstance(orientations, OrientationMap)
+        np.testing.assert_array_equal(orientations.data, expected.data)
+        orientations = polar.get_orientation(sims, frac_keep=1.0, search="seeded")
+        np.testing.assert_array_equal(orientations.data, expected.data)
+        search_type = orientations.metadata.search_type
+        assert search_type.axes_manager.signal_shape == (20, 20)
+        assert np.all(search_type.data[::4, ::4] == 0)
+        assert np.all(search_type.data[1::4] > 0)
+        with pytest.raises(ValueError, match="chunkwise"):
+            polar.get_orientation(sims, search="hierarchical", chunkwise=False)
+        with pytest.raises(ValueError, match="neighbourhood"):
+            polar.get_orientation(sims, n_best=1000, search="hierarchical")
+        with pytest.raises(ValueError, match="search"):
+            polar.get_orientation(sims, search="fast")
+
     def test_tilt_orientation_result(self, single_rot_orientation_result):
         assert isinstance(single_rot_orientation_result, OrientationMap)
         orients = single_rot_orientation_result.to_single_phase_orientations()
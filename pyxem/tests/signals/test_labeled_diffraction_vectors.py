@@ -90,6 +90,14 @@ class TestLabelledDiffractionVectors:
         assert len(clust.column_names) == 12
         assert len(clust.units) == 12
 
+    def test_cluster_labeled_vectors_tiled(self, labeled_vectors):
+        expected = labeled_vectors.cluster_labeled_vectors(method=DBSCAN(eps=25))
+        clust = labeled_vectors.cluster_labeled_vectors(
+            method=DBSCAN(eps=25), tile_size=100, scheduler="threads"
+        )
+        assert clust.data.shape == (100, 12)
+        np.testing.assert_array_equal(clust.data, expected.data)
+
     def test_cluster_labeled_vectors_fail(self, labeled_vectors):
         scan = DBSCAN()
         with pytest.raises(ValueError):
@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU General Public License
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
+from unittest.mock import patch
+
 import pytest
 import numpy as np
 
@@ -23,6 +25,7 @@ from hyperspy.axes import UniformDataAxis
 
 from pyxem.utils import calibration
 from pyxem.utils.calibration import Calibration
+from pyxem.utils._azimuthal_integrations import _LookupTableCache
 from pyxem.signals import Diffraction2D
 
 
@@ -159,6 +162,65 @@ class TestCalibrationClass:
         all_sum = np.sum(sum_factors)
         assert np.allclose(all_sum, 10000, atol=1)
 
+    def test_get_factors_against_shapely(self):
+        shapely = pytest.importorskip("shapely")
+        from pyxem.utils._azimuthal_integrations import (
+            _get_control_points,
+            _get_factors,
+        )
+
+        s = Diffraction2D(np.zeros((40, 50)))
+        s.calibration(scale=0.1, center=None)
+        affine = np.array([[1.05, 0.1, 0], [0.05, 0.95, 0], [0, 0, 1]])
+        s.calibration.affine = affine
+        slices, factors, factors_slice = s.calibration._get_slices_and_factors(
+            npt=10, npt_azim=36, radial_range=(0, 2.5), azimuthal_range=(-np.pi, np.pi)
+        )
+        control_points = _get_control_points(
+            10,
+            36,
+            (0, 2.5),
+            (-np.pi / 2, 3 * np.pi / 2),
+            affine.copy(),
+        )
+        x_ext, y_ext = s.calibration.pixel_extent
+        for i in [0, 5, 100, 359]:
+            sl = slices[i]
+            polygon = shapely.polygons(control_points[i])
+            xx, yy = np.meshgrid(
+                np.arange(sl[0], sl[2]), np.arange(sl[1], sl[3]), indexing="ij"
+            )
+            boxes = shapely.box(
+                x_ext[0][xx.ravel()],
+                y_ext[0][yy.ravel()],
+                x_ext[1][xx.ravel()],
+                y_ext[1][yy.ravel()],
+            )
+            expected = shapely.area(
+                shapely.intersection(boxes, polygon)
+            ) / shapely.area(boxes)
+            np.testing.assert_allclose(
+                factors[factors_slice[i][0] : factors_slice[i][1]], expected, atol=1e-12
+            )
+        new_factors, _ = _get_factors(
+            control_points, slices, s.calibration.pixel_extent
+        )
+        np.testing.assert_allclose(new_factors, factors)
+
+    def test_get_factors_square(self):
+        from pyxem.utils._azimuthal_integrations import _get_factors
+
+        pixel_extent = [
+            np.stack((np.arange(4) - 0.5, np.arange(4) + 0.5)),
+            np.stack((np.arange(4) - 0.5, np.arange(4) + 0.5)),
+        ]
+        # a square covering a quarter of the pixels around it
+        control_points = np.array([[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]]])
+        slices = np.array([[0, 0, 2, 2]])
+        factors, factors_slice = _get_factors(control_points, slices, pixel_extent)
+        np.testing.assert_allclose(factors, [0.25, 0.25, 0.25, 0.25])
+        np.testing.assert_array_equal(factors_slice, [[0, 4]])
+
     def test_get_slices_and_factors1d(self):
         s = Diffraction2D(np.zeros((100, 100)))
         s.calibration(scale=0.1, center=None)
@@ -171,6 +233,98 @@ class TestCalibrationClass:
             print(np.sum(sl))
         np.testing.assert_almost_equal(np.sum(factors), 3.1415 * 40**2, decimal=0)
 
+    def test_get_slices1d_matches_2d(self):
+        s = Diffraction2D(np.zeros((30, 24)))
+        s.calibration(scale=0.1, center=(12, 14))
+        indexes, factors, factor_slices, _ = s.calibration.get_slices1d(
+            12, radial_range=(0, 1.5)
+        )
+        slices, factors2d, factors_slice, _ = s.calibration.get_slices2d(
+            12, 360, radial_range=(0, 1.5)
+        )
+        assert len(factor_slices) == 13
+        for i in range(12):
+            expected = np.zeros((30, 24))
+            for j in range(360):
+                ind = i * 360 + j
+                sl = slices[ind]
+                expected[sl[0] : sl[2], sl[1] : sl[3]] += factors2d[
+                    factors_slice[ind][0] : factors_slice[ind][1]
+                ].reshape((sl[2] - sl[0], sl[3] - sl[1]))
+            result = np.zeros((30, 24))
+            ind = indexes[factor_slices[i] : factor_slices[i + 1]]
+            result[ind[:, 0], ind[:, 1]] = factors[
+                factor_slices[i] : factor_slices[i + 1]
+            ]
+            np.testing.assert_allclose(result, expected, atol=1e-12)
+            np.testing.assert_array_equal(ind, np.argwhere(expected))
+
+    def test_lookup_table_cache(self):
+        Calibration.cache_clear()
+        s = Diffraction2D(np.zeros((20, 20)))
+        s.calibration(scale=0.1, center=None)
+        slices, factors, factors_slice, _ = s.calibration.get_slices2d(5, 10)
+        assert s.calibration.cache_misses == 1
+        assert s.calibration.cache_hits == 0
+        # a different signal with the same calibration reuses the tables
+        s2 = Diffraction2D(np.ones((3, 20, 20)))
+        s2.calibration(scale=0.1, center=None)
+        slices2, factors2, factors_slice2, _ = s2.calibration.get_slices2d(5, 10)
+        assert s2.calibration.cache_hits == 1
+        assert slices2 is slices
+        assert not factors2.flags.writeable
+        # changing the center changes the tables
+        s2.calibration.center = (9, 9)
+        s2.calibration.get_slices2d(5, 10)
+        assert s2.calibration.cache_misses == 2
+        s2.calibration.get_slices1d(5)
+        s2.calibration.get_slices1d(5)
+        info = s2.calibration.cache_info()
+        assert info.hits == 2
+        assert info.currsize == 4
+        Calibration.cache_clear()
+        assert Calibration.cache_info().currsize == 0
+
+    def test_lookup_table_cache_eviction(self):
+        Calibration.cache_clear()
+        Calibration.configure_cache(maxsize=2)
+        try:
+            s = Diffraction2D(np.zeros((20, 20)))
+            s.calibration(scale=0.1, center=None)
+            for npt in [4, 5, 6]:
+                s.calibration.get_slices2d(npt, 10)
+            assert s.calibration.cache_info().currsize == 2
+            s.calibration.get_slices2d(4, 10)  # evicted
+            assert s.calibration.cache_misses == 4
+        finally:
+            Calibration.configure_cache(maxsize=16)
+            Calibration.cache_clear()
+
+    def test_lookup_table_cache_persist(self, tmp_path):
+        Calibration.cache_clear()
+        Calibration.configure_cache(directory=tmp_path)
+        try:
+            s = Diffraction2D(np.zeros((20, 20)))
+            s.calibration(scale=0.1, center=None)
+            indexes, facts, factor_slices, _ = s.calibration.get_slices1d(5)
+            assert len(list(tmp_path.glob("*.npz"))) == 2
+            Calibration.cache_clear()
+            indexes2, facts2, factor_slices2, _ = s.calibration.get_slices1d(5)
+            assert s.calibration.cache_hits == 1
+            assert s.calibration.cache_misses == 0
+            np.testing.assert_array_equal(indexes, indexes2)
+            np.testing.assert_array_equal(facts, facts2)
+            np.testing.assert_array_equal(factor_slices, factor_slices2)
+            # tables persisted with an older format are not reused
+            Calibration.cache_clear()
+            with patch.object(_LookupTableCache, "format_version", 0):
+                s.calibration.get_slices1d(5)
+            assert s.calibration.cache_hits == 0
+            assert len(list(tmp_path.glob("*.npz"))) == 4
+        finally:
+            Calibration.configure_cache(persist=False)
+            Calibration.cache_clear()
+
     def test_to_string(self, calibration):
         assert (
             str(calibration)
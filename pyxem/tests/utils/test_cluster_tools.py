@@ -21,6 +21,7 @@ import numpy as np
 from numpy.random import randint
 from pyxem.signals import Diffraction2D
 import pyxem.utils._cluster_tools as ct
+from sklearn.cluster import DBSCAN, KMeans
 
 
 class TestFilterPeakList:
@@ -489,3 +490,99 @@ class TestSortedClusterDictToMarkerList:
             color_centre=marker_color,
             color_none=marker_color,
         )
+
+
+class TestMergeCloseVectors:
+    def test_threshold(self):
+        vectors = np.array([[0.0, 0.0], [0.05, 0.0], [0.1, 0.0], [0.2, 0.0]])
+        merged, labels = ct._merge_close_vectors(vectors, np.array([1, 3, 1, 1]), 0.1)
+        # vectors exactly at the threshold are not merged
+        np.testing.assert_array_equal(labels, [0, 0, 1, 2])
+        np.testing.assert_allclose(merged, [[0.0375, 0], [0.1, 0], [0.2, 0]])
+
+    @pytest.mark.parametrize("n_columns", (2, 3))
+    def test_greedy_order(self, n_columns):
+        rng = np.random.default_rng(0)
+        vectors, weights = np.unique(
+            np.round(rng.uniform(-1, 1, (500, n_columns)), 1),
+            axis=0,
+            return_counts=True,
+        )
+        merged, labels = ct._merge_close_vectors(vectors, weights, 0.25)
+        # merge the remaining vectors close to the first remaining vector
+        remaining = np.arange(len(vectors))
+        expected = []
+        while len(remaining):
+            distances = np.linalg.norm(
+                vectors[remaining] - vectors[remaining[0]], axis=1
+            )
+            close = remaining[distances < 0.25]
+            np.testing.assert_array_equal(labels[close], len(expected))
+            expected.append(np.average(vectors[close], weights=weights[close], axis=0))
+            remaining = remaining[distances >= 0.25]
+        np.testing.assert_allclose(merged, expected)
+
+
+class TestClusterTiled:
+    @pytest.fixture()
+    def vectors(self):
+        rng = np.random.default_rng(0)
+        centers = rng.uniform(0, 50, (40, 4))
+        blobs = [center + rng.normal(0, 0.4, (30, 4)) for center in centers]
+        # clusters crossing many tiles
+        lines = [
+            np.stack(
+                [np.linspace(0, 50, 200), np.full(200, y), np.zeros(200), np.ones(200)],
+                axis=1,
+            )
+            for y in (10.5, 30.5)
+        ]
+        noise = rng.uniform(0, 50, (300, 4))
+        return np.concatenate(blobs + lines + [noise])
+
+    def test_get_tiles(self):
+        positions = np.array([[0.0, 0.0], [4.9, 0.0], [5.1, 9.9], [10, 10]])
+        rows, tiles, owners = ct._get_tiles(
+            positions, np.array([5.0, 5.0]), np.array([0.5, 0.5])
+        )
+        np.testing.assert_array_equal(owners, [0, 0, 4, 8])
+        assert np.all(np.diff(tiles) >= 0)
+        np.testing.assert_array_equal(
+            sorted(zip(rows, tiles)),
+            [
+                (0, 0),
+                (1, 0),
+                (1, 3),
+                (2, 1),
+                (2, 2),
+                (2, 4),
+                (2, 5),
+                (3, 4),
+                (3, 5),
+                (3, 7),
+                (3, 8),
+            ],
+        )
+
+    @pytest.mark.parametrize("tile_size", (4, 12.5, 100))
+    def test_same_as_dbscan(self, vectors, tile_size):
+        method = DBSCAN(eps=1.2, min_samples=4)
+        expected = method.fit(vectors).labels_
+        labels = ct._cluster_tiled(
+            vectors[:, :2], vectors, method, tile_size, 2.4, scheduler="threads"
+        )
+        assert labels.max() == expected.max()
+        np.testing.assert_array_equal(labels < 0, expected < 0)
+        # the clusters are the same up to their numbering
+        pairs = np.unique(np.stack([labels, expected])[:, labels >= 0], axis=1)
+        assert pairs.shape[1] == expected.max() + 1
+
+    def test_tile_overlap(self):
+        method = DBSCAN(eps=0.5)
+        np.testing.assert_allclose(
+            ct._get_tile_overlap(method, 4, [0, 1, 2, 3], [1, 2, 1, 1], (0, 1)), [1, 2]
+        )
+        with pytest.raises(ValueError, match="tile columns"):
+            ct._get_tile_overlap(method, 4, [2, 3], [1, 1], (0, 1))
+        with pytest.raises(ValueError, match="eps"):
+            ct._get_tile_overlap(KMeans(), 4, [0, 1], [1, 1], (0, 1))
@@ -232,3 +232,154 @@ class TestBackgroundRemoval:
         data = bt._subtract_dog(numpy_array, min_sigma=min_sigma)
         assert data.sum() != numpy_array.sum()
         assert data.shape == numpy_array.shape
+
+
+class TestGetNavigationMoments:
+    @pytest.mark.parametrize("axis", [(0, 1), (0,), 1])
+    @pytest.mark.parametrize("lazy", [True, False])
+    def test_moments(self, axis, lazy):
+        rng = np.random.default_rng(0)
+        data = rng.random((7, 9, 5, 4)) * 100
+        if lazy:
+            data = da.from_array(data, chunks=(3, 4, 5, 2))
+        count, mean, m2 = dt._get_navigation_moments(data, axis)
+        mean, m2 = da.compute(mean, m2)
+        data = np.asarray(data)
+        assert count == data.size // data.mean(axis).size
+        np.testing.assert_allclose(mean, data.mean(axis))
+        np.testing.assert_allclose(m2 / count, data.var(axis))
+
+    def test_integer_data(self):
+        data = np.full((4, 4, 3, 3), 200, dtype=np.uint8)
+        data[0] = 100
+        count, mean, m2 = dt._get_navigation_moments(data, (0, 1))
+        mean, m2 = da.compute(mean, m2)
+        expected = data.astype(float)
+        np.testing.assert_allclose(mean, expected.mean((0, 1)))
+        np.testing.assert_allclose(m2 / count, expected.var((0, 1)))
+
+
+class TestPlanChunks:
+    def test_whole_axes(self):
+        plan = dt._plan_chunks(
+            (20, 30, 64, 64), np.float32, whole_axes=(2, 3), chunk_bytes="1MiB"
+        )
+        assert plan.chunks[2:] == ((64,), (64,))
+        assert plan.chunk_bytes <= 2**20
+        assert plan.n_chunks == np.prod([len(c) for c in plan.chunks])
+        assert plan.rechunk
+
+    def test_keep_current_chunks(self):
+        chunks = ((10, 10), (10, 10, 10), (64,), (64,))
+        plan = dt._plan_chunks(
+            (20, 30, 64, 64), np.float32, whole_axes=(2, 3), chunks=chunks
+        )
+        assert plan.chunks == chunks
+        assert not plan.rechunk
+
+    def test_merge_whole_axes_only(self):
+        chunks = ((10, 10), (10, 10, 10), (32, 32), (64,))
+        plan = dt._plan_chunks(
+            (20, 30, 64, 64), np.float32, whole_axes=(2, 3), chunks=chunks
+        )
+        assert plan.chunks == ((10, 10), (10, 10, 10), (64,), (64,))
+        assert plan.rechunk
+
+    def test_current_chunks_too_large(self):
+        chunks = ((20,), (30,), (32, 32), (64,))
+        plan = dt._plan_chunks(
+            (20, 30, 64, 64),
+            np.float32,
+            whole_axes=(2, 3),
+            chunks=chunks,
+            chunk_bytes="1MiB",
+        )
+        assert plan.chunk_bytes <= 2**20
+
+    def test_memory_limit(self):
+        plan = dt._plan_chunks(
+            (100, 100, 64, 64),
+            np.float64,
+            whole_axes=(2, 3),
+            memory_limit="64MiB",
+            num_workers=4,
+        )
+        assert plan.chunk_bytes <= 8 * 2**20
+        assert plan.memory <= 64 * 2**20
+
+    def test_num_workers(self):
+        plan = dt._plan_chunks(
+            (100, 100, 64, 64), np.float64, whole_axes=(2, 3), num_workers=16
+        )
+        assert plan.n_chunks >= 16
+
+    def test_signal_plan_chunks(self):
+        s = LazyDiffraction2D(da.zeros((20, 30, 16, 16), chunks=(10, 10, 8, 16)))
+        plan = s.plan_chunks("frame")
+        assert plan.chunks[2:] == ((16,), (16,))
+        plan = s.plan_chunks("navigation")
+        assert plan.chunks[:2] == ((20,), (30,))
+        with pytest.raises(ValueError):
+            s.plan_chunks("magic")
+
+    def test_no_redundant_rechunk(self):
+        s = LazyDiffraction2D(da.zeros((20, 30, 16, 16), chunks=(10, 10, 16, 16)))
+        assert s._map_blocks_prepare() is s
+
+    def test_map_blocks_prepare_keeps_navigation_chunks(self):
+        s = LazyDiffraction2D(da.zeros((100, 100, 64, 64), chunks=(100, 100, 32, 64)))
+        prepared = s._map_blocks_prepare()
+        assert prepared.data.chunks == ((100,), (100,), (64,), (64,))
+        planned = s._map_blocks_prepare(plan_chunks=True, num_workers=4)
+        assert planned.data.chunks[2:] == ((64,), (64,))
+        assert planned.data.npartitions >= 4
+
+
+class TestStoreWithCheckpoint:
+    def test_store(self, tmp_path):
+        data = np.arange(60.0).reshape(6, 10)
+        array = da.from_array(data, chunks=((4, 2), (3, 4, 3)))
+        stored = dt._store_with_checkpoint(array * 2, tmp_path / "c.zarr")
+        assert isinstance(stored, da.Array)
+        assert stored.chunks == ((4, 2), (4, 4, 2))
+        np.testing.assert_array_equal(stored.compute(), data * 2)
+
+    def test_resume(self, tmp_path):
+        data = np.arange(60.0).reshape(6, 10)
+        computed = []
+
+        def double(block, block_info=None, fail=False):
+            location = block_info[0]["chunk-location"]
+            if fail and location == (1, 1):
+                raise RuntimeError("interrupted")
+            computed.append(location)
+            return block * 2
+
+        array = da.from_array(data, chunks=(3, 5))
+        with pytest.raises(RuntimeError, match="interrupted"):
+            dt._store_with_checkpoint(
+                array.map_blocks(double, fail=True, dtype=float),
+                tmp_path / "c.zarr",
+                attrs={"factor": 2},
+                scheduler="synchronous",
+            )
+        first = set(computed)
+        assert (1, 1) not in first
+        computed.clear()
+        stored = dt._store_with_checkpoint(
+            array.map_blocks(double, dtype=float),
+            tmp_path / "c.zarr",
+            attrs={"factor": 2},
+            scheduler="synchronous",
+        )
+        # only the blocks which were not stored are computed again
+        assert len(computed) == 4 - len(first)
+        assert set(computed).isdisjoint(first)
+        assert (1, 1) in computed
+        np.testing.assert_array_equal(stored.compute(), data * 2)
+        with pytest.raises(ValueError, match="different computation"):
+            dt._store_with_checkpoint(
+                array.map_blocks(double, dtype=float),
+                tmp_path / "c.zarr",
+                attrs={"factor": 3},
+            )
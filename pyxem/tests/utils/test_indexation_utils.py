@@ -16,8 +16,11 @@
 # You should have received a copy of the GNU General Public License
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
+from types import SimpleNamespace
+
 from hyperspy.signals import Signal2D
 import numpy as np
+from orix.crystal_map import Phase
 from orix.quaternion import Rotation
 import pytest
 
@@ -25,6 +28,20 @@ from pyxem.utils.indexation_utils import match_vectors
 from pyxem.utils.indexation_utils import (
     index_dataset_with_template_rotation,
     results_dict_to_crystal_map,
+    _get_integrated_polar_templates,
+    _mixed_matching_lib_to_polar,
+    _mixed_matching_lib_to_polar_chunk,
+    _get_correlation_method,
+    _get_template_spectra,
+    _take_template_spectra,
+    _build_search_index,
+    _combine_search_indexes,
+    _hierarchical_matching_lib_to_polar_chunk,
+    _seeded_matching_lib_to_polar_chunk,
+    _get_seed_neighbours,
+    PolarTemplateBank,
+    _get_simulation_fingerprint,
+    get_template_search_index,
 )
 
 
@@ -69,6 +86,401 @@ def test_match_vector_total_error_default(vector_match_peaks, vector_library):
     assert len(rhkls) == 0
 
 
+class TestMixedMatchingChunk:
+    @pytest.fixture
+    def templates(self):
+        rng = np.random.default_rng(0)
+        r_templates = rng.integers(1, 30, size=(200, 8))
+        r_templates[:, 6:] = 0
+        theta_templates = rng.integers(0, 90, size=(200, 8))
+        intensities = rng.random((200, 8))
+        integrated = _get_integrated_polar_templates(30, r_templates, intensities, True)
+        return integrated, r_templates, theta_templates, intensities
+
+    @pytest.mark.parametrize("correlation", ["direct", "fft"])
+    @pytest.mark.parametrize(
+        "n_keep, frac_keep, n_best",
+        [(None, 0.1, 1), (None, 0.1, 4), (7, None, 2), (None, 1.0, 3)],
+    )
+    def test_same_as_single_pattern(
+        self, templates, n_keep, frac_keep, n_best, correlation
+    ):
+        rng = np.random.default_rng(1)
+        polar = rng.random((3, 4, 30, 90)).astype(np.float32)
+        polar[0, 0, 3, 5] = np.nan
+        expected = np.empty((3, 4, n_best, 4))
+        for index in np.ndindex(3, 4):
+            expected[index] = _mixed_matching_lib_to_polar(
+                polar[index], *templates, n_keep, frac_keep, n_best, transpose=True
+            )
+        answer = _mixed_matching_lib_to_polar_chunk(
+            polar,
+            *templates,
+            n_keep,
+            frac_keep,
+            n_best,
+            transpose=True,
+            correlation=correlation,
+        )
+        np.testing.assert_array_equal(answer, expected)
+        answer = _mixed_matching_lib_to_polar_chunk(
+            polar.swapaxes(-1, -2),
+            *templates,
+            n_keep,
+            frac_keep,
+            n_best,
+            correlation=correlation,
+            batch_size=5,
+        )
+        np.testing.assert_array_equal(answer, expected)
+
+    @pytest.mark.parametrize("correlation", ["direct", "fft"])
+    def test_single_precision(self, templates, correlation):
+        polar = np.random.default_rng(1).random((3, 4, 30, 90))
+        expected = np.empty((3, 4, 3, 4))
+        for index in np.ndindex(3, 4):
+            expected[index] = _mixed_matching_lib_to_polar(
+                polar[index],
+                *templates,
+                None,
+                0.5,
+                3,
+                transpose=True,
+                precision=np.float32,
+            )
+        answer = _mixed_matching_lib_to_polar_chunk(
+            polar,
+            *templates,
+            None,
+            0.5,
+            3,
+            transpose=True,
+            correlation=correlation,
+            precision=np.float32,
+        )
+        np.testing.assert_array_equal(answer, expected)
+        double = _mixed_matching_lib_to_polar_chunk(
+            polar, *templates, None, 0.5, 3, transpose=True, correlation=correlation
+        )
+        np.testing.assert_array_equal(answer[..., 0], double[..., 0])
+        np.testing.assert_allclose(answer[..., 1], double[..., 1], rtol=1e-5)
+
+    def test_get_template_spectra(self, templates):
+        _, r_templates, theta_templates, intensities = templates
+        ring_ptr, ring_radii, coefficients = _get_template_spectra(
+            r_templates, theta_templates, intensities, 90
+        )
+        assert coefficients.shape == (ring_ptr[-1], 46)
+        twiddle = np.exp(-2j * np.pi * np.arange(46) / 90)
+        for template in (0, 17, 199):
+            rings = slice(ring_ptr[template], ring_ptr[template + 1])
+            expected = np.zeros(
+                (ring_ptr[template + 1] - ring_ptr[template], 46), complex
+            )
+            for r, theta, intensity in zip(
+                r_templates[template, :6],
+                theta_templates[template, :6],
+                intensities[template, :6],
+            ):
+                ring = np.flatnonzero(ring_radii[rings] == r)[0]
+                expected[ring] += intensity * twiddle**theta
+            np.testing.assert_allclose(coefficients[rings], expected, atol=1e-12)
+        # the spectra of a subset of the templates
+        indexes = np.array([5, 3, 150])
+        subset = _take_template_spectra((ring_ptr, ring_radii, coefficients), indexes)
+        expected = _get_template_spectra(
+            r_templates[indexes], theta_templates[indexes], intensities[indexes], 90
+        )
+        for array, expected_array in zip(subset, expected):
+            np.testing.assert_allclose(array, expected_array, atol=1e-12)
+
+    def test_precomputed_template_spectra(self, templates):
+        polar = np.random.default_rng(1).random((5, 30, 90))
+        template_spectra = _get_template_spectra(*templates[1:], 90)
+        expected = _mixed_matching_lib_to_polar_chunk(
+            polar, *templates, None, 0.5, 3, transpose=True, correlation="direct"
+        )
+        answer = _mixed_matching_lib_to_polar_chunk(
+            polar,
+            *templates,
+            None,
+            0.5,
+            3,
+            transpose=True,
+            correlation="fft",
+            template_spectra=template_spectra,
+        )
+        np.testing.assert_array_equal(answer, expected)
+
+    def test_wrong_correlation(self, templates):
+        polar = np.ones((2, 30, 90))
+        with pytest.raises(ValueError, match="correlation"):
+            _mixed_matching_lib_to_polar_chunk(
+                polar, *templates, None, 0.1, 1, correlation="slow"
+            )
+
+    def test_get_correlation_method(self):
+        # many spots on the same ring
+        r_templates = np.full((10, 60), 5)
+        assert _get_correlation_method(r_templates, 360) == "fft"
+        # a few spots on different rings
+        r_templates = np.tile(np.arange(1, 7), (10, 1))
+        assert _get_correlation_method(r_templates, 360) == "direct"
+        # spots after the first r == 0 are not used
+        r_templates = np.full((10, 60), 5)
+        r_templates[:, 3] = 0
+        assert _get_correlation_method(r_templates, 360) == "direct"
+        # the cost is per correlated pair, so it does not depend on the library size
+        r_templates = np.tile(np.repeat(np.arange(1, 6), 4), (1, 1))
+        assert _get_correlation_method(r_templates, 360) == "fft"
+        assert _get_correlation_method(np.tile(r_templates, (1000, 1)), 360) == "fft"
+
+
+class TestHierarchicalSearch:
+    @pytest.fixture
+    def directions(self):
+        rng = np.random.default_rng(0)
+        directions = rng.normal(size=(200, 3))
+        return directions / np.linalg.norm(directions, axis=1)[:, np.newaxis]
+
+    def test_build_search_index(self, directions):
+        index = _build_search_index(directions, n_neighbours=4)
+        assert index.coarse_indexes.size == 15
+        assert np.unique(index.coarse_indexes).size == 15
+        assert index.neighbour_ptr.size == 16
+        for i, coarse in enumerate(index.coarse_indexes):
+            neighbours = index.neighbour_indexes[
+                index.neighbour_ptr[i] : index.neighbour_ptr[i + 1]
+            ]
+            assert coarse in neighbours
+            np.testing.assert_array_equal(neighbours, np.unique(neighbours))
+        # every template is in the neighbourhood of its closest coarse template
+        closest = np.argmax(directions @ directions[index.coarse_indexes].T, axis=1)
+        for template, i in enumerate(closest):
+            neighbours = index.neighbour_indexes[
+                index.neighbour_ptr[i] : index.neighbour_ptr[i + 1]
+            ]
+            assert template in neighbours
+
+    def test_combine_search_indexes(self, directions):
+        index1 = _build_search_index(directions[:50])
+        index2 = _build_search_index(directions[50:])
+        index = _combine_search_indexes([index1, index2], [50, 150])
+        np.testing.assert_array_equal(
+            index.coarse_indexes,
+            np.concatenate([index1.coarse_indexes, index2.coarse_indexes + 50]),
+        )
+        np.testing.assert_array_equal(
+            index.neighbour_indexes[index.neighbour_ptr[-2] : index.neighbour_ptr[-1]],
+            index2.neighbour_indexes[index2.neighbour_ptr[-2] :] + 50,
+        )
+
+    def test_hierarchical_matching(self, directions):
+        rng = np.random.default_rng(1)
+        r_templates = rng.integers(1, 30, size=(200, 8))
+        theta_templates = rng.integers(0, 90, size=(200, 8))
+        intensities = rng.random((200, 8))
+        integrated = _get_integrated_polar_templates(30, r_templates, intensities, True)
+        templates = (integrated, r_templates, theta_templates, intensities)
+        polar = rng.random((2, 3, 30, 90))
+        # a single coarse template with everything in its neighbourhood is the same
+        # as an exhaustive search
+        index = _build_search_index(directions, n_coarse=1)
+        expected = _mixed_matching_lib_to_polar_chunk(
+            polar, *templates, None, 1.0, 3, transpose=True
+        )
+        answer = _hierarchical_matching_lib_to_polar_chunk(
+            polar, *templates, index, None, 1.0, 3, transpose=True
+        )
+        np.testing.assert_array_equal(answer, expected)
+        # the best templates are found in the neighbourhoods of the coarse hits
+        index = _build_search_index(directions)
+        answer = _hierarchical_matching_lib_to_polar_chunk(
+            polar, *templates, index, None, 1.0, 2, n_coarse_best=1, transpose=True
+        )
+        assert answer.shape == (2, 3, 2, 4)
+        for image in np.ndindex(2, 3):
+            hit = _mixed_matching_lib_to_polar_chunk(
+                polar[image][np.newaxis],
+                *(t[index.coarse_indexes] for t in templates),
+                None,
+                1.0,
+                1,
+                transpose=True,
+            )[0, 0, 0]
+            start, end = index.neighbour_ptr[int(hit) : int(hit) + 2]
+            assert np.isin(
+                answer[image][:, 0], index.neighbour_indexes[start:end]
+            ).all()
+
+    def test_n_best_larger_than_neighbourhood(self, directions):
+        rng = np.random.default_rng(1)
+        r_templates = rng.integers(1, 30, size=(200, 8))
+        theta_templates = rng.integers(0, 90, size=(200, 8))
+        intensities = rng.random((200, 8))
+        integrated = _get_integrated_polar_templates(30, r_templates, intensities, True)
+        templates = (integrated, r_templates, theta_templates, intensities)
+        polar = rng.random((2, 3, 30, 90))
+        # every neighbourhood has two templates
+        index = _build_search_index(directions, n_coarse=200, n_neighbours=1)
+        with pytest.raises(ValueError, match="n_best"):
+            _hierarchical_matching_lib_to_polar_chunk(
+                polar, *templates, index, None, 1.0, 3, transpose=True
+            )
+        with pytest.raises(ValueError, match="n_best"):
+            _seeded_matching_lib_to_polar_chunk(
+                polar, *templates, index, None, 1.0, 3, transpose=True
+            )
+        answer = _hierarchical_matching_lib_to_polar_chunk(
+            polar, *templates, index, None, 1.0, 2, transpose=True
+        )
+        assert np.all(answer[..., 0] >= 0)
+
+    def test_get_template_search_index(self):
+        simulation = SimpleNamespace(rotations=Rotation.random(100))
+        index = get_template_search_index(simulation)
+        assert index.coarse_indexes.size == 10
+        assert get_template_search_index(simulation) is index
+        # new parameters rebuild the index
+        index = get_template_search_index(simulation, n_coarse=5)
+        assert index.coarse_indexes.size == 5
+        assert get_template_search_index(simulation, n_coarse=5) is index
+        assert (
+            get_template_search_index(simulation, n_coarse=5, rebuild=True) is not index
+        )
+        assert get_template_search_index(simulation).coarse_indexes.size == 10
+
+
+class TestSeededSearch:
+    def test_get_seed_neighbours(self):
+        is_seed, neighbours = _get_seed_neighbours((5, 3), 2)
+        np.testing.assert_array_equal(np.flatnonzero(is_seed), [0, 2, 6, 8, 12, 14])
+        # position (1, 1) is surrounded by the seeds (0, 0), (0, 2), (2, 0), (2, 2)
+        np.testing.assert_array_equal(neighbours[1], [0, 2, 6, 8])
+        np.testing.assert_array_equal(neighbours[0], [0, 2, 6, 8])
+        # position (4, 1) is at the end of the chunk, missing seeds are replaced
+        np.testing.assert_array_equal(neighbours[-1], [12, 14, 12, 12])
+        is_seed, neighbours = _get_seed_neighbours((), 4)
+        assert is_seed.all() and neighbours.shape == (0, 2)
+
+    def test_seeded_matching(self):
+        rng = np.random.default_rng(1)
+        directions = rng.normal(size=(100, 3))
+        directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+        index = _build_search_index(directions)
+        r_templates = rng.integers(1, 30, size=(100, 8))
+        theta_templates = rng.integers(0, 90, size=(100, 8))
+        intensities = rng.random((100, 8))
+        integrated = _get_integrated_polar_templates(30, r_templates, intensities, True)
+        templates = (integrated, r_templates, theta_templates, intensities)
+        # every position shows the same pattern, rotated
+        polar = np.zeros((30, 90))
+        polar[r_templates[42], theta_templates[42]] = intensities[42]
+        polar = np.stack([np.roll(polar, shift, axis=1) for shift in range(12)])
+        polar = polar.reshape(3, 4, 30, 90)
+        expected = _mixed_matching_lib_to_polar_chunk(
+            polar, *templates, None, 1.0, 2, transpose=True
+        )
+        answer = _seeded_matching_lib_to_polar_chunk(
+            polar, *templates, index, None, 1.0, 2, seed_step=2, transpose=True
+        )
+        # only the best template is guaranteed to be in the seeded neighbourhoods
+        np.testing.assert_array_equal(answer[..., 0, :4], expected[..., 0, :])
+        np.testing.assert_array_equal(
+            answer[:, :, 0, 4], [[0, 1, 0, 1], [1, 1, 1, 1], [0, 1, 0, 1]]
+        )
+        # a threshold above 1 falls back to the full search everywhere
+        answer = _seeded_matching_lib_to_polar_chunk(
+            polar,
+            *templates,
+            index,
+            None,
+            1.0,
+            2,
+            seed_step=2,
+            fallback_threshold=2,
+            transpose=True,
+        )
+        np.testing.assert_array_equal(answer[..., :4], expected)
+        np.testing.assert_array_equal(
+            answer[:, :, 0, 4], [[0, 2, 0, 2], [2, 2, 2, 2], [0, 2, 0, 2]]
+        )
+
+
+class TestPolarTemplateBank:
+    simulation = SimpleNamespace(
+        phases=Phase("a", space_group=227), rotations=Rotation.identity((10,))
+    )
+
+    @pytest.fixture
+    def bank(self):
+        rng = np.random.default_rng(0)
+        r_templates = rng.integers(1, 30, size=(10, 5))
+        intensities = rng.random((10, 5))
+        integrated = _get_integrated_polar_templates(30, r_templates, intensities, True)
+        return PolarTemplateBank(
+            r_templates.astype(np.int16),
+            rng.integers(0, 90, size=(10, 5)).astype(np.int16),
+            intensities.astype(np.float32),
+            integrated.astype(np.float32),
+            np.linalg.norm(intensities, axis=1).astype(np.float32),
+            np.arange(30.0),
+            np.linspace(0, 2 * np.pi, 90, endpoint=False),
+            _get_simulation_fingerprint(self.simulation),
+            normalize_templates=False,
+        )
+
+    @pytest.mark.parametrize(
+        "filename, mmap_mode",
+        [("bank.npz", "r"), ("bank.npz", None), ("bank.zarr", "r")],
+    )
+    def test_save_load(self, bank, tmp_path, filename, mmap_mode):
+        bank.save(tmp_path / filename)
+        loaded = PolarTemplateBank.load(tmp_path / filename, mmap_mode=mmap_mode)
+        is_memmap = filename.endswith(".npz") and mmap_mode is not None
+        assert loaded.n_templates == 10
+        assert not loaded.normalize_templates
+        for name in PolarTemplateBank._array_names:
+            array = getattr(loaded, name)
+            assert array.dtype == getattr(bank, name).dtype
+            np.testing.assert_array_equal(array, getattr(bank, name))
+            assert isinstance(array, np.memmap) == is_memmap
+
+    def test_load_compressed(self, bank, tmp_path):
+        np.savez_compressed(
+            tmp_path / "bank.npz",
+            **{name: getattr(bank, name) for name in bank._array_names},
+            normalize_templates=True,
+        )
+        with pytest.raises(ValueError, match="compressed"):
+            PolarTemplateBank.load(tmp_path / "bank.npz")
+
+    def test_check_simulation(self, bank):
+        bank.check_simulation(self.simulation, normalize_templates=False)
+        simulation = SimpleNamespace(
+            phases=self.simulation.phases, rotations=Rotation.identity((11,))
+        )
+        with pytest.raises(ValueError, match="11"):
+            bank.check_simulation(simulation)
+        simulation.rotations = Rotation.random(10)
+        with pytest.raises(ValueError, match="rotations"):
+            bank.check_simulation(simulation)
+        simulation = SimpleNamespace(
+            phases=Phase("b", space_group=227), rotations=Rotation.identity((10,))
+        )
+        with pytest.raises(ValueError, match="phases"):
+            bank.check_simulation(simulation)
+        with pytest.raises(ValueError, match="normalize_templates"):
+            bank.check_simulation(self.simulation, normalize_templates=True)
+
+    def test_check_axes(self, bank):
+        bank.check_axes(np.arange(30.0), np.linspace(0, 2 * np.pi, 90, endpoint=False))
+        with pytest.raises(ValueError, match="radial"):
+            bank.check_axes(np.arange(31.0), bank.azimuthal_axis)
+        with pytest.raises(ValueError, match="azimuthal"):
+            bank.check_axes(bank.radial_axis, bank.azimuthal_axis + 0.1)
+
+
 @pytest.mark.filterwarnings("ignore:Property 'correlation' was expected")
 def test_results_dict_to_crystal_map(test_library_phases_multi, test_lib_gen):
     """Test getting a :class:`orix.crystal_map.CrystalMap` from returns
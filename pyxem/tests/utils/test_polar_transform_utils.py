@@ -20,6 +20,7 @@
 from pyxem.utils import polar_transform_utils as ptu
 import pytest
 import numpy as np
+from scipy import ndimage
 from unittest.mock import Mock
 
 try:
@@ -180,9 +181,77 @@ def test_image_to_polar_gpu(delta_r, delta_theta, max_r, fdb, db, expected_shape
     ],
 )
 def test_chunk_polar(center, radius, output_shape, expected_shape):
-    chunk = np.ones((3, 2, 10, 7))
+    chunk = np.random.default_rng(0).random((3, 2, 10, 7))
     polar_chunk = ptu._chunk_to_polar(chunk, center, radius, output_shape)
     np.testing.assert_array_almost_equal(polar_chunk.shape, expected_shape)
+    for index in np.ndindex(3, 2):
+        np.testing.assert_allclose(
+            polar_chunk[index],
+            ptu._warp_polar_custom(chunk[index], center, radius, output_shape),
+        )
+
+
+@pytest.mark.parametrize("precision", [np.float64, np.float32])
+def test_warp_polar_custom(precision):
+    image = np.random.default_rng(0).random((10, 7))
+    center, radius, output_shape = (4.2, 3.5), 6, (90, 12)
+    T = np.linspace(0, 2 * np.pi, 90).reshape(90, 1)
+    R = np.linspace(0, radius, 12).reshape(1, 12)
+    coordinates = np.stack([-R * np.sin(T) + center[0], R * np.cos(T) + center[1]])
+    expected = ndimage.map_coordinates(image, coordinates, order=1)
+    polar = ptu._warp_polar_custom(
+        image, center, radius, output_shape, precision=precision
+    )
+    assert polar.dtype == precision
+    np.testing.assert_allclose(polar, expected, atol=1e-6)
+    polar = ptu._warp_polar_custom(image, center, radius, output_shape, order=0)
+    np.testing.assert_array_equal(
+        polar, ndimage.map_coordinates(image, coordinates, order=0)
+    )
+
+
+def test_chunk_polar_centers():
+    chunk = np.random.default_rng(0).random((3, 2, 10, 7))
+    centers = np.empty((3, 2, 2))
+    centers[:] = (5.02, 3.5)
+    centers[1, 1] = (4.0, 3.0)
+    polar_chunk = ptu._chunk_to_polar(chunk, centers, 5, (36, 7))
+    for index in np.ndindex(3, 2):
+        center = (4.0, 3.0) if index == (1, 1) else (5.0, 3.5)
+        np.testing.assert_allclose(
+            polar_chunk[index],
+            ptu._warp_polar_custom(chunk[index], center, 5, (36, 7)),
+        )
+    polar_chunk = ptu._chunk_to_polar(chunk, centers, 5, (36, 7), center_decimals=2)
+    np.testing.assert_allclose(
+        polar_chunk[0, 0], ptu._warp_polar_custom(chunk[0, 0], (5.02, 3.5), 5, (36, 7))
+    )
+
+
+@pytest.mark.parametrize(
+    "center, radius, output_shape",
+    [((5, 3.5), 5, (360, 7)), ((2.3, 8.1), 10, (90, 20))],
+)
+def test_get_polar_interpolation_matrix(center, radius, output_shape):
+    image = np.random.default_rng(0).random((10, 7))
+    expected = ptu._warp_polar_custom(image, center, radius, output_shape)
+    interpolation = ptu._get_polar_interpolation_matrix(
+        image.shape, center, radius, output_shape
+    )
+    polar = (interpolation @ image.ravel()).reshape(output_shape)
+    np.testing.assert_allclose(polar, expected, atol=1e-12)
+    radial_indexes = np.array([0, 2, 5])
+    interpolation = ptu._get_polar_interpolation_matrix(
+        image.shape,
+        center,
+        radius,
+        output_shape,
+        radial_indexes=radial_indexes,
+        precision=np.float32,
+    )
+    assert interpolation.dtype == np.float32
+    polar = (interpolation @ image.ravel()).reshape(output_shape[0], -1)
+    np.testing.assert_allclose(polar, expected[:, radial_indexes], atol=1e-6)
 
 
 @skip_cupy
@@ -456,6 +456,48 @@ def test_mixed_matching_lib_to_polar(nbest):
     assert answer.shape[1] == 4
 
 
+@pytest.mark.parametrize("n_best", [1, 4, 25])
+@pytest.mark.parametrize("n_blocks", [1, 3, 25])
+def test_match_polar_to_polar_library_n_best_cpu(n_best, n_blocks):
+    rng = np.random.default_rng(0)
+    polar_image = rng.random((36, 10))
+    r = rng.integers(1, 10, size=(25, 6))
+    theta = rng.integers(0, 36, size=(25, 6))
+    intensities = rng.random((25, 6))
+    # equal templates have equal correlations
+    r[10], theta[10], intensities[10] = r[3], theta[3], intensities[3]
+    shift, cor, shift_m, cor_m = iutls._match_polar_to_polar_library_cpu(
+        polar_image, r, theta, intensities
+    )
+    positive_is_best = cor >= cor_m
+    best_cors = np.where(positive_is_best, cor, cor_m)
+    order = np.argsort(-best_cors, kind="stable")[:n_best]
+    cors, solutions = iutls._match_polar_to_polar_library_n_best_cpu(
+        polar_image, r, theta, intensities, n_best, n_blocks
+    )
+    np.testing.assert_array_equal(cors, best_cors[order])
+    np.testing.assert_array_equal(solutions[:, 0], order)
+    np.testing.assert_array_equal(
+        solutions[:, 1], np.where(positive_is_best, shift, shift_m)[order]
+    )
+    np.testing.assert_array_equal(
+        solutions[:, 2], np.where(positive_is_best, 1, -1)[order]
+    )
+
+
+@pytest.mark.parametrize("n_best", [2, 5, 40])
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_get_n_best_indices(n_best, dtype):
+    rng = np.random.default_rng(0)
+    # few distinct values to have many equal correlations
+    cors = rng.integers(0, 10, size=(30, 40)).astype(dtype)
+    cors[:, 35:] = -np.inf
+    cors[:3] = -np.inf
+    indices = iutls._get_n_best_indices(cors, n_best)
+    expected = np.argsort(-cors, axis=1, kind="stable")[:, :n_best]
+    np.testing.assert_array_equal(indices, expected)
+
+
 # @pytest.mark.skipif(sys.platform=='darwin',reason="Fails on Mac OSX")
 @pytest.mark.parametrize(
     "nbest, frk, norim, nortemp",
@@ -571,6 +613,96 @@ def test_index_dataset_with_template_rotation(
     )
 
 
+def test_index_dataset_with_template_rotation_correlation(library):
+    signal = create_dataset((2, 3, 8, 8))
+    signal.data = da.from_array(np.random.default_rng(0).random((2, 3, 8, 8)))
+    results = [
+        iutls.index_dataset_with_template_rotation(
+            signal,
+            library,
+            n_best=2,
+            delta_r=0.5,
+            delta_theta=10,
+            correlation=correlation,
+        )[0]
+        for correlation in ["direct", "fft"]
+    ]
+    for key, value in results[0].items():
+        np.testing.assert_array_equal(results[1][key], value)
+
+
+@pytest.mark.parametrize("correlation", ["direct", "fft"])
+def test_index_dataset_with_template_rotation_precision(library, correlation):
+    signal = create_dataset((2, 3, 8, 8))
+    signal.data = da.from_array(np.random.default_rng(0).random((2, 3, 8, 8)))
+    kwargs = dict(n_best=2, delta_r=0.5, delta_theta=10, correlation=correlation)
+    expected, _ = iutls.index_dataset_with_template_rotation(signal, library, **kwargs)
+    result, _ = iutls.index_dataset_with_template_rotation(
+        signal, library, precision=np.float32, **kwargs
+    )
+    assert result["correlation"].dtype == np.float32
+    np.testing.assert_array_equal(result["template_index"], expected["template_index"])
+    np.testing.assert_allclose(
+        result["correlation"], expected["correlation"], rtol=1e-5
+    )
+
+
+def test_index_dataset_with_template_rotation_checkpoint(library, tmp_path):
+    signal = create_dataset((2, 3, 8, 8))
+    signal.data = da.from_array(
+        np.random.default_rng(0).random((2, 3, 8, 8)), chunks=(1, 3, 8, 8)
+    )
+    kwargs = dict(n_best=2, delta_r=0.5, delta_theta=10)
+    expected, _ = iutls.index_dataset_with_template_rotation(signal, library, **kwargs)
+    checkpoint = tmp_path / "indexation.zarr"
+    for _ in range(2):
+        result, _ = iutls.index_dataset_with_template_rotation(
+            signal, library, checkpoint=checkpoint, **kwargs
+        )
+        for key, value in expected.items():
+            np.testing.assert_array_equal(result[key], value)
+    with pytest.raises(ValueError, match="different computation"):
+        iutls.index_dataset_with_template_rotation(
+            signal, library, checkpoint=checkpoint, n_best=1, delta_r=0.5
+        )
+    with pytest.raises(ValueError, match="different computation"):
+        iutls.index_dataset_with_template_rotation(
+            signal, library, checkpoint=checkpoint, max_r=3, **kwargs
+        )
+    # a different library of the same size
+    simulations = library["dummyphase"]["simulations"]
+    library["dummyphase"]["simulations"] = simulations[::-1]
+    with pytest.raises(ValueError, match="different computation"):
+        iutls.index_dataset_with_template_rotation(
+            signal, library, checkpoint=checkpoint, **kwargs
+        )
+    with pytest.raises(ValueError, match="different computation"):
+        iutls.index_dataset_with_template_rotation(
+            signal,
+            library,
+            checkpoint=checkpoint,
+            intensity_transform_function=np.sqrt,
+            **kwargs,
+        )
+
+
+def test_index_dataset_with_template_rotation_hierarchical(library):
+    signal = create_dataset((2, 3, 8, 8))
+    signal.data = da.from_array(np.random.default_rng(0).random((2, 3, 8, 8)))
+    kwargs = dict(n_best=2, delta_r=0.5, delta_theta=10)
+    expected, _ = iutls.index_dataset_with_template_rotation(signal, library, **kwargs)
+    # with two templates the neighbourhoods contain the full library
+    result, _ = iutls.index_dataset_with_template_rotation(
+        signal, library, search="hierarchical", n_coarse_best=1, **kwargs
+    )
+    # the library is not modified
+    assert set(library["dummyphase"]) == {"simulations", "orientations"}
+    for key, value in expected.items():
+        np.testing.assert_array_equal(result[key], value)
+    with pytest.raises(ValueError, match="search"):
+        iutls.index_dataset_with_template_rotation(signal, library, search="fast")
+
+
 # @pytest.mark.skipif(sys.platform=='darwin',reason="Fails on Mac OSX")
 @pytest.mark.slow
 def test_fail_index_dataset_with_template_rot(library):
@@ -672,6 +804,44 @@ def test_index_chunk(n_best, fraction):
     run_index_chunk(np, n_best, fraction)
 
 
+@pytest.mark.parametrize("norm_images", [False, True])
+@pytest.mark.parametrize("search_index", [None, iutls._build_search_index(np.eye(3))])
+def test_index_chunk_polar_sampling(search_index, norm_images):
+    rng = np.random.default_rng(0)
+    data = rng.random((2, 3, 20, 24))
+    r = rng.integers(1, 10, size=(3, 5))
+    theta = rng.integers(0, 36, size=(3, 5))
+    intensities = rng.random((3, 5))
+    integrated_templates = iutls._get_integrated_polar_templates(
+        12, r, intensities, False
+    )
+    args = (
+        (10, 12),
+        12,
+        (36, 12),
+        np.float64,
+        integrated_templates,
+        r,
+        theta,
+        intensities,
+        None,
+        1.0,
+        2,
+        norm_images,
+    )
+    expected = iutls._index_chunk(data, *args, search_index=search_index)
+    radial_indexes = np.arange(12) if norm_images else r
+    polar_sampling = iutls._get_polar_sampling(
+        data.shape[-2:], (10, 12), 12, (36, 12), radial_indexes, np.float64
+    )
+    np.testing.assert_array_equal(polar_sampling[0], np.unique(radial_indexes))
+    answer = iutls._index_chunk(
+        data, *args, search_index=search_index, polar_sampling=polar_sampling
+    )
+    np.testing.assert_array_equal(answer[..., [0, 2, 3]], expected[..., [0, 2, 3]])
+    np.testing.assert_allclose(answer[..., 1], expected[..., 1])
+
+
 @pytest.mark.parametrize(
     "n_best, fraction",
     [
@@ -18,10 +18,13 @@
 
 """Utils for azimuthal integration."""
 
+from collections import OrderedDict, namedtuple
+import hashlib
+import os
+
 import numpy as np
+from scipy import sparse
 
-from shapely import Polygon, box
-import shapely
 from numba import cuda, prange
 import numba
 
@@ -41,6 +44,7 @@ def _slice_radial_integrate(
     npt_azim,
     mask=None,
     mean=False,
+    normalization=None,
 ):  # pragma: no cover
     """Slice the image into small chunks and multiply by the factors.
 
@@ -56,6 +60,14 @@ def _slice_radial_integrate(
         The number of radial points
     npt_azim:
         The number of azimuthal points
+    mask:
+        The mask to apply to the image. A static mask is better folded into the
+        factors using :func:`_mask_factors2d`.
+    mean:
+        If True, return the mean of the pixels in the slice rather than the sum
+    normalization:
+        A precomputed normalization for each slice. If given, the integrated values
+        are divided by this rather than recomputing the normalization for `mean`.
 
     Note
     ----
@@ -68,7 +80,17 @@ def _slice_radial_integrate(
     val = np.empty((npt_rad, npt_azim))
     for i in prange(len(factors_slice)):
         ii, jj = i // npt_azim, i % npt_azim
-        if mean:  # divide by the total number of pixels
+        if normalization is not None:
+            val[ii, jj] = (
+                np.sum(
+                    img[slices[i][0] : slices[i][2], slices[i][1] : slices[i][3]]
+                    * factors[factors_slice[i][0] : factors_slice[i][1]].reshape(
+                        (slices[i][2] - slices[i][0], slices[i][3] - slices[i][1])
+                    )
+                )
+                / normalization[i]
+            )
+        elif mean:  # divide by the total number of pixels
             val[ii, jj] = np.sum(
                 img[slices[i][0] : slices[i][2], slices[i][1] : slices[i][3]]
                 * factors[factors_slice[i][0] : factors_slice[i][1]].reshape(
@@ -144,7 +166,7 @@ def __slice_radial_integrate_cupy(
 
 @numba.njit
 def _slice_radial_integrate1d(
-    img, indexes, factors, factor_slices, mask=None, mean=False
+    img, indexes, factors, factor_slices, mask=None, mean=False, normalization=None
 ):  # pragma: no cover
     """Slice the image into small chunks and multiply by the factors.
 
@@ -159,9 +181,13 @@ def _slice_radial_integrate1d(
     factor_slices:
         The slices to slice the factors and the indexes by
     mask:
-        The mask to apply to the image
+        The mask to apply to the image. A static mask is better folded into the
+        factors using :func:`_mask_factors1d`.
     mean:
         If True, return the mean of the pixels in the slice rather than the sum
+    normalization:
+        A precomputed normalization for each slice. If given, the integrated values
+        are divided by this rather than recomputing the normalization for `mean`.
 
     Note
     ----
@@ -178,7 +204,9 @@ def _slice_radial_integrate1d(
         total = 0.0
         for index, fa in zip(ind, f):
             total = total + img[index[0], index[1]] * fa
-        if mean:
+        if normalization is not None:
+            total = total / normalization[i]
+        elif mean:
             total_f = np.finfo(np.float32).eps
             if mask is not None:
                 for index, fa in zip(ind, f):
@@ -192,60 +220,374 @@ def _slice_radial_integrate1d(
     return ans
 
 
+@numba.njit
+def _slice_radial_integrate1d_moments(
+    img, indexes, factors, factor_slices, mask=None
+):  # pragma: no cover
+    """Integrate the image, the squared image and the pixel weights for each radial
+    bin in a single pass over the image.
+
+    Parameters
+    ----------
+    img: np.array
+        The image to be integrated
+    indexes:
+        The indexes of the pixels to multiply by the `factors`
+    factors:
+        The percentage of the pixel for each radial bin associated with some index
+    factor_slices:
+        The slices to slice the factors and the indexes by
+    mask:
+        The mask to apply to the image. A static mask is better folded into the
+        factors using :func:`_mask_factors1d`.
+
+    Returns
+    -------
+    moments: np.ndarray (3, npt)
+        The sum, the sum of squares and the total (unmasked) pixel weight for each
+        radial bin.
+    """
+    ans = np.zeros((3, len(factor_slices) - 1))
+    for i in range(len(factor_slices) - 1):
+        for j in range(factor_slices[i], factor_slices[i + 1]):
+            x, y = indexes[j, 0], indexes[j, 1]
+            if mask is not None and mask[x, y]:
+                continue
+            fa = factors[j]
+            val = img[x, y]
+            ans[0, i] += val * fa
+            ans[1, i] += val * val * fa
+            ans[2, i] += fa
+    return ans
+
+
+def _integrate_csr_moments(images, matrix):
+    """Integrate the images, the squared images and the pixel weights of a block
+    of images using a sparse CSR integration matrix.
+
+    Returns
+    -------
+    moments: np.ndarray
+        The sum, the sum of squares and the pixel weight for each bin with shape
+        (..., 3, bins)
+    """
+    nav_shape = images.shape[:-2]
+    frames = images.reshape((-1, images.shape[-2] * images.shape[-1]))
+    frames = frames.astype(float)
+    moments = np.empty((frames.shape[0], 3, matrix.shape[0]))
+    moments[:, 0] = (matrix @ frames.T).T
+    moments[:, 1] = (matrix @ np.square(frames).T).T
+    moments[:, 2] = np.asarray(matrix.sum(axis=1)).ravel()
+    return moments.reshape(nav_shape + (3, matrix.shape[0]))
+
+
+def _get_factor_pixels(slices, factors_slice):
+    """Get the (x, y) pixel index of each of the factors for 2d integration."""
+    slices = np.asarray(slices)
+    factors_slice = np.asarray(factors_slice)
+    width = slices[:, 3] - slices[:, 1]
+    num = factors_slice[:, 1] - factors_slice[:, 0]
+    # position of each factor within its slice
+    local = np.arange(np.sum(num)) - np.repeat(factors_slice[:, 0], num)
+    width = np.repeat(np.clip(width, 1, None), num)
+    x = np.repeat(slices[:, 0], num) + local // width
+    y = np.repeat(slices[:, 1], num) + local % width
+    return x, y
+
+
+def _get_bin_sums(factors, factor_slices):
+    """Sum the factors in each bin given the start index of each bin (and the end
+    index of the last bin)."""
+    num = np.diff(factor_slices)
+    bins = np.repeat(np.arange(len(num)), num)
+    return np.bincount(bins, weights=factors, minlength=len(num))
+
+
+def _mask_factors2d(slices, factors, factors_slice, mask=None, mean=False):
+    """Fold a static mask into the factors for 2d integration and precompute the
+    normalization used for the `mean`.
+
+    This avoids masking (and so copying) every image during the integration.
+
+    Returns
+    -------
+    factors: np.ndarray
+        The factors with the masked pixels set to zero
+    normalization: np.ndarray or None
+        The sum of the (unmasked) factors in each slice if `mean` otherwise None
+    """
+    normalization = None
+    if mean:
+        factors_slice = np.asarray(factors_slice)
+        normalization = _get_bin_sums(
+            factors, np.append(factors_slice[:, 0], factors_slice[-1, 1])
+        )
+    if mask is not None:
+        x, y = _get_factor_pixels(slices, factors_slice)
+        factors = factors * np.logical_not(mask)[x, y]
+    return factors, normalization
+
+
+def _mask_factors1d(indexes, factors, factor_slices, mask=None, mean=False):
+    """Fold a static mask into the factors for 1d integration and precompute the
+    normalization used for the `mean`.
+
+    This avoids masking (and so copying) every image during the integration.
+
+    Returns
+    -------
+    factors: np.ndarray
+        The factors with the masked pixels set to zero
+    normalization: np.ndarray or None
+        The sum of the unmasked factors in each slice if `mean` otherwise None
+    """
+    if mask is not None:
+        factors = factors * np.logical_not(mask)[indexes[:, 0], indexes[:, 1]]
+    normalization = None
+    if mean:
+        normalization = np.finfo(np.float32).eps + _get_bin_sums(factors, factor_slices)
+    return factors, normalization
+
+
+def _get_csr_matrix2d(slices, factors, factors_slice, shape):
+    """Convert the slices and factors for 2d integration into a sparse CSR matrix
+    with shape (npt * npt_azim, shape[0] * shape[1]).
+
+    Multiplying the flattened images by the transpose of this matrix is equivalent
+    to calling :func:`_slice_radial_integrate` on each of the images.
+    """
+    factors_slice = np.asarray(factors_slice)
+    x, y = _get_factor_pixels(slices, factors_slice)
+    indptr = np.append(factors_slice[:, 0], factors_slice[-1, 1])
+    matrix = sparse.csr_matrix(
+        (np.array(factors, dtype=float), x * shape[1] + y, indptr),
+        shape=(len(slices), shape[0] * shape[1]),
+    )
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def _mask_csr_matrix(matrix, mask):
+    """Set the columns of the masked pixels in an integration matrix to zero."""
+    if mask is None:
+        return matrix
+    matrix = matrix @ sparse.diags(np.logical_not(mask).ravel().astype(float))
+    matrix.eliminate_zeros()
+    return matrix.tocsr()
+
+
+def _get_slices1d_from_slices2d(slices, factors, factors_slice, npt_azim, shape):
+    """Sum the azimuthal bins of the slices and factors for 2d integration to get
+    the indexes and factors for 1d integration.
+
+    The 2d table is scattered into a sparse matrix in a single pass, so the memory
+    used is proportional to the number of non zero factors.
+
+    Returns
+    -------
+    indexes: np.ndarray (n, 2)
+        The indexes of the pixels in each radial bin, in row-major order
+    factors: np.ndarray (n)
+        The fraction of each pixel in the radial bin
+    factor_slices: np.ndarray (npt+1)
+        The start and end index of the factors for each radial bin
+    """
+    matrix = _get_csr_matrix2d(slices, factors, factors_slice, shape).tocoo()
+    npt = len(slices) // npt_azim
+    matrix = sparse.csr_matrix(
+        (matrix.data, (matrix.row // npt_azim, matrix.col)),
+        shape=(npt, shape[0] * shape[1]),
+    )  # duplicate entries are summed
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    indexes = np.stack(np.unravel_index(matrix.indices, shape), axis=1)
+    return indexes, matrix.data, matrix.indptr
+
+
+def _get_csr_matrix1d(indexes, factors, factor_slices, shape):
+    """Convert the indexes and factors for 1d integration into a sparse CSR matrix
+    with shape (npt, shape[0] * shape[1]).
+
+    Multiplying the flattened images by the transpose of this matrix is equivalent
+    to calling :func:`_slice_radial_integrate1d` on each of the images.
+    """
+    indexes = np.asarray(indexes)
+    matrix = sparse.csr_matrix(
+        (
+            np.array(factors, dtype=float),
+            indexes[:, 0] * shape[1] + indexes[:, 1],
+            np.array(factor_slices),
+        ),
+        shape=(len(factor_slices) - 1, shape[0] * shape[1]),
+    )
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def _integrate_csr(images, matrix, output_shape, normalization=None):
+    """Integrate a block of images using a sparse CSR integration matrix.
+
+    Parameters
+    ----------
+    images: np.ndarray
+        The images with shape (..., y, x)
+    matrix: scipy.sparse.csr_matrix
+        The integration matrix with shape (bins, x * y)
+    output_shape: tuple
+        The shape of the integrated signal for each image
+    normalization: np.ndarray or None
+        If not None, the integrated values are divided by this normalization
+
+    Returns
+    -------
+    val: np.ndarray
+        The integrated images with shape (...,) + output_shape
+    """
+    nav_shape = images.shape[:-2]
+    frames = images.reshape((-1, images.shape[-2] * images.shape[-1]))
+    val = (matrix @ frames.T).T
+    if normalization is not None:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            val = val / normalization
+    return np.asarray(val, dtype=float).reshape(nav_shape + tuple(output_shape))
+
+
 def _get_factors(control_points, slices, pixel_extents):
     """This function takes a set of control points (vertices of bounding polygons) and
     slices (min and max indices for each control point) and returns the factors for
     each slice. The factors are the area of the intersection of the polygon and the
     sliced pixels.
+
+    Parameters
+    ----------
+    control_points: np.ndarray (n, m, 2)
+        The vertices of the n polygons with m vertices each
+    slices: np.ndarray (n, 4)
+        The slices [min_x, min_y, max_x, max_y] bounding each polygon
+    pixel_extents: [np.ndarray (2, x), np.ndarray (2, y)]
+        The left and right edges of the pixels along each axis
+
+    Returns
+    -------
+    factors: np.ndarray
+        The fraction of each pixel inside of its polygon, flattened for all slices
+    factors_slice: np.ndarray (n, 2)
+        The start and end index in `factors` for each slice
     """
-    all_boxes = get_boxes(slices, pixel_extent=pixel_extents)
-    max_num = np.max([len(x) for x in all_boxes])
-    num_box = len(all_boxes)
-    boxes = shapely.empty((num_box, max_num))
-
-    p = shapely.polygons(control_points)
-    for i, bx in enumerate(all_boxes):
-        try:
-            b = shapely.box(bx[:, 0], bx[:, 1], bx[:, 2], bx[:, 3])
-            boxes[i, : len(b)] = b
-        except IndexError:  # the box is empty.
-            pass
-
-    factors = shapely.area(
-        shapely.intersection(boxes, p[:, np.newaxis])
-    ) / shapely.area(boxes)
-    not_nan = np.logical_not(np.isnan(factors))
-
-    factors = factors.flatten()
-    factors = factors[not_nan.flatten()]
-
-    num = np.sum(not_nan, axis=1)
+    x_extent, y_extent = pixel_extents
+    slices = np.asarray(slices, dtype=np.int64)
+    num = np.clip(slices[:, 2] - slices[:, 0], 0, None) * np.clip(
+        slices[:, 3] - slices[:, 1], 0, None
+    )
     factors_slice = np.cumsum(num)
     factors_slice = np.hstack(([0], factors_slice))
     factors_slice = np.stack((factors_slice[:-1], factors_slice[1:])).T
+    factors = _get_factors_numba(
+        np.ascontiguousarray(control_points, dtype=np.float64),
+        slices,
+        np.ascontiguousarray(x_extent[0], dtype=np.float64),
+        np.ascontiguousarray(x_extent[1], dtype=np.float64),
+        np.ascontiguousarray(y_extent[0], dtype=np.float64),
+        np.ascontiguousarray(y_extent[1], dtype=np.float64),
+        factors_slice,
+    )
     return factors, factors_slice
 
 
-def get_boxes(slices, pixel_extent):
-    all_boxes = []
-    x_extent, y_extent = pixel_extent
-    x_ext_left, x_ext_right = x_extent
-    y_ext_left, y_ext_right = y_extent
-    for sl in slices:
-        x_edges = list(range(sl[0], sl[2]))
-        y_edges = list(range(sl[1], sl[3]))
-        boxes = []
-        for i, x in enumerate(x_edges):
-            for j, y in enumerate(y_edges):
-                b = [
-                    x_ext_left[x],
-                    y_ext_left[y],
-                    x_ext_right[x],
-                    y_ext_right[y],
-                ]
-                boxes.append(b)
-        all_boxes.append(np.array(boxes))
-    return all_boxes
+@numba.njit(parallel=True, nogil=True)
+def _get_factors_numba(
+    control_points, slices, x_left, x_right, y_left, y_right, factors_slice
+):  # pragma: no cover
+    """Clip every polygon against each of the pixels in its slice and return the
+    fraction of each pixel which is inside the polygon.
+
+    Note
+    ----
+    The pixels are clipped using the Sutherland-Hodgman algorithm, which is exact for
+    an axis aligned (convex) clipping window. The pixels are iterated over in the same
+    order as the slice i.e. ``factors[...].reshape((max_x-min_x, max_y-min_y))``
+    """
+    factors = np.zeros(factors_slice[-1, 1])
+    num_vertices = control_points.shape[1]
+    # each clipping edge can at most double the number of vertices
+    max_vertices = num_vertices * 16
+    for i in prange(len(slices)):
+        buffer_x = np.empty((2, max_vertices))
+        buffer_y = np.empty((2, max_vertices))
+        poly_x = control_points[i, :, 0]
+        poly_y = control_points[i, :, 1]
+        min_px, max_px = np.min(poly_x), np.max(poly_x)
+        min_py, max_py = np.min(poly_y), np.max(poly_y)
+        ind = factors_slice[i, 0]
+        for x in range(slices[i, 0], slices[i, 2]):
+            for y in range(slices[i, 1], slices[i, 3]):
+                x0, x1 = x_left[x], x_right[x]
+                y0, y1 = y_left[y], y_right[y]
+                if x1 <= min_px or x0 >= max_px or y1 <= min_py or y0 >= max_py:
+                    factors[ind] = 0.0
+                    ind += 1
+                    continue
+                buffer_x[0, :num_vertices] = poly_x
+                buffer_y[0, :num_vertices] = poly_y
+                n = num_vertices
+                n = _clip_polygon_edge(buffer_x, buffer_y, n, 0, x0, True)
+                n = _clip_polygon_edge(buffer_x, buffer_y, n, 0, x1, False)
+                n = _clip_polygon_edge(buffer_x, buffer_y, n, 1, y0, True)
+                n = _clip_polygon_edge(buffer_x, buffer_y, n, 1, y1, False)
+                factors[ind] = _polygon_area(buffer_x[0], buffer_y[0], n) / (
+                    (x1 - x0) * (y1 - y0)
+                )
+                ind += 1
+    return factors
+
+
+@numba.njit(nogil=True)
+def _clip_polygon_edge(
+    buffer_x, buffer_y, n, axis, bound, keep_above
+):  # pragma: no cover
+    """Clip the polygon in ``buffer[0]`` against the half plane
+    ``coordinate[axis] >= bound`` (or ``<=`` if not `keep_above`). The clipped
+    polygon is written back to ``buffer[0]`` and the number of vertices is returned.
+    """
+    if n == 0:
+        return 0
+    buffer_x[1, :n] = buffer_x[0, :n]
+    buffer_y[1, :n] = buffer_y[0, :n]
+    in_x, in_y = buffer_x[1], buffer_y[1]
+    out_x, out_y = buffer_x[0], buffer_y[0]
+    m = 0
+    prev_x, prev_y = in_x[n - 1], in_y[n - 1]
+    prev_c = prev_x if axis == 0 else prev_y
+    prev_in = prev_c >= bound if keep_above else prev_c <= bound
+    for k in range(n):
+        cur_x, cur_y = in_x[k], in_y[k]
+        cur_c = cur_x if axis == 0 else cur_y
+        cur_in = cur_c >= bound if keep_above else cur_c <= bound
+        if cur_in != prev_in:
+            t = (bound - prev_c) / (cur_c - prev_c)
+            if axis == 0:
+                out_x[m] = bound
+                out_y[m] = prev_y + t * (cur_y - prev_y)
+            else:
+                out_x[m] = prev_x + t * (cur_x - prev_x)
+                out_y[m] = bound
+            m += 1
+        if cur_in:
+            out_x[m] = cur_x
+            out_y[m] = cur_y
+            m += 1
+        prev_x, prev_y, prev_c, prev_in = cur_x, cur_y, cur_c, cur_in
+    return m
+
+
+@numba.njit(nogil=True)
+def _polygon_area(x, y, n):  # pragma: no cover
+    """Area of a simple polygon with n vertices using the shoelace formula."""
+    area = 0.0
+    for k in range(n):
+        j = (k + 1) % n
+        area += x[k] * y[j] - x[j] * y[k]
+    return abs(area) / 2
 
 
 def _get_control_points(npt, npt_azim, radial_range, azimuthal_range, affine):
@@ -291,7 +633,99 @@ def _get_control_points(npt, npt_azim, radial_range, azimuthal_range, affine):
 
     # apply the affine transformation to the control points
     if affine is not None:
+        affine = np.array(affine)  # don't modify the affine in place
         affine[0, 1] = -affine[0, 1]  # changing the rotation direction
         affine[1, 0] = -affine[1, 0]
         control_points = np.dot(control_points, affine[:2, :2])
     return control_points
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class _LookupTableCache:
+    """A least recently used cache for the lookup tables (slices and factors) used for
+    azimuthal integration.
+
+    The tables are keyed on a hash of everything which goes into computing them, so
+    that different signals with the same calibration share the same tables. Optionally
+    the tables are also persisted as .npz files in `directory` so that they are reused
+    between sessions.
+
+    `format_version` is part of every key. It must be increased whenever the way the
+    tables are computed changes, so that stale tables persisted to disk are not used.
+    """
+
+    format_version = 1
+
+    def __init__(self, maxsize=16, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+
+    @classmethod
+    def get_key(cls, *args):
+        """Hash some set of arrays, numbers or None to a hex digest, salted with the
+        format version of the tables."""
+        h = hashlib.sha256()
+        h.update(f"lookup-tables-v{cls.format_version}".encode())
+        for arg in args:
+            if arg is None:
+                h.update(b"None")
+            else:
+                arr = np.ascontiguousarray(arg)
+                h.update(f"{arr.dtype}{arr.shape}".encode())
+                h.update(arr.tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Return the tables for some key or None if they aren't cached."""
+        if key in self._tables:
+            self._tables.move_to_end(key)
+            self.hits += 1
+            return self._tables[key]
+        if self.directory is not None and os.path.isfile(self._path(key)):
+            with np.load(self._path(key)) as f:
+                tables = tuple(f[f"arr_{i}"] for i in range(len(f.files)))
+            self.hits += 1
+            return self._insert(key, tables)
+        self.misses += 1
+        return None
+
+    def set(self, key, tables):
+        """Add the tables for some key to the cache and return the (read only)
+        cached tables."""
+        tables = self._insert(key, tables)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            np.savez(self._path(key), *tables)
+        return tables
+
+    def _insert(self, key, tables):
+        tables = tuple(np.asarray(t) for t in tables)
+        for t in tables:
+            # tables are shared between signals so they shouldn't be modified
+            t.flags.writeable = False
+        self._tables[key] = tables
+        self._tables.move_to_end(key)
+        while len(self._tables) > max(self.maxsize, 0):
+            self._tables.popitem(last=False)
+        return tables
+
+    def clear(self):
+        """Clear the in memory cache and reset the hit/miss counters. Tables persisted
+        to disk are not removed."""
+        self._tables.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._tables))
+
+
+_lookup_table_cache = _LookupTableCache()
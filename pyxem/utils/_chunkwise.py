@@ -0,0 +1,164 @@
+"""Batched kernels operating on whole chunks of diffraction patterns.
+
+Every function in this module takes a ``chunk`` with shape
+``navigation_shape + (H, W)`` (any number of leading navigation dimensions)
+and processes all of the frames at once. They are meant to be called once per
+dask block through :meth:`pyxem.signals.CommonDiffraction._blockwise` instead
+of calling a single frame function through :meth:`hyperspy.signal.BaseSignal.map`
+for every diffraction pattern.
+"""
+
+import numpy as np
+from scipy.ndimage import gaussian_filter, median_filter
+
+
+def _frame_sigma(chunk, sigma):
+    """Expand a 2D kernel width so that navigation axes are left untouched."""
+    return (0,) * (chunk.ndim - 2) + (sigma, sigma)
+
+
+def _apply_to_frames(chunk, frame_function, **kwargs):
+    """Apply a single frame function to every frame in a chunk.
+
+    Fallback for kernels which do not have a vectorized implementation. This
+    still avoids the per-frame overhead of :meth:`BaseSignal.map`.
+
+    Parameters
+    ----------
+    chunk : numpy.ndarray
+        Array with shape ``navigation_shape + (H, W)``.
+    frame_function : callable
+        Function applied to each (H, W) frame. The shape and dtype of the output
+        is taken from the result for the first frame.
+    **kwargs :
+        Passed to ``frame_function``.
+    """
+    nav_shape = chunk.shape[:-2]
+    frames = chunk.reshape((-1,) + chunk.shape[-2:])
+    first = np.asarray(frame_function(frames[0], **kwargs))
+    output = np.empty((frames.shape[0],) + first.shape, dtype=first.dtype)
+    output[0] = first
+    for i in range(1, frames.shape[0]):
+        output[i] = frame_function(frames[i], **kwargs)
+    return output.reshape(nav_shape + first.shape)
+
+
+def _gain_normalise_chunk(chunk, dref, bref):
+    """Batched version of :func:`pyxem.utils.diffraction.gain_normalise`."""
+    return ((chunk - dref) / (bref - dref)) * np.mean((bref - dref))
+
+
+def _subtract_dog_chunk(chunk, min_sigma=1, max_sigma=55):
+    """Batched version of :func:`pyxem.utils._background_subtraction._subtract_dog`."""
+    blur_max = gaussian_filter(chunk, _frame_sigma(chunk, max_sigma))
+    blur_min = gaussian_filter(chunk, _frame_sigma(chunk, min_sigma))
+    return np.maximum(np.where(blur_min > blur_max, chunk, 0) - blur_max, 0)
+
+
+def _subtract_median_chunk(chunk, footprint=19):
+    """Batched version of :func:`pyxem.utils._background_subtraction._subtract_median`."""
+    size = (1,) * (chunk.ndim - 2) + (footprint, footprint)
+    return chunk - median_filter(chunk, size=size)
+
+
+def _subtract_radial_median_chunk(chunk, center_x=128, center_y=128):
+    """Batched version of
+    :func:`pyxem.utils._background_subtraction._subtract_radial_median`.
+
+    The radius map is only computed once per chunk and the median of each
+    ring is taken over all of the frames in the chunk at the same time.
+    """
+    y, x = np.indices(chunk.shape[-2:])
+    r = np.hypot(x - center_x, y - center_y).astype(int)
+    r_flat = r.ravel()
+    frames = chunk.reshape((-1, r_flat.size))
+    r_median = np.zeros((frames.shape[0], np.max(r) + 1), dtype=np.float64)
+    for i in np.unique(r_flat):
+        r_median[:, i] = np.median(frames[:, r_flat == i], axis=1)
+    image = frames - r_median[:, r_flat]
+    return image.reshape(chunk.shape)
+
+
+def _threshold_and_mask_chunk(chunk, threshold=None, mask=None):
+    """Batched version of
+    :func:`pyxem.utils._pixelated_stem_tools._threshold_and_mask_single_frame`.
+    """
+    image = np.array(chunk, copy=True)
+    if mask is not None:
+        image *= mask
+    if threshold is not None:
+        if mask is None:
+            mean_value = np.mean(image, axis=(-2, -1))
+        else:
+            mean_value = np.mean(image[..., np.asarray(mask, dtype=bool)], axis=-1)
+        mean_value = (mean_value * threshold)[..., np.newaxis, np.newaxis]
+        # in two steps like the single frame version: with a negative threshold
+        # the zeroed pixels are above it too
+        image[image <= mean_value] = 0
+        image[image > mean_value] = 1
+    return image
+
+
+def _center_of_mass_chunk(chunk, mask=None, threshold=None):
+    """Batched version of :func:`pyxem.utils.diffraction.center_of_mass_from_image`.
+
+    Returns
+    -------
+    center : numpy.ndarray
+        Array with shape ``navigation_shape + (2,)`` with the [x, y] center
+        of mass of each frame.
+    """
+    z = np.array(chunk, dtype=np.float64)
+    if mask is not None:
+        z *= mask
+    if threshold is not None:
+        mean_value = np.mean(z, axis=(-2, -1), keepdims=True) * threshold
+        z[z < mean_value] = 0
+    y, x = np.indices(z.shape[-2:])
+    total = np.sum(z, axis=(-2, -1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cx = np.tensordot(z, x, axes=2) / total
+        cy = np.tensordot(z, y, axes=2) / total
+    return np.stack((cx, cy), axis=-1)
+
+
+def _beam_center_blur_chunk(chunk, sigma):
+    """Batched version of :func:`pyxem.utils.diffraction.find_beam_center_blur`.
+
+    Returns
+    -------
+    center : numpy.ndarray
+        Array with shape ``navigation_shape + (2,)`` with the [x, y] position
+        of the maximum of each blurred frame.
+    """
+    blurred = gaussian_filter(chunk, _frame_sigma(chunk, sigma), mode="wrap")
+    width = chunk.shape[-1]
+    flat = blurred.reshape(chunk.shape[:-2] + (-1,))
+    argmax = np.argmax(flat, axis=-1)
+    return np.stack((argmax % width, argmax // width), axis=-1)
+
+
+def _apply_to_frames_inplace(chunk, frame_function, iterating_kwargs=None, **kwargs):
+    """Apply a single frame function to every frame in a chunk, writing each
+    result straight back into the chunk.
+
+    Parameters
+    ----------
+    chunk : numpy.ndarray
+        Writeable array (usually a view of the full dataset) with shape
+        ``navigation_shape + (H, W)``.
+    frame_function : callable
+        Function applied to each (H, W) frame. It must return an array with
+        the same shape as the frame. The result is cast to the dtype of
+        ``chunk`` using NumPy's "unsafe" casting.
+    iterating_kwargs : dict, optional
+        Arrays with a leading ``navigation_shape``. The values at the position
+        of each frame are passed to ``frame_function``.
+    **kwargs :
+        Passed to ``frame_function``.
+    """
+    if iterating_kwargs is None:
+        iterating_kwargs = {}
+    for index in np.ndindex(chunk.shape[:-2]):
+        frame_kwargs = {key: value[index] for key, value in iterating_kwargs.items()}
+        chunk[index] = frame_function(chunk[index], **frame_kwargs, **kwargs)
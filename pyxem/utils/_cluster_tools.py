@@ -18,8 +18,12 @@
 
 """Utils for Clustering."""
 
+import dask
 import numpy as np
+from numba import njit
+from scipy.spatial import cKDTree, minkowski_distance
 from sklearn import cluster
+from sklearn.base import clone
 from hyperspy.misc.utils import isiterable
 import hyperspy.api as hs
 
@@ -541,3 +545,251 @@ def _sorted_cluster_dict_to_marker_list(
             hs.plot.markers.Points(cluster_list, color=color, size=size),
         )
     return marker_list
+
+
+@njit(nogil=True)
+def _assign_neighbourhoods(indptr, indices):
+    """Greedily label the vectors: in order, each vector which is not labelled yet
+    gets a new label together with all of its neighbours which are not labelled
+    yet. The neighbours of the vector ``i`` are ``indices[indptr[i]:indptr[i + 1]]``.
+    """
+    n = len(indptr) - 1
+    labels = np.full(n, -1, dtype=np.int64)
+    label = 0
+    for i in range(n):
+        if labels[i] >= 0:
+            continue
+        labels[i] = label
+        for k in range(indptr[i], indptr[i + 1]):
+            if labels[indices[k]] < 0:
+                labels[indices[k]] = label
+        label += 1
+    return labels
+
+
+def _merge_close_vectors(vectors, weights, distance_threshold):
+    """Merge the vectors closer than ``distance_threshold`` to a vector.
+
+    The vectors are visited in order. Each vector which is not merged yet is merged
+    with all the vectors closer than ``distance_threshold`` to it which are not
+    merged yet, and replaced by their weighted average. The pairs of close vectors
+    are found at once with a KD-tree.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        The vectors of shape (n, n_columns).
+    weights : numpy.ndarray
+        The weight of each vector.
+    distance_threshold : float
+        Vectors closer than this distance are merged.
+
+    Returns
+    -------
+    merged : numpy.ndarray
+        The weighted average of each group of merged vectors, in the order of the
+        first vector of each group.
+    labels : numpy.ndarray
+        The group of each vector.
+    """
+    pairs = cKDTree(vectors).query_pairs(distance_threshold, output_type="ndarray")
+    # the tree includes the pairs at exactly the threshold
+    distances = minkowski_distance(vectors[pairs[:, 0]], vectors[pairs[:, 1]])
+    pairs = pairs[distances < distance_threshold]
+    # neighbour lists in both directions, as a sparse row matrix
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    indices = np.concatenate([pairs[:, 1], pairs[:, 0]])[np.argsort(rows)]
+    indptr = np.zeros(len(vectors) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(vectors)), out=indptr[1:])
+    labels = _assign_neighbourhoods(indptr, indices)
+    total_weights = np.bincount(labels, weights=weights)
+    merged = np.stack(
+        [np.bincount(labels, weights=weights * column) for column in vectors.T],
+        axis=1,
+    )
+    return merged / total_weights[:, np.newaxis], labels
+
+
+def _get_tiles(positions, tile_size, tile_overlap):
+    """Bucket the vectors into a grid of overlapping tiles.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray
+        The positions along which the vectors are tiled, of shape (n, n_dims).
+    tile_size, tile_overlap : numpy.ndarray
+        The size of the tiles and the width by which each tile is extended on all
+        sides, for each dimension.
+
+    Returns
+    -------
+    rows, tiles : numpy.ndarray
+        The vector and flattened tile index of each (vector, tile) pair, sorted by
+        tile.
+    owners : numpy.ndarray
+        The tile which each vector is in before the tiles are extended.
+    """
+    origin = positions.min(axis=0)
+    n_tiles = np.floor((positions.max(axis=0) - origin) / tile_size).astype(int) + 1
+
+    def tile_index(shift):
+        index = np.floor((positions + shift - origin) / tile_size).astype(int)
+        return np.clip(index, 0, n_tiles - 1)
+
+    first, last = tile_index(-tile_overlap), tile_index(tile_overlap)
+    rows = np.arange(len(positions))
+    tiles = np.zeros(len(positions), dtype=np.int64)
+    for dim in range(positions.shape[1]):
+        # every vector is in all of the tiles from first to last along each axis
+        spans = last[rows, dim] - first[rows, dim] + 1
+        starts = np.repeat(np.cumsum(spans) - spans, spans)
+        rows = np.repeat(rows, spans)
+        steps = np.arange(len(rows)) - starts
+        tiles = np.repeat(tiles, spans) * n_tiles[dim] + first[rows, dim] + steps
+    order = np.argsort(tiles, kind="stable")
+    owners = np.ravel_multi_index(tuple(tile_index(0).T), n_tiles)
+    return rows[order], tiles[order], owners
+
+
+def _cluster_tile(vectors, method):
+    """Cluster the vectors of one tile.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        The cluster labels, -1 for noise.
+    is_core : numpy.ndarray
+        Whether each vector is a core sample of its cluster, when the method
+        distinguishes core samples (e.g. DBSCAN). Otherwise all clustered vectors
+        are core samples.
+    """
+    clustering = clone(method).fit(vectors)
+    labels = clustering.labels_
+    if hasattr(clustering, "core_sample_indices_"):
+        is_core = np.zeros(len(labels), dtype=bool)
+        is_core[clustering.core_sample_indices_] = True
+    else:
+        is_core = labels >= 0
+    return labels, is_core
+
+
+@njit(nogil=True)
+def _union_find(n, first, second):
+    """The root of each of ``n`` nodes after joining the nodes ``first[i]`` and
+    ``second[i]`` for every i."""
+    parents = np.arange(n)
+    for i in range(len(first)):
+        a, b = first[i], second[i]
+        while parents[a] != a:
+            parents[a] = parents[parents[a]]
+            a = parents[a]
+        while parents[b] != b:
+            parents[b] = parents[parents[b]]
+            b = parents[b]
+        if a != b:
+            parents[max(a, b)] = min(a, b)
+    for i in range(n):
+        parents[i] = parents[parents[i]]
+    return parents
+
+
+def _get_tile_overlap(method, n_columns, columns, column_scale_factors, tile_columns):
+    """The default overlap of the tiles: twice the ``eps`` of the method in the
+    units of the tile columns."""
+    if not hasattr(method, "eps"):
+        raise ValueError(
+            "The tile_overlap must be given for clustering methods without `eps`."
+        )
+    scales = {
+        column % n_columns: scale
+        for column, scale in zip(columns, column_scale_factors)
+    }
+    tile_columns = [column % n_columns for column in tile_columns]
+    if any(column not in scales for column in tile_columns):
+        raise ValueError(
+            "The tile_overlap must be given if the vectors are not clustered along "
+            "the tile columns."
+        )
+    return [2 * method.eps * scales[column] for column in tile_columns]
+
+
+def _cluster_tiled(
+    positions,
+    vectors,
+    method,
+    tile_size,
+    tile_overlap,
+    scheduler="processes",
+    num_workers=None,
+):
+    """Cluster vectors in overlapping tiles and stitch the clusters of the tiles.
+
+    The vectors are bucketed into a grid of tiles along ``positions``, and every
+    tile is extended by ``tile_overlap`` on all sides. The tiles are clustered in
+    parallel, so that only the vectors of the tiles being clustered need to be in
+    memory. Each vector is labeled by the tile it is in before the tiles are
+    extended. The clusters of different tiles which share a core sample are joined
+    with a union-find.
+
+    For DBSCAN, the result is the same as clustering all vectors at once if the
+    overlap is at least twice ``eps``, apart from border vectors close to several
+    clusters, which belong to any of them, and the numbering of the clusters.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray
+        The positions along which the vectors are tiled, of shape (n, n_dims).
+    vectors : numpy.ndarray or dask.array.Array
+        The vectors to cluster, of shape (n, n_columns).
+    method : sklearn.base.ClusterMixin
+        The clustering method, which is cloned for every tile.
+    tile_size, tile_overlap : float or array-like
+        The size of the tiles and the width by which each tile is extended, in the
+        units of ``positions``.
+    scheduler : str
+        The dask scheduler used to cluster the tiles.
+    num_workers : int, optional
+        The number of workers used to cluster the tiles.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        The cluster of each vector, -1 for noise.
+    """
+    n_dims = positions.shape[1]
+    tile_size = np.broadcast_to(np.asarray(tile_size, dtype=float), n_dims)
+    tile_overlap = np.broadcast_to(np.asarray(tile_overlap, dtype=float), n_dims)
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64)
+    rows, tiles, owners = _get_tiles(positions, tile_size, tile_overlap)
+    splits = np.flatnonzero(np.diff(tiles)) + 1
+    tile_rows = np.split(rows, splits)
+    tile_ids = tiles[np.concatenate([[0], splits])]
+    tasks = [dask.delayed(_cluster_tile)(vectors[index], method) for index in tile_rows]
+    results = dask.compute(*tasks, scheduler=scheduler, num_workers=num_workers)
+
+    # number the clusters of all tiles consecutively
+    n_clusters = [labels.max() + 1 for labels, _ in results]
+    first_cluster = np.concatenate([[0], np.cumsum(n_clusters)])
+    nodes = np.concatenate(
+        [
+            np.where(labels >= 0, labels + start, -1)
+            for (labels, _), start in zip(results, first_cluster)
+        ]
+    )
+    is_core = np.concatenate([core for _, core in results])
+    is_owner = np.repeat(tile_ids, [len(index) for index in tile_rows]) == owners[rows]
+
+    # join the clusters of the tiles in which a vector is a core sample
+    core_rows, core_nodes = rows[is_core], nodes[is_core]
+    order = np.argsort(core_rows, kind="stable")
+    core_rows, core_nodes = core_rows[order], core_nodes[order]
+    _, first = np.unique(core_rows, return_index=True)
+    first_nodes = np.repeat(core_nodes[first], np.diff(np.append(first, len(order))))
+    roots = _union_find(first_cluster[-1], first_nodes, core_nodes)
+
+    labels = np.full(len(positions), -1, dtype=np.int64)
+    owned = is_owner & (nodes >= 0)
+    labels[rows[owned]] = roots[nodes[owned]]
+    _, labels[labels >= 0] = np.unique(labels[labels >= 0], return_inverse=True)
+    return labels
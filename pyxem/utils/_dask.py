@@ -18,8 +18,14 @@
 
 """Utils for using dask."""
 
+from collections import namedtuple
+import json
+import os
+
 import numpy as np
+import dask
 import dask.array as da
+from dask.utils import parse_bytes
 import scipy.ndimage as ndi
 from skimage import morphology
 from hyperspy.misc.utils import isiterable
@@ -109,6 +115,122 @@ def _intensity_peaks_image_single_frame(frame, peaks, disk_r):
     return intensity_array
 
 
+ChunkPlan = namedtuple(
+    "ChunkPlan", ["chunks", "chunk_bytes", "n_chunks", "memory", "rechunk"]
+)
+ChunkPlan.__doc__ = """The chunks planned for an operation.
+
+Attributes
+----------
+chunks : tuple of tuples
+    The planned dask chunks.
+chunk_bytes : int
+    The size of the largest chunk in bytes.
+n_chunks : int
+    The total number of chunks.
+memory : int
+    Estimate of the peak memory in bytes, i.e. the input and output of the
+    chunks being processed at the same time by all of the workers.
+rechunk : bool
+    If the planned chunks differ from the current chunks.
+"""
+
+
+def _get_num_workers(num_workers=None):
+    """Get the number of workers used by the dask scheduler."""
+    if num_workers is None:
+        num_workers = dask.config.get("num_workers", None)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    return int(num_workers)
+
+
+def _plan_chunks(
+    shape,
+    dtype,
+    whole_axes=(),
+    chunks=None,
+    chunk_bytes=None,
+    memory_limit=None,
+    num_workers=None,
+    min_chunk_bytes="1MiB",
+):
+    """Plan the chunks of an array for an operation.
+
+    The axes in ``whole_axes`` are always kept in a single chunk, while the
+    remaining axes are chunked so that each chunk is at most ``chunk_bytes``. If
+    the current chunks already satisfy this they are kept (only merging the
+    ``whole_axes``) so consecutive operations do not rechunk the data.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the array.
+    dtype : numpy.dtype
+        The data type of the array.
+    whole_axes : tuple of int
+        The array axes which the operation needs to be in one chunk.
+    chunks : tuple of tuples, optional
+        The current chunks of the array.
+    chunk_bytes : int or str, optional
+        The maximum size of each chunk. Default is dask's "array.chunk-size".
+    memory_limit : int or str, optional
+        The memory available to the computation. The chunks are made small enough
+        that every worker can hold the input and output of one chunk.
+    num_workers : int, optional
+        The number of workers. The chunks are made small enough that every worker
+        gets at least one chunk, as long as each chunk is larger than
+        ``min_chunk_bytes``. Default is the number of CPUs.
+    min_chunk_bytes : int or str
+        The smallest chunk size used when splitting the data between workers.
+
+    Returns
+    -------
+    plan : ChunkPlan
+    """
+    shape = tuple(shape)
+    dtype = np.dtype(dtype)
+    whole_axes = tuple(a % len(shape) for a in whole_axes)
+    num_workers = _get_num_workers(num_workers)
+    if chunk_bytes is None:
+        chunk_bytes = dask.config.get("array.chunk-size")
+    limit = parse_bytes(chunk_bytes)
+    if memory_limit is not None:
+        limit = min(limit, parse_bytes(memory_limit) // (2 * num_workers))
+    total_bytes = int(np.prod(shape)) * dtype.itemsize
+    if total_bytes // num_workers >= parse_bytes(min_chunk_bytes):
+        limit = min(limit, -(-total_bytes // num_workers))
+
+    planned = None
+    if chunks is not None:
+        planned = tuple(
+            (shape[i],) if i in whole_axes else tuple(c) for i, c in enumerate(chunks)
+        )
+        if _get_max_chunk_bytes(planned, dtype) > limit:
+            planned = None
+    if planned is None:
+        chunks_dict = {i: -1 if i in whole_axes else "auto" for i in range(len(shape))}
+        planned = da.core.normalize_chunks(
+            chunks=chunks_dict,
+            shape=shape,
+            limit=max(limit, 1),
+            dtype=dtype,
+        )
+    chunk_size = _get_max_chunk_bytes(planned, dtype)
+    n_chunks = int(np.prod([len(c) for c in planned]))
+    memory = 2 * chunk_size * min(n_chunks, num_workers)
+    rechunk = chunks is None or tuple(map(tuple, chunks)) != planned
+    return ChunkPlan(planned, chunk_size, n_chunks, memory, rechunk)
+
+
+def _get_max_chunk_bytes(chunks, dtype):
+    """Get the size in bytes of the largest chunk."""
+    return (
+        int(np.prod([max(c) if len(c) else 0 for c in chunks]))
+        * np.dtype(dtype).itemsize
+    )
+
+
 def _get_chunking(signal, chunk_shape=None, chunk_bytes=None):
     """Get chunk tuple based on the size of the dataset.
 
@@ -163,3 +285,138 @@ def _get_dask_array(signal, chunk_shape=None, chunk_bytes=None):
         chunks = _get_chunking(signal, chunk_shape, chunk_bytes)
         dask_array = da.from_array(signal.data, chunks=chunks)
     return dask_array
+
+
+def _get_chunk_moments(block, axis):
+    """Get the mean and the sum of squared differences from the mean (M2) of a
+    block along some axes, stacked along a new first axis."""
+    mean = block.mean(axis=axis, keepdims=True, dtype=float)
+    m2 = np.sum(np.square(block - mean), axis=axis, keepdims=True)
+    return np.stack((mean, m2))
+
+
+def _get_navigation_moments(data, axis):
+    """Get the count, mean and M2 (sum of squared differences from the mean) of
+    an array along some axes while only reading the data once.
+
+    Each chunk is reduced to its own mean and M2, which are then merged using
+    the parallel algorithm of Chan et al. The variance is ``m2 / count`` and the
+    mean of the squared data is ``m2 / count + mean**2``. Unlike calculating the
+    mean of ``data**2`` this never creates a squared copy of the data and is
+    numerically stable.
+
+    Parameters
+    ----------
+    data : dask.array.Array or numpy.ndarray
+        The data to reduce. A numpy array is reduced chunk-wise as well so no
+        full size temporary arrays are created.
+    axis : int or tuple of int
+        The axes to reduce over
+
+    Returns
+    -------
+    count : int
+        The number of elements reduced for each output element
+    mean, m2 : dask.array.Array
+        The mean and M2 with the axes in `axis` removed
+
+    References
+    ----------
+    Chan, T. F., Golub, G. H., & LeVeque, R. J. (1979). Updating formulae and a
+    pairwise algorithm for computing sample variances.
+    """
+    if not isinstance(data, da.Array):
+        data = da.from_array(data, chunks="auto")
+    if not isiterable(axis):
+        axis = (axis,)
+    axis = tuple(a % data.ndim for a in axis)
+    chunks = ((2,),) + tuple(
+        (1,) * len(c) if i in axis else c for i, c in enumerate(data.chunks)
+    )
+    stats = data.map_blocks(
+        _get_chunk_moments,
+        axis=axis,
+        chunks=chunks,
+        new_axis=0,
+        dtype=float,
+    )
+    # the number of elements in each chunk
+    counts = np.ones([len(c) if i in axis else 1 for i, c in enumerate(data.chunks)])
+    for i in axis:
+        shape = [1] * data.ndim
+        shape[i] = -1
+        counts = counts * np.reshape(data.chunks[i], shape)
+    count = int(np.sum(counts))
+    means, m2s = stats[0], stats[1]
+    mean = (means * counts).sum(axis=axis, keepdims=True) / count
+    m2 = m2s.sum(axis=axis) + (counts * (means - mean) ** 2).sum(axis=axis)
+    mean = mean.squeeze(axis=axis)
+    return count, mean, m2
+
+
+def _store_block(block, data, done, block_index, chunks):
+    """Write a computed block to the zarr array and then mark it as done"""
+    region = tuple(
+        slice(i * chunk, i * chunk + size)
+        for i, chunk, size in zip(block_index, chunks, block.shape)
+    )
+    data[region] = block
+    done[block_index] = True
+
+
+def _store_with_checkpoint(array, path, attrs=None, **kwargs):
+    """Compute a dask array block by block into a zarr store, so that an
+    interrupted computation can be resumed.
+
+    Every block is written to the store as soon as it is computed and is then
+    marked as done. Calling the function again with the same store only computes
+    the blocks which are not done yet.
+
+    Parameters
+    ----------
+    array : dask.array.Array
+        The array to compute. Irregular chunks are rechunked to the largest chunk
+        along each axis, as zarr needs regular chunks.
+    path : str or pathlib.Path
+        The zarr directory, which is created if it does not exist.
+    attrs : dict, optional
+        JSON serializable attributes describing the computation. They are stored
+        with the data, and resuming a computation with different attributes (or a
+        different shape, chunks or dtype) raises a ValueError.
+    **kwargs : dict
+        Passed to :func:`dask.compute`.
+
+    Returns
+    -------
+    dask.array.Array
+        The array read lazily from the store
+    """
+    import zarr
+
+    chunks = tuple(max(chunk) for chunk in array.chunks)
+    array = array.rechunk(chunks)
+    attrs = dict(attrs or {})
+    attrs.update(shape=array.shape, chunks=chunks, dtype=array.dtype.str)
+    # compare the attributes as they are stored
+    attrs = json.loads(json.dumps(attrs))
+    group = zarr.open_group(str(path), mode="a")
+    if "data" in group:
+        if group.attrs.asdict() != attrs:
+            raise ValueError(
+                f"The checkpoint in {path} belongs to a different computation."
+            )
+        data = group["data"]
+        done = group["done"]
+    else:
+        data = group.zeros("data", shape=array.shape, chunks=chunks, dtype=array.dtype)
+        # one chunk per flag, so that the blocks can be marked in parallel
+        done = group.zeros("done", shape=array.numblocks, chunks=1, dtype=bool)
+        group.attrs.update(attrs)
+    is_done = done[...]
+    tasks = [
+        dask.delayed(_store_block)(array.blocks[index], data, done, index, chunks)
+        for index in np.ndindex(array.numblocks)
+        if not is_done[index]
+    ]
+    dask.compute(*tasks, **kwargs)
+    return da.from_zarr(data)
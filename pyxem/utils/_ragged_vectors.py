@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016-2024 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Columnar storage of the ragged vectors of a map of diffraction vectors."""
+
+import numpy as np
+
+from pyxem.utils.vectors import vectors_to_polar
+
+
+class RaggedVectors:
+    """
+    The diffraction vectors of all navigation positions in one contiguous array.
+
+    A ragged :class:`pyxem.signals.DiffractionVectors` signal holds one array of
+    vectors per navigation position in an object array, so every operation is a
+    Python call per position. Here the vectors of all positions are stacked in one
+    array and the operations are column operations on it, in the manner of a
+    compressed sparse row matrix.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        The vectors of all navigation positions of shape (n_vectors, n_columns),
+        ordered by flattened navigation position.
+    offsets : numpy.ndarray
+        The index of the first vector of each navigation position, followed by the
+        number of vectors, of shape (n_positions + 1,). The vectors of the position
+        ``i`` are ``vectors[offsets[i]:offsets[i + 1]]``.
+    navigation_shape : tuple of int
+        The navigation shape in array order.
+    squeeze : bool
+        If True, the vectors have a single column and the vectors of each position
+        are 1D arrays in the object representation.
+    """
+
+    def __init__(self, vectors, offsets, navigation_shape, squeeze=False):
+        self.vectors = vectors
+        self.offsets = offsets
+        self.navigation_shape = tuple(navigation_shape)
+        self.squeeze = squeeze
+
+    @classmethod
+    def from_object_array(cls, data):
+        """
+        Stack the vectors of an object array.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            Object array with an array of vectors of shape (n, n_columns), or (n,)
+            for a single column, at each navigation position.
+
+        Returns
+        -------
+        RaggedVectors
+        """
+        arrays, squeeze = _get_vector_arrays(data)
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(a) for a in arrays], out=offsets[1:])
+        return cls(np.concatenate(arrays), offsets, data.shape, squeeze=squeeze)
+
+    def to_object_array(self):
+        """
+        The vectors as an object array with an array of vectors at each
+        navigation position. The arrays are views of :attr:`vectors`.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        vectors = self.vectors[:, 0] if self.squeeze else self.vectors
+        bounds = self.offsets.tolist()
+        data = np.empty(self.n_positions, dtype=object)
+        for i in range(self.n_positions):
+            data[i] = vectors[bounds[i] : bounds[i + 1]]
+        return data.reshape(self.navigation_shape)
+
+    @property
+    def n_positions(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_columns(self):
+        return self.vectors.shape[1]
+
+    @property
+    def counts(self):
+        """The number of vectors at each flattened navigation position."""
+        return np.diff(self.offsets)
+
+    @property
+    def position_indexes(self):
+        """The flattened navigation position of each vector."""
+        return np.repeat(np.arange(self.n_positions), self.counts)
+
+    def with_vectors(self, vectors, squeeze=False):
+        """The same positions with new vectors, one row per vector."""
+        return type(self)(vectors, self.offsets, self.navigation_shape, squeeze)
+
+    def select(self, keep):
+        """
+        Keep a subset of the vectors.
+
+        Parameters
+        ----------
+        keep : numpy.ndarray
+            Boolean array of shape (n_vectors,).
+
+        Returns
+        -------
+        RaggedVectors
+        """
+        kept = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(keep, out=kept[1:])
+        return type(self)(
+            self.vectors[keep], kept[self.offsets], self.navigation_shape, self.squeeze
+        )
+
+    def get_magnitudes(self, columns=None):
+        """The magnitude of the vectors, as a single column."""
+        if columns is None:
+            columns = [0, 1]
+        magnitudes = np.linalg.norm(self.vectors[:, columns], axis=-1)
+        return self.with_vectors(magnitudes[:, np.newaxis], squeeze=True)
+
+    def filter_magnitude(self, min_magnitude, max_magnitude, columns=None):
+        """
+        Keep the vectors with a magnitude between ``min_magnitude`` and
+        ``max_magnitude``, see :func:`pyxem.utils.vectors.filter_vectors_ragged`.
+        """
+        magnitudes = self.get_magnitudes(columns).vectors[:, 0]
+        outside = (magnitudes < min_magnitude) | (magnitudes > max_magnitude)
+        return self.select(~outside & (magnitudes != 0))
+
+    def filter_detector_edge(self, x_threshold, y_threshold):
+        """
+        Keep the vectors away from the detector edge, see
+        :func:`pyxem.utils.vectors.filter_vectors_edge_ragged`.
+        """
+        x, y = self.vectors[:, 0], self.vectors[:, 1]
+        outside = (np.absolute(x) > x_threshold) | (np.absolute(y) > y_threshold)
+        return self.select(~outside & (x != 0))
+
+    def flatten(self, navigation_positions):
+        """
+        The vectors with the navigation position of each vector prepended.
+
+        Parameters
+        ----------
+        navigation_positions : numpy.ndarray
+            The position of each flattened navigation position, of shape
+            (n_positions, n_navigation_columns).
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (n_vectors, n_navigation_columns + n_columns).
+        """
+        n_navigation = navigation_positions.shape[1]
+        dtype = np.result_type(navigation_positions, self.vectors)
+        flattened = np.empty((len(self.vectors), n_navigation + self.n_columns), dtype)
+        flattened[:, :n_navigation] = np.repeat(
+            navigation_positions, self.counts, axis=0
+        )
+        flattened[:, n_navigation:] = self.vectors
+        return flattened
+
+    def to_polar(self, columns=None):
+        """The vectors in polar coordinates, see
+        :func:`pyxem.utils.vectors.vectors_to_polar`."""
+        return self.with_vectors(vectors_to_polar(self.vectors, columns))
+
+
+def _get_vector_arrays(data):
+    """The arrays of vectors of an object array as a list of 2D arrays, and
+    whether the vectors are 1D arrays of a single column."""
+    arrays = [np.asarray(vectors) for vectors in data.ravel()]
+    # empty positions can be 1D whatever the number of columns
+    template = next((a for a in arrays if a.size), arrays[0])
+    squeeze = template.ndim == 1
+    n_columns = 1 if squeeze else template.shape[-1]
+    return [a.reshape(-1, n_columns) for a in arrays], squeeze
+
+
+def _flatten_vectors(data, navigation_positions, dtype=None):
+    """
+    Flatten an object array of vectors into a single array with the navigation
+    position of each vector prepended, see :meth:`RaggedVectors.flatten`.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Object array with the vectors at each navigation position.
+    navigation_positions : numpy.ndarray
+        The position of each navigation position of shape
+        ``data.shape + (n_navigation_columns,)``.
+    dtype : numpy.dtype, optional
+        The dtype of the flattened vectors. By default the result type of the
+        positions and vectors.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n_vectors, n_navigation_columns + n_columns).
+    """
+    arrays, _ = _get_vector_arrays(data)
+    counts = [len(a) for a in arrays]
+    n_navigation = navigation_positions.shape[-1]
+    navigation_positions = navigation_positions.reshape(-1, n_navigation)
+    if dtype is None:
+        dtype = np.result_type(navigation_positions, *{a.dtype for a in arrays})
+    # the flattened vectors are allocated once and filled column wise
+    flattened = np.empty((sum(counts), n_navigation + arrays[0].shape[1]), dtype)
+    flattened[:, :n_navigation] = np.repeat(navigation_positions, counts, axis=0)
+    np.concatenate(arrays, out=flattened[:, n_navigation:])
+    return flattened
@@ -19,10 +19,12 @@
 """Utils for subpixel vectors refinement."""
 
 import numpy as np
+from scipy.signal import fftconvolve
 from skimage.transform import rescale
 from skimage import draw
 
 from pyxem.utils.diffraction import normalize_template_match
+from pyxem.utils._ragged_vectors import RaggedVectors
 
 
 def _get_experimental_square(z, vector, square_size):
@@ -51,6 +53,47 @@ def _get_experimental_square(z, vector, square_size):
     return _z
 
 
+def _get_experimental_squares(z, vectors, square_size, indexes=None):
+    """Batched version of :func:`_get_experimental_square` which cuts the squares
+    around all of the vectors at once.
+
+    Parameters
+    ----------
+    z : np.array()
+        Single diffraction pattern, or a stack of diffraction patterns of shape
+        (n_patterns, H, W) if ``indexes`` is given.
+    vectors : np.array()
+        Vectors in pixels (int) [x,y] with top left as [0,0] of shape (n, 2)
+    square_size : int
+        The length of one side of the bounding square (must be even)
+    indexes : np.array(), optional
+        The pattern in the stack of each vector of shape (n,)
+
+    Returns
+    -------
+    squares : np.array()
+        Of size (n,L+1,L+1) where L = square_size. The pixels of a square
+        outside of the pattern are 0.
+
+    """
+    if square_size % 2 != 0:
+        raise ValueError("'square_size' must be an even number")
+    half_ss = int(square_size / 2)
+    window = np.arange(-half_ss, half_ss + 1)
+    vectors = np.asarray(vectors)
+    rows = vectors[:, 0].astype(int)[:, np.newaxis, np.newaxis] + window[:, None]
+    cols = vectors[:, 1].astype(int)[:, np.newaxis, np.newaxis] + window
+    h, w = z.shape[-2:]
+    is_outside = (rows < 0) | (rows >= h) | (cols < 0) | (cols >= w)
+    rows, cols = np.clip(rows, 0, h - 1), np.clip(cols, 0, w - 1)
+    if indexes is None:
+        squares = z[rows, cols]
+    else:
+        squares = z[np.asarray(indexes)[:, np.newaxis, np.newaxis], rows, cols]
+    squares[is_outside] = 0
+    return squares
+
+
 def _get_simulated_disc(square_size, disc_radius):
     """Create a uniform disc for correlating with the experimental square.
 
@@ -105,6 +148,26 @@ def _center_of_mass_hs(z):
     return cy, cx
 
 
+def _center_of_mass_squares(z):
+    """Batched version of :func:`_center_of_mass_hs` for a stack of squares.
+
+    Parameters
+    ----------
+    z : np.array
+        Stack of squares of shape (n, h, w)
+
+    Returns
+    -------
+    centers : np.array
+        The y and x locations of the center of mass of each square, of shape (n, 2)
+    """
+    s = np.sum(z, axis=(1, 2), dtype=np.float64)
+    s[s == 0] = 1
+    cy = np.sum(z, axis=2) @ np.arange(z.shape[1]) / s
+    cx = np.sum(z, axis=1) @ np.arange(z.shape[2]) / s
+    return np.stack([cy, cx], axis=1)
+
+
 def _com_experimental_square(z, vector, square_size):
     """Wrapper for get_experimental_square that makes the non-zero
     elements symmetrical around the 'unsubpixeled' peak by zeroing a
@@ -146,16 +209,84 @@ def _conventional_xc(slic, kernel, upsample_factor):
     return shifts
 
 
+def _match_template_squares(image, template):
+    """Normalized cross correlation of a stack of images with a template.
+
+    Batched version of :func:`skimage.feature.match_template` with
+    ``pad_input=True`` which correlates all of the images with a single FFT
+    convolution.
+
+    Parameters
+    ----------
+    image : np.array
+        Stack of images of shape (n, M, N)
+    template : np.array
+        Template of shape (m, n)
+
+    Returns
+    -------
+    response : np.array
+        The correlation coefficients of shape (n, M, N)
+    """
+    float_dtype = np.float32 if image.dtype == np.float32 else np.float64
+    image_shape = image.shape[1:]
+    image = image.astype(float_dtype, copy=False)
+    pad_width = ((0, 0),) + tuple((width, width) for width in template.shape)
+    image = np.pad(image, pad_width=pad_width, mode="constant")
+
+    def window_sum(array):
+        for axis, width in zip((1, 2), template.shape):
+            array = np.cumsum(array, axis=axis)
+            array = np.take(array, range(width, array.shape[axis] - 1), axis=axis) - (
+                np.take(array, range(array.shape[axis] - width - 1), axis=axis)
+            )
+        return array
+
+    image_window_sum = window_sum(image)
+    image_window_sum2 = window_sum(image**2)
+
+    template_mean = template.mean()
+    template_volume = template.size
+    template_ssd = np.sum((template - template_mean) ** 2)
+
+    xcorr = fftconvolve(
+        image, template[np.newaxis, ::-1, ::-1], mode="valid", axes=(1, 2)
+    )[:, 1:-1, 1:-1]
+    numerator = xcorr - image_window_sum * template_mean
+    denominator = image_window_sum2 - image_window_sum**2 / template_volume
+    denominator = np.sqrt(np.maximum(denominator * template_ssd, 0))
+    response = np.zeros_like(xcorr, dtype=float_dtype)
+    mask = denominator > np.finfo(float_dtype).eps
+    response[mask] = numerator[mask] / denominator[mask]
+
+    d0 = [(width - 1) // 2 for width in template.shape]
+    return response[:, d0[0] : d0[0] + image_shape[0], d0[1] : d0[1] + image_shape[1]]
+
+
+def _conventional_xc_squares(squares, kernel, upsample_factor):
+    """Batched version of :func:`_conventional_xc` which finds the shifts of a
+    stack of squares at once.
+    """
+    half_ss = int((squares.shape[1]) / 2)
+    squares = rescale(squares, upsample_factor, order=1, mode="reflect", channel_axis=0)
+    kernel = rescale(kernel, upsample_factor, order=1, mode="reflect")
+
+    temp = _match_template_squares(squares, kernel)
+    max = np.argmax(temp.reshape(len(temp), -1), axis=1)
+    max = np.stack(np.unravel_index(max, temp.shape[1:]), axis=1)
+    shifts = max / upsample_factor - half_ss
+    return shifts
+
+
 #####################################################
 # Methods for subpixel refinement on a set of vectors
 #####################################################
 
 
-def _center_of_mass_map(dp, vectors, square_size, offsets, scales):
-    shifts = np.zeros_like(vectors, dtype=np.float64)
-    for i, vector in enumerate(vectors):
-        square = _get_experimental_square(dp, vector, square_size)
-        shifts[i] = [a - square_size / 2 for a in _center_of_mass_hs(square)]
+def _center_of_mass_map(dp, vectors, square_size, offsets, scales, indexes=None):
+    vectors = np.asarray(vectors)
+    squares = _get_experimental_squares(dp, vectors, square_size, indexes=indexes)
+    shifts = _center_of_mass_squares(squares) - square_size / 2
 
     new_vectors = (vectors + shifts) * scales + offsets
     return new_vectors
@@ -169,12 +300,21 @@ def _conventional_xc_map(
     upsample_factor,
     offsets,
     scales,
+    indexes=None,
+    batch_size=1024,
 ):
     vectors = np.array(vectors).astype(int)
     shifts = np.zeros_like(vectors, dtype=np.float64)
-    for i, vector in enumerate(vectors):
-        expt_disc = _get_experimental_square(dp, vector, square_size)
-        shifts[i] = _conventional_xc(expt_disc, kernel, upsample_factor)
+    # the upsampled squares are correlated in batches to bound the memory use
+    for start in range(0, len(vectors), batch_size):
+        batch = slice(start, start + batch_size)
+        expt_discs = _get_experimental_squares(
+            dp,
+            vectors[batch],
+            square_size,
+            indexes=None if indexes is None else indexes[batch],
+        )
+        shifts[batch] = _conventional_xc_squares(expt_discs, kernel, upsample_factor)
 
     return (vectors + shifts) * scales + offsets
 
@@ -217,3 +357,43 @@ def _wrap_columns(dp, vectors, f, columns=None, **kwargs):
     if columns is not None:
         new_vectors = np.hstack((new_vectors, extra_columns))
     return new_vectors
+
+
+def _subpixel_refine_chunk(patterns, vectors, f, columns=None, **kwargs):
+    """
+    Refine the vectors of a chunk of diffraction patterns at once.
+
+    The vectors of all of the navigation positions in the chunk are stacked so
+    that ``f`` is called once for the whole chunk, see :func:`_wrap_columns`.
+
+    Parameters
+    ----------
+    patterns : numpy.ndarray
+        The diffraction patterns of shape ``navigation_shape + (H, W)``.
+    vectors : numpy.ndarray
+        Object array of shape ``navigation_shape`` with the vectors in pixels at
+        each navigation position.
+    f : func
+        The refinement function, which takes the stack of patterns and the
+        pattern of each vector as ``indexes``.
+    columns : list, optional
+        The columns of the pixels of interest.
+    kwargs:
+        Any additional keyword arguments passed to f
+
+    Returns
+    -------
+    numpy.ndarray
+        Object array of shape ``navigation_shape`` with the refined vectors.
+    """
+    store = RaggedVectors.from_object_array(vectors)
+    frames = patterns.reshape((-1,) + patterns.shape[-2:])
+    refined = _wrap_columns(
+        frames,
+        store.vectors,
+        f,
+        columns=columns,
+        indexes=store.position_indexes,
+        **kwargs,
+    )
+    return store.with_vectors(refined).to_object_array()
@@ -20,13 +20,19 @@
 
 import numpy as np
 import json
+import os
 
 from diffsims.utils.sim_utils import get_electron_wavelength
 import hyperspy.api as hs
 from hyperspy.axes import UniformDataAxis
 
 from pyxem.utils.indexation_utils import index_dataset_with_template_rotation
-from pyxem.utils._azimuthal_integrations import _get_control_points, _get_factors
+from pyxem.utils._azimuthal_integrations import (
+    _get_control_points,
+    _get_factors,
+    _get_slices1d_from_slices2d,
+    _lookup_table_cache,
+)
 from pyxem.utils._deprecated import deprecated
 
 
@@ -330,12 +336,95 @@ class Calibration:
         radial_range = self._get_radial_range(radial_range)
         if azimuthal_range is None:
             azimuthal_range = (-np.pi, np.pi)
+        key = self._get_cache_key("2d", npt, npt_azim, radial_range, azimuthal_range)
+        cached = _lookup_table_cache.get(key)
+        if cached is not None:
+            slices, factors, factors_slice = cached
+            return slices, factors, factors_slice, radial_range
         # Get the slices and factors for the integration
         slices, factors, factors_slice = self._get_slices_and_factors(
             npt, npt_azim, radial_range, azimuthal_range
         )
+        slices, factors, factors_slice = _lookup_table_cache.set(
+            key, (slices, factors, factors_slice)
+        )
         return slices, factors, factors_slice, radial_range
 
+    def _get_cache_key(self, kind, npt, npt_azim, radial_range, azimuthal_range):
+        """Hash everything which the integration lookup tables depend on."""
+        return _lookup_table_cache.get_key(
+            np.frombuffer(kind.encode(), dtype=np.uint8),
+            *self.pixel_extent,
+            self.affine,
+            np.asarray(radial_range, dtype=float),
+            None if azimuthal_range is None else np.asarray(azimuthal_range, float),
+            npt,
+            npt_azim,
+        )
+
+    @staticmethod
+    def cache_info():
+        """Return the hits, misses, maximum size and current size of the cache of
+        azimuthal integration lookup tables.
+
+        The cache is shared between all signals, so integrating many signals with
+        the same calibration only computes the lookup tables once.
+
+        Returns
+        -------
+        info : CacheInfo
+            A named tuple with the fields ``hits``, ``misses``, ``maxsize`` and
+            ``currsize``.
+        """
+        return _lookup_table_cache.info()
+
+    @property
+    def cache_hits(self):
+        """The number of times the azimuthal integration lookup tables were
+        found in the cache."""
+        return _lookup_table_cache.hits
+
+    @property
+    def cache_misses(self):
+        """The number of times the azimuthal integration lookup tables had
+        to be computed."""
+        return _lookup_table_cache.misses
+
+    @staticmethod
+    def cache_clear():
+        """Clear the in memory cache of azimuthal integration lookup tables and
+        reset the hit/miss counters."""
+        _lookup_table_cache.clear()
+
+    @staticmethod
+    def configure_cache(maxsize=None, persist=None, directory=None):
+        """Configure the cache of azimuthal integration lookup tables.
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            The maximum number of lookup tables to hold in memory. The least
+            recently used tables are evicted first.
+        persist : bool, optional
+            If True the lookup tables are also saved as .npz files so they can be
+            reused between sessions. If False they are only held in memory.
+        directory : str, optional
+            The directory to persist the lookup tables to. Defaults to
+            ``pooch.os_cache("pyxem")/azimuthal_integration``.
+        """
+        if maxsize is not None:
+            _lookup_table_cache.maxsize = maxsize
+        if persist is not None and not persist:
+            _lookup_table_cache.directory = None
+        elif persist or directory is not None:
+            if directory is None:
+                import pooch
+
+                directory = os.path.join(
+                    pooch.os_cache("pyxem"), "azimuthal_integration"
+                )
+            _lookup_table_cache.directory = str(directory)
+
     def _get_radial_range(self, radial_range=None):
         if radial_range is None:
             from itertools import combinations
@@ -377,35 +466,27 @@ class Calibration:
             The range of the radial extent used for the integration
 
         """
+        radial_range = self._get_radial_range(radial_range)
+        key = self._get_cache_key("1d", npt, None, radial_range, None)
+        cached = _lookup_table_cache.get(key)
+        if cached is not None:
+            indexes, facts, factor_slices = cached
+            return indexes, facts, factor_slices, radial_range
+
         # reuse the 2d method as it is actually fairly fast
-        # and can be much faster if we spend time with numba
         npt_azim = 360  # approximate a circle with a 360-gon... Using a circle is harder/ not much better
 
         slices, factors, factors_slice, radial_range = self.get_slices2d(
             npt, npt_azim, radial_range
         )
 
-        # convert into 1d slices
-        indexes = []
-        facts = []
-        for i in range(npt):
-            test = np.zeros(self.shape)
-            for j in range(npt_azim):
-                ind = i * npt_azim + j
-                sl = slices[ind]
-                test[sl[0] : sl[2], sl[1] : sl[3]] += factors[
-                    factors_slice[ind][0] : factors_slice[ind][1]
-                ].reshape((sl[2] - sl[0], sl[3] - sl[1]))
-            inds = np.argwhere(test)
-            indexes.append(inds)
-            facts.append(test[inds[:, 0], inds[:, 1]])
-        factor_slices = np.cumsum(
-            [
-                0,
-            ]
-            + [len(f) for f in facts]
+        # convert into 1d slices by summing all of the azimuthal bins
+        indexes, facts, factor_slices = _get_slices1d_from_slices2d(
+            slices, factors, factors_slice, npt_azim, self.shape
+        )
+        indexes, facts, factor_slices = _lookup_table_cache.set(
+            key, (indexes, facts, factor_slices)
         )
-        indexes, facts = np.vstack(indexes), np.hstack(facts)
         return indexes, facts, factor_slices, radial_range
 
     def _get_slices_and_factors(self, npt, npt_azim, radial_range, azimuthal_range):
@@ -19,17 +19,22 @@
 """Utilities for indexing electron diffraction spot patterns."""
 
 from collections import namedtuple
+import hashlib
 from itertools import combinations
 from operator import attrgetter
+import struct
 import warnings
+import zipfile
 
 from dask.diagnostics import ProgressBar
-from numba import njit, prange
+from numba import get_num_threads, njit, prange
 import numpy as np
 from orix.crystal_map import CrystalMap, PhaseList
 from orix.quaternion import Rotation
+from orix.vector import Vector3d
 import psutil
 import scipy
+import scipy.spatial
 
 from pyxem.utils.diffraction import _cart2polar
 from pyxem.utils.vectors import get_rotation_matrix_between_vectors
@@ -40,13 +45,14 @@ from pyxem.utils.cuda_utils import (
     _correlate_polar_image_to_library_gpu,
     TPB,
 )
-from pyxem.utils._dask import _get_dask_array
+from pyxem.utils._dask import _get_dask_array, _store_with_checkpoint
 from pyxem.utils.polar_transform_utils import (
     _cartesian_positions_to_polar,
     get_polar_pattern_shape,
     image_to_polar,
     get_template_polar_coordinates,
     _warp_polar_custom,
+    _get_polar_interpolation_matrix,
 )
 
 try:
@@ -64,6 +70,12 @@ OrientationResult = namedtuple(
     "phase_index rotation_matrix match_rate error_hkls total_error scale center_x center_y".split(),
 )
 
+# container for the coarse-to-fine template search index
+TemplateSearchIndex = namedtuple(
+    "TemplateSearchIndex",
+    ["coarse_indexes", "neighbour_ptr", "neighbour_indexes", "template_cells"],
+)
+
 
 def get_nth_best_solution(
     single_match_result, mode, rank=0, key="match_rate", descending=True
@@ -468,8 +480,8 @@ def _match_polar_to_polar_library_cpu(
     best_in_plane_corr_m = np.empty(N, dtype=polar_image.dtype)
 
     for template in prange(N):
-        inplane_cor = np.zeros(n_shifts)
-        inplane_cor_m = np.zeros(n_shifts)
+        inplane_cor = np.zeros(n_shifts, dtype=polar_image.dtype)
+        inplane_cor_m = np.zeros(n_shifts, dtype=polar_image.dtype)
         for spot in range(R):
             rsp = r_templates[template, spot]
             if rsp == 0:
@@ -498,6 +510,128 @@ def _match_polar_to_polar_library_cpu(
     )
 
 
+@njit(nogil=True)
+def _insert_n_best(cors, solutions, cor, template, shift, sign):
+    """
+    Insert a solution in the n_best solutions sorted by decreasing correlation.
+    Solutions with an equal correlation stay in the order they were inserted.
+    """
+    n_best = cors.shape[0]
+    if not cor > cors[n_best - 1]:
+        return
+    position = n_best - 1
+    while position > 0 and cor > cors[position - 1]:
+        cors[position] = cors[position - 1]
+        solutions[position] = solutions[position - 1]
+        position -= 1
+    cors[position] = cor
+    solutions[position, 0] = template
+    solutions[position, 1] = shift
+    solutions[position, 2] = sign
+
+
+@njit(parallel=True, nogil=True)
+def _match_polar_to_polar_library_n_best_cpu(
+    polar_image,
+    r_templates,
+    theta_templates,
+    intensities_templates,
+    n_best,
+    n_blocks,
+):
+    """
+    Correlates a polar pattern to all polar templates on CPU and only keeps the
+    n_best solutions
+
+    The templates are split in ``n_blocks`` contiguous blocks. Each block keeps
+    its n_best solutions in a small sorted buffer while it is matched and the
+    buffers are merged at the end, so no arrays of the length of the library are
+    allocated.
+
+    Parameters
+    ----------
+    polar_image, r_templates, theta_templates, intensities_templates
+        See :func:`_match_polar_to_polar_library_cpu`
+    n_best : int
+        The number of solutions to keep
+    n_blocks : int
+        The number of blocks of templates matched in parallel
+
+    Returns
+    -------
+    cors : (n_best) 1D numpy.ndarray
+        The correlations of the best solutions in decreasing order. With equal
+        correlations the first template comes first.
+    solutions : (n_best, 3) 2D numpy.ndarray
+        The template, the in-plane shift and the sign (1 for the template and -1
+        for the mirrored template) of each solution. The template of missing
+        solutions is -1.
+    """
+    N = r_templates.shape[0]
+    R = r_templates.shape[1]
+    n_shifts = polar_image.shape[0]
+    block_size = (N + n_blocks - 1) // n_blocks
+    block_cors = np.full((n_blocks, n_best), -np.inf, dtype=polar_image.dtype)
+    block_solutions = np.full((n_blocks, n_best, 3), -1, dtype=np.int64)
+
+    for block in prange(n_blocks):
+        inplane_cor = np.zeros(n_shifts, dtype=polar_image.dtype)
+        inplane_cor_m = np.zeros(n_shifts, dtype=polar_image.dtype)
+        for template in range(block * block_size, min((block + 1) * block_size, N)):
+            inplane_cor[:] = 0
+            inplane_cor_m[:] = 0
+            for spot in range(R):
+                rsp = r_templates[template, spot]
+                if rsp == 0:
+                    break
+                tsp = theta_templates[template, spot]
+                isp = intensities_templates[template, spot]
+                split = n_shifts - tsp
+                column = polar_image[:, rsp] * isp
+                inplane_cor[:split] += column[tsp:]
+                inplane_cor[split:] += column[:tsp]
+                inplane_cor_m[:tsp] += column[split:]
+                inplane_cor_m[tsp:] += column[:split]
+
+            best_shift = np.argmax(inplane_cor)
+            best_shift_m = np.argmax(inplane_cor_m)
+            if inplane_cor[best_shift] >= inplane_cor_m[best_shift_m]:
+                _insert_n_best(
+                    block_cors[block],
+                    block_solutions[block],
+                    inplane_cor[best_shift],
+                    template,
+                    best_shift,
+                    1,
+                )
+            else:
+                _insert_n_best(
+                    block_cors[block],
+                    block_solutions[block],
+                    inplane_cor_m[best_shift_m],
+                    template,
+                    best_shift_m,
+                    -1,
+                )
+
+    # the blocks are merged in order, so the first template wins ties
+    cors = np.full(n_best, -np.inf, dtype=polar_image.dtype)
+    solutions = np.full((n_best, 3), -1, dtype=np.int64)
+    for block in range(n_blocks):
+        for i in range(n_best):
+            if block_solutions[block, i, 0] < 0:
+                break
+            _insert_n_best(
+                cors,
+                solutions,
+                block_cors[block, i],
+                block_solutions[block, i, 0],
+                block_solutions[block, i, 1],
+                block_solutions[block, i, 2],
+            )
+    return cors, solutions
+
+
 def _match_polar_to_polar_library_gpu(
     polar_image,
     r_templates,
@@ -743,6 +877,7 @@ def _mixed_matching_lib_to_polar(
     frac_keep,
     n_best,
     transpose=False,
+    precision=np.float64,
 ):
     """
     Match a polar image to a filtered subset of polar templates
@@ -769,6 +904,9 @@ def _mixed_matching_lib_to_polar(
         number of templates to pass to the full indexation
     n_best : int
         number of solutions to return in decending order of fit
+    precision : np.float32 or np.float64
+        The floating point type of the polar image and the template intensities
+        during the matching
 
     Return
     ------
@@ -779,7 +917,9 @@ def _mixed_matching_lib_to_polar(
     """
     if transpose:
         polar_image = polar_image.T
-    polar_image = np.nan_to_num(polar_image)
+    polar_image = np.nan_to_num(polar_image.astype(precision, copy=False))
+    intensities_templates = intensities_templates.astype(precision, copy=False)
+    integrated_templates = integrated_templates.astype(precision, copy=False)
     dispatcher = get_array_module(polar_image)
     # remove templates we don't care about with a fast match
     (
@@ -796,7 +936,26 @@ def _mixed_matching_lib_to_polar(
         frac_keep,
         n_keep,
     )
-    # get a full match on the filtered data - we must branch for CPU/GPU
+    if not is_cupy_array(polar_image):
+        # only keep the n_best solutions while matching, see
+        # _match_polar_to_polar_library_n_best_cpu
+        n_best = max(min(n_best, r_templates.shape[0]), 1)
+        n_blocks = max(min(r_templates.shape[0], 4 * get_num_threads()), 1)
+        cors, solutions = _match_polar_to_polar_library_n_best_cpu(
+            polar_image,
+            r_templates,
+            theta_templates,
+            intensities_templates,
+            n_best,
+            n_blocks,
+        )
+        answer = np.empty((n_best, 4), dtype=polar_image.dtype)
+        answer[:, 0] = template_indexes[solutions[:, 0]]
+        answer[:, 1] = cors
+        answer[:, 2] = solutions[:, 1]
+        answer[:, 3] = solutions[:, 2]
+        return answer
+    # get a full match on the filtered data on the GPU
     (
         best_in_plane_shift,
         best_in_plane_corr,
@@ -846,207 +1005,1857 @@ def _mixed_matching_lib_to_polar(
     return answer
 
 
-def _index_chunk(
-    images,
-    center,
-    max_radius,
-    output_shape,
-    precision,
-    integrated_templates,
+def _prefilter_templates_batch(polar_images, integrated_templates, frac_keep, n_keep):
+    """
+    Pre-filter the templates for a batch of polar images with one matrix product
+
+    Parameters
+    ----------
+    polar_images : 3D numpy.ndarray
+        The images in polar coordinates in the form (P, r, theta)
+    integrated_templates : 2D numpy.ndarray
+        Azimuthally integrated templates of shape (N, r)
+    frac_keep : float
+        Fraction of templates to keep
+    n_keep : int
+        Number of templates to keep. Overrides frac_keep
+
+    Returns
+    -------
+    template_indexes : 2D numpy.ndarray
+        The indexes of the kept templates for each image, in order of decreasing
+        fast correlation, of shape (P, K)
+    """
+    n_images, r_dim = polar_images.shape[:2]
+    n_templates = integrated_templates.shape[0]
+    max_keep = _get_max_n(n_templates, n_keep, frac_keep)
+    if max_keep == n_templates:
+        template_indexes = np.arange(n_templates, dtype=np.int32)
+        return np.broadcast_to(template_indexes, (n_images, n_templates))
+    weights = np.arange(r_dim, dtype=polar_images.dtype) / r_dim
+    polar_sums = polar_images.sum(axis=2) * weights
+    correlations_fast = polar_sums @ integrated_templates.T
+    template_indexes = np.argsort(-correlations_fast, axis=1)[:, :max_keep]
+    return template_indexes.astype(np.int32)
+
+
+def _get_template_pattern_pairs(template_indexes, n_templates):
+    """
+    Group the (image, slot) pairs of the kept templates by template
+
+    Parameters
+    ----------
+    template_indexes : 2D numpy.ndarray
+        The kept templates for each image, of shape (P, K). Negative indexes are
+        ignored.
+    n_templates : int
+        The total number of templates N
+
+    Returns
+    -------
+    template_ptr : 1D numpy.ndarray
+        The pairs for template ``t`` are in ``template_ptr[t]:template_ptr[t + 1]``
+    image_index, slot_index : 1D numpy.ndarray
+        The image and the slot (column in ``template_indexes``) of each pair
+    """
+    n_slots = template_indexes.shape[1]
+    flat = template_indexes.ravel()
+    order = np.argsort(flat, kind="stable")
+    # negative indexes mark unused slots
+    order = order[flat[order] >= 0]
+    template_ptr = np.zeros(n_templates + 1, dtype=np.int64)
+    template_ptr[1:] = np.cumsum(np.bincount(flat[order], minlength=n_templates))
+    image_index = (order // n_slots).astype(np.int32)
+    slot_index = (order % n_slots).astype(np.int32)
+    return template_ptr, image_index, slot_index
+
+
+@njit(parallel=True, nogil=True)
+def _match_polar_to_polar_library_batch_cpu(
+    polar_images,
     r_templates,
     theta_templates,
     intensities_templates,
-    n_keep,
-    frac_keep,
-    n_best,
-    norm_images,
-    order=1,
+    template_ptr,
+    image_index,
+    slot_index,
+    n_slots,
 ):
-    dispatcher = get_array_module(images)
-    # prepare an empty results chunk
-    indexation_result_chunk = dispatcher.empty(
-        (images.shape[0], images.shape[1], n_best, 4),
-        dtype=precision,
-    )
-    for index in np.ndindex(images.shape[:2]):
-        polar_image = _warp_polar_custom(
-            images[index],
-            center,
-            max_radius,
-            output_shape,
-            order=order,
-            precision=precision,
-        )
-        if norm_images:
-            polar_image = polar_image / dispatcher.linalg.norm(polar_image)
-        indexation_result_chunk[index] = _mixed_matching_lib_to_polar(
-            polar_image,
-            integrated_templates,
-            r_templates,
-            theta_templates,
-            intensities_templates,
-            n_keep,
-            frac_keep,
-            n_best,
-        )
-    return indexation_result_chunk
+    """
+    Correlates a batch of polar patterns to their kept polar templates on CPU
 
+    The loop over the templates is outermost so that the spots of each template
+    are reused for all of the images which kept that template.
 
-def _index_chunk_gpu(images, *args, **kwargs):
-    gpu_im = cp.asarray(images)
-    indexed_chunk = _index_chunk(gpu_im, *args, **kwargs)
-    return cp.asnumpy(indexed_chunk)
+    Parameters
+    ----------
+    polar_images : 3D numpy.ndarray
+        The images converted to polar coordinates in the form (P, r, theta)
+    r_templates : 2D numpy.ndarray
+        r-coordinates of diffraction spots in templates.
+    theta_templates : 2D numpy ndarray
+        theta-coordinates of diffraction spots in templates.
+    intensities_templates : 2D numpy.ndarray
+        intensities of the spots in each template
+    template_ptr, image_index, slot_index : 1D numpy.ndarray
+        The (image, slot) pairs to correlate for each template, see
+        :func:`_get_template_pattern_pairs`
+    n_slots : int
+        The number of kept templates per image K
+
+    Returns
+    -------
+    best_in_plane_shift, best_in_plane_corr, best_in_plane_shift_m, best_in_plane_corr_m : (P, K) 2D numpy.ndarray
+        Same as :func:`_match_polar_to_polar_library_cpu` for each image and kept
+        template
+    """
+    n_images = polar_images.shape[0]
+    n_shifts = polar_images.shape[2]
+    N = r_templates.shape[0]
+    R = r_templates.shape[1]
+    best_in_plane_shift = np.zeros((n_images, n_slots), dtype=np.int32)
+    best_in_plane_shift_m = np.zeros((n_images, n_slots), dtype=np.int32)
+    best_in_plane_corr = np.zeros((n_images, n_slots), dtype=polar_images.dtype)
+    best_in_plane_corr_m = np.zeros((n_images, n_slots), dtype=polar_images.dtype)
 
+    for template in prange(N):
+        inplane_cor = np.zeros(n_shifts, dtype=polar_images.dtype)
+        inplane_cor_m = np.zeros(n_shifts, dtype=polar_images.dtype)
+        for pair in range(template_ptr[template], template_ptr[template + 1]):
+            image = image_index[pair]
+            slot = slot_index[pair]
+            inplane_cor[:] = 0
+            inplane_cor_m[:] = 0
+            for spot in range(R):
+                rsp = r_templates[template, spot]
+                if rsp == 0:
+                    break
+                tsp = theta_templates[template, spot]
+                isp = intensities_templates[template, spot]
+                split = n_shifts - tsp
+                column = polar_images[image, rsp]
+                for k in range(split):
+                    inplane_cor[k] += column[tsp + k] * isp
+                    inplane_cor_m[tsp + k] += column[k] * isp
+                for k in range(tsp):
+                    inplane_cor[split + k] += column[k] * isp
+                    inplane_cor_m[k] += column[split + k] * isp
+
+            best_shift = np.argmax(inplane_cor)
+            best_shift_m = np.argmax(inplane_cor_m)
+            best_in_plane_shift[image, slot] = best_shift
+            best_in_plane_shift_m[image, slot] = best_shift_m
+            best_in_plane_corr[image, slot] = inplane_cor[best_shift]
+            best_in_plane_corr_m[image, slot] = inplane_cor_m[best_shift_m]
 
-def get_in_plane_rotation_correlation(
-    image,
-    simulation,
-    intensity_transform_function=None,
-    delta_r=1,
-    delta_theta=1,
-    max_r=None,
-    find_direct_beam=False,
-    direct_beam_position=None,
-    normalize_image=True,
-    normalize_template=True,
+    return (
+        best_in_plane_shift,
+        best_in_plane_corr,
+        best_in_plane_shift_m,
+        best_in_plane_corr_m,
+    )
+
+
+def _get_template_spectra(
+    r_templates, theta_templates, intensities_templates, n_shifts
 ):
     """
-    Correlate a single image and simulation over the in-plane rotation angle
+    Combine the spots of each template into one Fourier coefficient per ring
+
+    The coefficients only depend on the templates and the azimuthal sampling, so
+    they are computed once and reused for every chunk of patterns.
 
     Parameters
     ----------
-    image : 2D numpy.ndarray
-        The image of the diffraction pattern
-    simulation : diffsims.sims.diffraction_simulation.DiffractionSimulation
-        The diffraction pattern simulation
-    intensity_transform_function : Callable, optional
-        Function to apply to both image and template intensities on an
-        element by element basis prior to comparison
-    delta_r : float, optional
-        The sampling interval of the radial coordinate in pixels
-    delta_theta : float, optional
-        The sampling interval of the azimuthal coordinate in degrees
-    max_r : float, optional
-        Maximum radius to consider in pixel units. By default it is the
-        distance from the center of the image to a corner
-    find_direct_beam : bool, optional
-        Whether to optimize the direct beam, otherwise the center of the image
-        is chosen
-    direct_beam_position : 2-tuple of floats, optional
-        (x, y) coordinate of the direct beam in pixel units. Overrides other
-        settings for finding the direct beam
-    normalize_image : bool, optional
-        normalize the image to calculate the correlation coefficient
-    normalize_template : bool, optional
-        normalize the template to calculate the correlation coefficient
+    r_templates, theta_templates, intensities_templates : 2D numpy.ndarray
+        The templates, see :func:`_match_polar_to_polar_library_cpu`
+    n_shifts : int
+        The number of azimuthal pixels in the polar images
 
     Returns
     -------
-    angle_array : 1D np.ndarray
-        The in-plane angles at which the correlation is calculated in degrees
-    correlation_array : 1D np.ndarray
-        The correlation corresponding to these angles
+    ring_ptr : 1D numpy.ndarray
+        The rings of template ``i`` are ``ring_ptr[i]:ring_ptr[i + 1]``
+    ring_radii : 1D numpy.ndarray
+        The radial pixel of each ring
+    ring_coefficients : 2D numpy.ndarray
+        The real FFT along theta of the spots on each ring, of shape
+        (n_rings, n_shifts // 2 + 1), with the precision of the intensities
     """
-    polar_image = image_to_polar(
-        image,
-        delta_r,
-        delta_theta,
-        max_r=max_r,
-        find_direct_beam=find_direct_beam,
-        direct_beam_position=direct_beam_position,
+    r_templates = np.asarray(r_templates)
+    intensities_templates = np.asarray(intensities_templates)
+    # spots after the first r == 0 are not used
+    used = np.cumprod(r_templates != 0, axis=1, dtype=bool)
+    template, spot = np.nonzero(used)
+    radii = r_templates[template, spot].astype(np.int64)
+    # a ring is a unique (template, radius) pair, sorted by template
+    n_radii = radii.max(initial=0) + 1
+    rings, ring_of_spot = np.unique(template * n_radii + radii, return_inverse=True)
+    ring_ptr = np.zeros(r_templates.shape[0] + 1, dtype=np.int64)
+    ring_ptr[1:] = np.cumsum(
+        np.bincount(rings // n_radii, minlength=r_templates.shape[0])
     )
-    r, theta, intensity = get_template_polar_coordinates(
-        simulation,
-        in_plane_angle=0.0,
-        delta_r=delta_r,
-        delta_theta=delta_theta,
-        max_r=polar_image.shape[1],
+    ring_radii = rings % n_radii
+    ring_signals = np.zeros((rings.size, n_shifts), dtype=intensities_templates.dtype)
+    np.add.at(
+        ring_signals,
+        (ring_of_spot, np.asarray(theta_templates)[template, spot]),
+        intensities_templates[template, spot],
     )
-    if is_cupy_array(polar_image):
-        dispatcher = cp
-        r = cp.asarray(r)
-        theta = cp.asarray(theta)
-        intensity = cp.asarray(intensity)
-    else:
-        dispatcher = np
-    if intensity_transform_function is not None:
-        intensity = intensity_transform_function(intensity)
-        polar_image = intensity_transform_function(polar_image)
-    if normalize_image:
-        polar_image = polar_image / dispatcher.linalg.norm(polar_image)
-    if normalize_template:
-        intensity = intensity / dispatcher.linalg.norm(intensity)
-    correlation_array = _match_polar_to_polar_template(
-        polar_image,
-        r,
-        theta,
-        intensity,
+    ring_coefficients = np.fft.rfft(ring_signals, axis=1)
+    return (
+        ring_ptr,
+        ring_radii,
+        ring_coefficients.astype(_get_complex_dtype(ring_signals)),
     )
-    angle_array = dispatcher.arange(correlation_array.shape[0]) * delta_theta
-    return angle_array, correlation_array
 
 
-def _get_fast_correlation_index(
-    polar_image,
-    r,
-    intensities,
-    normalize_image,
-    normalize_templates,
-):
-    dispatcher = get_array_module(polar_image)
-    integrated_polar = polar_image.sum(axis=0)
-    rrr = dispatcher.arange(integrated_polar.shape[0]) / integrated_polar.shape[0]
-    integrated_polar = integrated_polar * rrr
-    integrated_templates = _get_integrated_polar_templates(
-        integrated_polar.shape[0],
-        r,
-        intensities,
-        normalize_templates,
-    )
-    if normalize_image:
-        integrated_polar = integrated_polar / np.linalg.norm(integrated_polar)
-    correlations = _match_library_to_polar_fast(
-        integrated_polar,
-        integrated_templates,
-    )
-    return correlations
+def _get_complex_dtype(array):
+    """The complex dtype with the precision of a real array"""
+    return np.result_type(array.dtype, np.complex64)
 
 
-def correlate_library_to_pattern_fast(
-    image,
-    simulations,
-    delta_r=1,
-    delta_theta=1,
-    max_r=None,
-    intensity_transform_function=None,
-    find_direct_beam=False,
-    direct_beam_position=None,
-    normalize_image=True,
-    normalize_templates=True,
+def _take_template_spectra(template_spectra, indexes):
+    """Get the template spectra of a subset of the templates"""
+    ring_ptr, ring_radii, ring_coefficients = template_spectra
+    starts = ring_ptr[indexes]
+    sizes = ring_ptr[np.asarray(indexes) + 1] - starts
+    new_ptr = np.zeros(sizes.size + 1, dtype=np.int64)
+    new_ptr[1:] = np.cumsum(sizes)
+    rows = np.repeat(starts - new_ptr[:-1], sizes) + np.arange(new_ptr[-1])
+    return new_ptr, ring_radii[rows], ring_coefficients[rows]
+
+
+@njit(parallel=True, nogil=True)
+def _match_polar_to_polar_library_batch_fft_cpu(
+    polar_spectra,
+    ring_ptr,
+    ring_radii,
+    ring_coefficients,
+    template_ptr,
+    image_index,
 ):
     """
-    Get the correlation between azimuthally integrated templates and patterns
+    Get the spectra of the in-plane correlation of a batch of polar patterns with
+    their kept templates
 
     Parameters
     ----------
-    image : 2D numpy.ndarray
-        The image of the diffraction pattern
-    simulations : list of diffsims.sims.diffraction_simulation.DiffractionSimulation
-        The diffraction pattern simulation
-    delta_r : float, optional
-        The sampling interval of the radial coordinate in pixels
-    delta_theta : float, optional
-        The sampling interval of the azimuthal coordinate in degrees
-    max_r : float, optional
-        Maximum radius to consider in pixel units. By default it is the
-        distance from the center of the image to a corner
-    intensity_transform_function : Callable, optional
-        Function to apply to both image and template intensities on an
-        element by element basis prior to comparison
-    find_direct_beam : bool, optional
-        Whether to optimize the direct beam, otherwise the center of the image
-        is chosen
-    direct_beam_position : 2-tuple of floats, optional
+    polar_spectra : 3D numpy.ndarray
+        The real FFT along theta of the polar images, shape (P, r, n_shifts // 2 + 1)
+    ring_ptr, ring_radii, ring_coefficients : numpy.ndarray
+        The spectra of the rings of the templates, see :func:`_get_template_spectra`
+    template_ptr, image_index : 1D numpy.ndarray
+        The images to correlate for each template, see
+        :func:`_get_template_pattern_pairs`
+
+    Returns
+    -------
+    spectra, spectra_m : 2D numpy.ndarray
+        The real FFT of the correlation with the direct and the mirrored template
+        for each (template, image) pair, in the order of ``image_index``
+    """
+    N = template_ptr.shape[0] - 1
+    n_freq = polar_spectra.shape[2]
+    n_pairs = image_index.shape[0]
+    spectra = np.empty((n_pairs, n_freq), dtype=polar_spectra.dtype)
+    spectra_m = np.empty((n_pairs, n_freq), dtype=polar_spectra.dtype)
+
+    for template in prange(N):
+        for pair in range(template_ptr[template], template_ptr[template + 1]):
+            image = image_index[pair]
+            for f in range(n_freq):
+                direct = polar_spectra.dtype.type(0)
+                mirrored = polar_spectra.dtype.type(0)
+                for ring in range(ring_ptr[template], ring_ptr[template + 1]):
+                    value = polar_spectra[image, ring_radii[ring], f]
+                    coefficient = ring_coefficients[ring, f]
+                    direct += coefficient.conjugate() * value
+                    mirrored += coefficient * value
+                spectra[pair, f] = direct
+                spectra_m[pair, f] = mirrored
+
+    return spectra, spectra_m
+
+
+@njit(parallel=True, nogil=True)
+def _refine_fft_correlations(
+    polar_images,
+    correlations,
+    correlations_m,
+    r_templates,
+    theta_templates,
+    intensities_templates,
+    template_ptr,
+    image_index,
+    slot_index,
+    n_slots,
+    rtol,
+):
+    """
+    Get the best in-plane shift from the FFT correlations of each pair
+
+    Every shift within ``rtol`` times the maximum of the FFT correlation is
+    recomputed exactly, in the same order and precision as
+    :func:`_match_polar_to_polar_library_batch_cpu`, so that the results are
+    identical to the direct correlation.
+
+    Returns
+    -------
+    best_in_plane_shift, best_in_plane_corr, best_in_plane_shift_m, best_in_plane_corr_m : (P, K) 2D numpy.ndarray
+        See :func:`_match_polar_to_polar_library_batch_cpu`
+    """
+    n_images = polar_images.shape[0]
+    n_shifts = polar_images.shape[2]
+    N = r_templates.shape[0]
+    R = r_templates.shape[1]
+    best_in_plane_shift = np.zeros((n_images, n_slots), dtype=np.int32)
+    best_in_plane_shift_m = np.zeros((n_images, n_slots), dtype=np.int32)
+    best_in_plane_corr = np.zeros((n_images, n_slots), dtype=polar_images.dtype)
+    best_in_plane_corr_m = np.zeros((n_images, n_slots), dtype=polar_images.dtype)
+
+    for template in prange(N):
+        for pair in range(template_ptr[template], template_ptr[template + 1]):
+            image = image_index[pair]
+            slot = slot_index[pair]
+            for mirror in range(2):
+                if mirror:
+                    correlation = correlations_m[pair]
+                else:
+                    correlation = correlations[pair]
+                tolerance = rtol * np.abs(correlation).max() + 1e-300
+                cutoff = correlation.max() - tolerance
+                best_shift = 0
+                best_value = -np.inf
+                for shift in range(n_shifts):
+                    if correlation[shift] < cutoff:
+                        continue
+                    value = polar_images.dtype.type(0)
+                    for spot in range(R):
+                        rsp = r_templates[template, spot]
+                        if rsp == 0:
+                            break
+                        tsp = theta_templates[template, spot]
+                        isp = intensities_templates[template, spot]
+                        if mirror:
+                            k = (shift - tsp) % n_shifts
+                        else:
+                            k = (shift + tsp) % n_shifts
+                        value += polar_images[image, rsp, k] * isp
+                    if value > best_value:
+                        best_value = value
+                        best_shift = shift
+                if mirror:
+                    best_in_plane_shift_m[image, slot] = best_shift
+                    best_in_plane_corr_m[image, slot] = best_value
+                else:
+                    best_in_plane_shift[image, slot] = best_shift
+                    best_in_plane_corr[image, slot] = best_value
+
+    return (
+        best_in_plane_shift,
+        best_in_plane_corr,
+        best_in_plane_shift_m,
+        best_in_plane_corr_m,
+    )
+
+
+def _get_correlation_method(r_templates, n_shifts):
+    """
+    Choose between the direct and the FFT in-plane correlation
+
+    The cost of both methods is estimated for each (template, pattern) pair which
+    is correlated, averaged over the templates. The direct correlation costs about
+    ``4 * n_spots * n_shifts`` operations per pair. The FFT correlation costs about
+    ``4 * n_rings * n_shifts`` operations to multiply the spectra of the rings of
+    the pattern and the template, ``5 * n_shifts * log2(n_shifts)`` for the two
+    inverse FFTs and ``4 * n_shifts`` to find and refine the maximum. The spectra
+    of the templates are computed once (see :func:`_get_template_spectra`) and the
+    spectra of each pattern are shared by all of its kept templates, so they are
+    not included.
+
+    Parameters
+    ----------
+    r_templates : 2D numpy.ndarray
+        r-coordinates of diffraction spots in templates.
+    n_shifts : int
+        The number of azimuthal pixels in the polar images
+
+    Returns
+    -------
+    correlation : str
+        "direct" or "fft"
+    """
+    r_templates = np.asarray(r_templates)
+    n_templates = max(r_templates.shape[0], 1)
+    # spots after the first r == 0 are not used
+    used = np.cumprod(r_templates != 0, axis=1, dtype=bool)
+    n_spots = used.sum() / n_templates
+    r_sorted = np.sort(np.where(used, r_templates, -1), axis=1)
+    new_ring = r_sorted[:, 1:] != r_sorted[:, :-1]
+    n_rings = (
+        (new_ring & (r_sorted[:, 1:] >= 0)).sum() + (r_sorted[:, 0] >= 0).sum()
+    ) / n_templates
+    cost_direct = 4 * n_spots * n_shifts
+    cost_fft = n_shifts * (4 * n_rings + 5 * np.log2(max(n_shifts, 2)) + 4)
+    return "fft" if cost_fft < cost_direct else "direct"
+
+
+def _prepare_polar_chunk(polar_images, transpose, precision=np.float64):
+    """
+    Reshape a chunk of polar images to a contiguous (P, r, theta) array of
+    ``precision`` without NaN
+
+    Returns
+    -------
+    nav_shape : tuple
+        The navigation shape of the chunk
+    polar_images : 3D numpy.ndarray
+        The images in the form (P, r, theta)
+    """
+    nav_shape = polar_images.shape[:-2]
+    polar_images = polar_images.reshape((-1,) + polar_images.shape[-2:])
+    if not transpose:
+        # the correlation kernels read along theta
+        polar_images = polar_images.transpose(0, 2, 1)
+    polar_images = np.nan_to_num(polar_images.astype(precision, copy=False))
+    return nav_shape, np.ascontiguousarray(polar_images)
+
+
+def _cast_templates(integrated_templates, intensities_templates, precision):
+    """Cast the integrated templates and the intensities to ``precision``"""
+    return (
+        np.asarray(integrated_templates, dtype=precision),
+        np.asarray(intensities_templates, dtype=precision),
+    )
+
+
+def _check_correlation_method(correlation, r_templates, n_shifts):
+    """Resolve "auto" and check the in-plane correlation method"""
+    if correlation == "auto":
+        correlation = _get_correlation_method(r_templates, n_shifts)
+    if correlation not in ("direct", "fft"):
+        raise ValueError(
+            f"correlation must be 'auto', 'direct' or 'fft', not '{correlation}'"
+        )
+    return correlation
+
+
+def _get_fft_tolerance(dtype):
+    """
+    The relative tolerance below the maximum of the FFT correlation within which
+    the shifts are recomputed exactly, see :func:`_refine_fft_correlations`
+    """
+    return float(np.sqrt(np.finfo(dtype).eps))
+
+
+def _get_batch_size(n_slots, n_shifts, correlation):
+    """
+    The number of images to match at once, limiting the size of the intermediate
+    (images, kept templates) arrays
+    """
+    if correlation == "fft":
+        return max(2**21 // (n_slots * n_shifts), 1)
+    return max(2**22 // n_slots, 1)
+
+
+def _correlate_kept_templates(
+    polar_images,
+    template_indexes,
+    r_templates,
+    theta_templates,
+    intensities_templates,
+    correlation,
+    template_spectra=None,
+):
+    """
+    Get the best in-plane correlation of a batch of images with their kept templates
+
+    Parameters
+    ----------
+    polar_images : 3D numpy.ndarray
+        The images in polar coordinates in the form (P, r, theta)
+    template_indexes : 2D numpy.ndarray
+        The kept templates for each image, of shape (P, K). Slots with a negative
+        index are not correlated and get a correlation of -inf.
+    r_templates, theta_templates, intensities_templates : 2D numpy.ndarray
+        The templates, see :func:`_match_polar_to_polar_library_cpu`
+    correlation : str
+        "direct" or "fft"
+    template_spectra : tuple, optional
+        The spectra of the templates for the FFT correlation, see
+        :func:`_get_template_spectra`. Computed if not given.
+
+    Returns
+    -------
+    best_in_plane_shift, best_in_plane_corr, best_in_plane_shift_m, best_in_plane_corr_m : (P, K) 2D numpy.ndarray
+        See :func:`_match_polar_to_polar_library_batch_cpu`
+    """
+    n_shifts = polar_images.shape[2]
+    n_slots = template_indexes.shape[1]
+    pairs = _get_template_pattern_pairs(template_indexes, r_templates.shape[0])
+    if correlation == "fft":
+        if template_spectra is None:
+            template_spectra = _get_template_spectra(
+                r_templates, theta_templates, intensities_templates, n_shifts
+            )
+        polar_spectra = np.fft.rfft(polar_images, axis=2)
+        spectra = _match_polar_to_polar_library_batch_fft_cpu(
+            polar_spectra.astype(_get_complex_dtype(polar_images)),
+            *template_spectra,
+            *pairs[:2],
+        )
+        correlations = _refine_fft_correlations(
+            polar_images,
+            *(np.fft.irfft(spectrum, n=n_shifts, axis=1) for spectrum in spectra),
+            r_templates,
+            theta_templates,
+            intensities_templates,
+            *pairs,
+            n_slots,
+            _get_fft_tolerance(polar_images.dtype),
+        )
+    else:
+        correlations = _match_polar_to_polar_library_batch_cpu(
+            polar_images,
+            r_templates,
+            theta_templates,
+            intensities_templates,
+            *pairs,
+            n_slots,
+        )
+    unused = template_indexes < 0
+    if unused.any():
+        correlations[1][unused] = -np.inf
+        correlations[3][unused] = -np.inf
+    return correlations
+
+
+@njit(parallel=True, nogil=True)
+def _get_n_best_indices(cors, n_best):
+    """
+    The indexes of the n_best largest correlations of each row in decreasing
+    order, keeping only n_best values per row in a sorted buffer
+
+    With equal correlations the first index comes first, like in
+    :func:`_match_polar_to_polar_library_n_best_cpu`.
+    """
+    indices = np.zeros((cors.shape[0], n_best), dtype=np.int64)
+    for row in prange(cors.shape[0]):
+        best = np.empty(n_best, dtype=cors.dtype)
+        n_kept = 0
+        for j in range(cors.shape[1]):
+            cor = cors[row, j]
+            if n_kept == n_best and not cor > best[n_best - 1]:
+                continue
+            position = min(n_kept, n_best - 1)
+            while position > 0 and cor > best[position - 1]:
+                best[position] = best[position - 1]
+                indices[row, position] = indices[row, position - 1]
+                position -= 1
+            best[position] = cor
+            indices[row, position] = j
+            n_kept = min(n_kept + 1, n_best)
+    return indices
+
+
+def _get_n_best_batch(
+    template_indexes,
+    best_in_plane_shift,
+    best_in_plane_corr,
+    best_in_plane_shift_m,
+    best_in_plane_corr_m,
+    n_best,
+):
+    """
+    Combine the direct and mirrored correlations and get the n_best solutions
+    for each image, see :func:`_mixed_matching_lib_to_polar`
+
+    Returns
+    -------
+    answer : 3D numpy.ndarray
+        Array of shape (P, n_best, 4)
+    """
+    positive_is_best = best_in_plane_corr >= best_in_plane_corr_m
+    best_sign = np.where(positive_is_best, 1, -1)
+    best_cors = np.where(positive_is_best, best_in_plane_corr, best_in_plane_corr_m)
+    best_angles = np.where(positive_is_best, best_in_plane_shift, best_in_plane_shift_m)
+    rows = np.arange(best_cors.shape[0])[:, np.newaxis]
+    if n_best == 1:
+        n_best_indices = np.argmax(best_cors, axis=1)[:, np.newaxis]
+    else:
+        n_best_indices = _get_n_best_indices(best_cors, n_best)
+    answer = np.empty((best_cors.shape[0], n_best, 4), dtype=best_cors.dtype)
+    answer[:, :, 0] = template_indexes[rows, n_best_indices]
+    answer[:, :, 1] = best_cors[rows, n_best_indices]
+    answer[:, :, 2] = best_angles[rows, n_best_indices]
+    answer[:, :, 3] = best_sign[rows, n_best_indices]
+    return answer
+
+
+def _mixed_matching_lib_to_polar_chunk(
+    polar_images,
+    integrated_templates,
+    r_templates,
+    theta_templates,
+    intensities_templates,
+    n_keep,
+    frac_keep,
+    n_best,
+    transpose=False,
+    correlation="auto",
+    batch_size=None,
+    template_spectra=None,
+    precision=np.float64,
+):
+    """
+    Match a chunk of polar images to a filtered subset of polar templates
+
+    Batched version of :func:`_mixed_matching_lib_to_polar`. The fast prefilter
+    for all of the images is one matrix product, and the full matching loops over
+    the templates outermost so that each template is reused for all images.
+
+    Parameters
+    ----------
+    polar_images : numpy.ndarray
+        images in polar coordinates of shape (..., theta, r), or (..., r, theta)
+        if ``transpose`` is True
+    integrated_templates : 2D ndarray, (N, r_max)
+        azimuthally integrated templates
+    r_templates : 2D ndarray, (N, R)
+        r coordinates of diffraction spots in all N templates
+    theta_templates : 2D ndarray, (N, R)
+        theta coordinates of diffraction spots in all N templates
+    intensities_templates : 2D ndarray, (N, R)
+        intensities of diffraction spots in all N templates
+    n_keep : float
+        number of templates to pass to the full indexation
+    frac_keep : float
+        fraction of templates to pass on to the full indexation
+    n_best : int
+        number of solutions to return in decending order of fit
+    transpose : bool
+        Whether the last two axes of ``polar_images`` are (r, theta)
+    correlation : str
+        How the in-plane correlation is computed. "direct" accumulates the shifted
+        rows of the image for every spot. "fft" multiplies the spectra of the rings
+        of the image and the template, which is faster for templates with many spots
+        on few rings. "auto" chooses using :func:`_get_correlation_method`. All of
+        them give identical results.
+    batch_size : int, optional
+        The number of images matched at the same time. By default this is chosen
+        to limit the size of the intermediate (images, kept templates) arrays.
+    template_spectra : tuple, optional
+        The spectra of the templates for the FFT correlation, see
+        :func:`_get_template_spectra`. Pass them when matching many chunks, so
+        that they are only computed once.
+    precision : np.float32 or np.float64
+        The floating point type of the polar images, the templates and the
+        correlations. Single precision halves the memory traffic of the matching.
+
+    Returns
+    -------
+    answer : numpy.ndarray, (..., n_best, 4)
+        See :func:`_mixed_matching_lib_to_polar`. Always float64, so that large
+        template indexes are represented exactly.
+    """
+    nav_shape, polar_images = _prepare_polar_chunk(polar_images, transpose, precision)
+    integrated_templates, intensities_templates = _cast_templates(
+        integrated_templates, intensities_templates, precision
+    )
+    n_templates = r_templates.shape[0]
+    n_slots = _get_max_n(n_templates, n_keep, frac_keep)
+    n_best = max(min(n_best, n_slots), 1)
+    n_shifts = polar_images.shape[2]
+    correlation = _check_correlation_method(correlation, r_templates, n_shifts)
+    if correlation == "fft" and template_spectra is None:
+        template_spectra = _get_template_spectra(
+            r_templates, theta_templates, intensities_templates, n_shifts
+        )
+    if batch_size is None:
+        batch_size = _get_batch_size(n_slots, n_shifts, correlation)
+    answer = np.empty((polar_images.shape[0], n_best, 4), dtype=np.float64)
+    for start in range(0, polar_images.shape[0], batch_size):
+        batch = polar_images[start : start + batch_size]
+        template_indexes = _prefilter_templates_batch(
+            batch, integrated_templates, frac_keep, n_keep
+        )
+        correlations = _correlate_kept_templates(
+            batch,
+            template_indexes,
+            r_templates,
+            theta_templates,
+            intensities_templates,
+            correlation,
+            template_spectra,
+        )
+        answer[start : start + batch_size] = _get_n_best_batch(
+            template_indexes, *correlations, n_best
+        )
+    return answer.reshape(nav_shape + (n_best, 4))
+
+
+def _build_search_index(directions, n_coarse=None, n_neighbours=6):
+    """
+    Build the coarse-to-fine search index for the templates of one phase
+
+    Parameters
+    ----------
+    directions : 2D numpy.ndarray
+        Unit vectors of shape (N, 3) which characterize each template, usually the
+        beam direction in the crystal.
+    n_coarse : int, optional
+        The number of coarse templates. Default is ``ceil(sqrt(N))``.
+    n_neighbours : int
+        The number of neighbouring coarse templates whose cells are included in the
+        neighbourhood of each coarse template.
+
+    Returns
+    -------
+    TemplateSearchIndex
+    """
+    n_templates = directions.shape[0]
+    if n_coarse is None:
+        n_coarse = int(np.ceil(np.sqrt(n_templates)))
+    n_coarse = int(min(max(n_coarse, 1), n_templates))
+    # farthest point sampling gives an evenly spread coarse grid
+    coarse_indexes = np.empty(n_coarse, dtype=np.int64)
+    coarse_indexes[0] = 0
+    distance = 1 - directions @ directions[0]
+    for i in range(1, n_coarse):
+        coarse_indexes[i] = np.argmax(distance)
+        distance = np.minimum(distance, 1 - directions @ directions[coarse_indexes[i]])
+    tree = scipy.spatial.cKDTree(directions[coarse_indexes])
+    # every template belongs to the cell of the closest coarse template
+    _, cell = tree.query(directions)
+    cell_order = np.argsort(cell, kind="stable")
+    cell_ptr = np.zeros(n_coarse + 1, dtype=np.int64)
+    cell_ptr[1:] = np.cumsum(np.bincount(cell, minlength=n_coarse))
+    # the neighbourhood of a coarse template is its cell and the adjacent cells
+    k = min(n_neighbours + 1, n_coarse)
+    _, adjacent = tree.query(directions[coarse_indexes], k=k)
+    adjacent = adjacent.reshape(n_coarse, k)
+    neighbour_ptr = np.zeros(n_coarse + 1, dtype=np.int64)
+    neighbour_indexes = []
+    for i in range(n_coarse):
+        members = np.concatenate(
+            [cell_order[cell_ptr[c] : cell_ptr[c + 1]] for c in adjacent[i]]
+        )
+        neighbour_indexes.append(np.sort(members))
+        neighbour_ptr[i + 1] = neighbour_ptr[i] + members.size
+    return TemplateSearchIndex(
+        coarse_indexes, neighbour_ptr, np.concatenate(neighbour_indexes), cell
+    )
+
+
+def _combine_search_indexes(search_indexes, n_templates):
+    """
+    Combine the search indexes of several phases into one for the concatenated
+    templates
+
+    Parameters
+    ----------
+    search_indexes : list of TemplateSearchIndex
+        The search index of each phase
+    n_templates : list of int
+        The number of templates of each phase
+    """
+    if len(search_indexes) == 1:
+        return search_indexes[0]
+    offsets = np.cumsum([0] + list(n_templates[:-1]))
+    coarse_indexes = np.concatenate(
+        [
+            index.coarse_indexes + offset
+            for index, offset in zip(search_indexes, offsets)
+        ]
+    )
+    neighbour_indexes = np.concatenate(
+        [
+            index.neighbour_indexes + offset
+            for index, offset in zip(search_indexes, offsets)
+        ]
+    )
+    ptr_offsets = np.cumsum([0] + [index.neighbour_ptr[-1] for index in search_indexes])
+    neighbour_ptr = np.concatenate(
+        [[0]]
+        + [
+            index.neighbour_ptr[1:] + offset
+            for index, offset in zip(search_indexes, ptr_offsets)
+        ]
+    )
+    cell_offsets = np.cumsum(
+        [0] + [index.coarse_indexes.size for index in search_indexes]
+    )
+    template_cells = np.concatenate(
+        [
+            index.template_cells + offset
+            for index, offset in zip(search_indexes, cell_offsets)
+        ]
+    )
+    return TemplateSearchIndex(
+        coarse_indexes, neighbour_ptr, neighbour_indexes, template_cells
+    )
+
+
+def _get_min_neighbourhood_size(search_index):
+    """The number of templates in the smallest neighbourhood of a search index"""
+    return int(np.diff(search_index.neighbour_ptr).min())
+
+
+def _check_n_best_search_index(n_best, search_index):
+    """
+    Raise a ValueError if some neighbourhood of a search index has fewer than
+    ``n_best`` templates, so that every searched pattern can get ``n_best`` solutions
+    """
+    n_min = _get_min_neighbourhood_size(search_index)
+    if n_best > n_min:
+        raise ValueError(
+            f"n_best ({n_best}) is larger than the smallest neighbourhood of the "
+            f"template search index ({n_min} templates). Use a smaller n_best or a "
+            "search index with fewer coarse templates or more neighbours."
+        )
+
+
+def get_template_search_index(simulation, n_coarse=None, n_neighbours=6, rebuild=False):
+    """
+    Get the index used for the hierarchical orientation search of a simulation
+
+    The templates are grouped by their beam direction. A coarse subset of the
+    templates is chosen which evenly covers the simulated beam directions, and each
+    template is assigned to the cell of its closest coarse template. The
+    neighbourhood of a coarse template is its own cell together with the cells of
+    the ``n_neighbours`` closest coarse templates.
+
+    The index is stored in the ``template_search_index`` attribute of the
+    simulation, so that it is only built once for each simulation and set of
+    parameters.
+
+    Parameters
+    ----------
+    simulation : diffsims.simulations.Simulation2D
+        The simulated diffraction patterns
+    n_coarse : int, optional
+        The number of coarse templates of each phase. Default is the square root of
+        the number of templates.
+    n_neighbours : int
+        The number of adjacent cells in the neighbourhood of each coarse template.
+    rebuild : bool
+        Build the index even if the simulation already has one with the same
+        parameters.
+
+    Returns
+    -------
+    TemplateSearchIndex
+        Named tuple with the indexes of the coarse templates, ``coarse_indexes``,
+        the neighbourhoods in compressed sparse row format: the templates in the
+        neighbourhood of coarse template ``i`` are
+        ``neighbour_indexes[neighbour_ptr[i]:neighbour_ptr[i + 1]]``, and the cell
+        of each template, ``template_cells``.
+    """
+    search_index = getattr(simulation, "template_search_index", None)
+    parameters = getattr(simulation, "template_search_index_parameters", None)
+    if (
+        search_index is not None
+        and parameters == (n_coarse, n_neighbours)
+        and not rebuild
+    ):
+        return search_index
+    rotations = simulation.rotations
+    if not isinstance(rotations, (list, tuple, np.ndarray)):
+        rotations = [rotations]
+    search_indexes = []
+    n_templates = []
+    for phase_rotations in rotations:
+        directions = (phase_rotations * Vector3d.zvector()).unit.data.reshape(-1, 3)
+        search_indexes.append(_build_search_index(directions, n_coarse, n_neighbours))
+        n_templates.append(directions.shape[0])
+    search_index = _combine_search_indexes(search_indexes, n_templates)
+    simulation.template_search_index = search_index
+    simulation.template_search_index_parameters = (n_coarse, n_neighbours)
+    return search_index
+
+
+def _memmap_npz(filename, mmap_mode="r"):
+    """
+    Memory map the arrays of an uncompressed .npz file
+
+    Parameters
+    ----------
+    filename : str
+        The .npz file, written with :func:`numpy.savez`
+    mmap_mode : str
+        The mode of :class:`numpy.memmap`
+
+    Returns
+    -------
+    arrays : dict
+        The memory mapped arrays by name
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(
+                    f"{filename} is compressed and can not be memory mapped"
+                )
+            # skip the local file header to the start of the .npy file
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(name_length + extra_length, 1)
+            if np.lib.format.read_magic(f) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            name = info.filename[: -len(".npy")]
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    filename,
+                    dtype=dtype,
+                    mode=mmap_mode,
+                    offset=f.tell(),
+                    shape=shape,
+                    order="F" if fortran_order else "C",
+                )
+    return arrays
+
+
+def _get_simulation_fingerprint(simulation):
+    """
+    Hash the phases and rotations of a simulation, which identify its templates
+
+    Returns
+    -------
+    fingerprint : numpy.ndarray
+        The sha256 digest as 32 uint8
+    """
+    phases = simulation.phases
+    rotations = simulation.rotations
+    if not isinstance(rotations, (list, tuple, np.ndarray)):
+        phases = [phases]
+        rotations = [rotations]
+    h = hashlib.sha256()
+    for phase, phase_rotations in zip(phases, rotations):
+        h.update(f"{phase.name}{phase.space_group}".encode())
+        h.update(np.ascontiguousarray(phase_rotations.data, dtype=float).tobytes())
+    return np.frombuffer(h.digest(), dtype=np.uint8).copy()
+
+
+def _get_array_fingerprint(*arrays):
+    """
+    Hash some arrays, e.g. to identify the templates or the polar grid used for
+    a computation
+
+    Returns
+    -------
+    fingerprint : str
+        The hexadecimal sha256 digest
+    """
+    h = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        h.update(f"{array.dtype.str}{array.shape}".encode())
+        h.update(array.tobytes())
+    return h.hexdigest()
+
+
+def _get_function_name(function):
+    """The qualified name of a function, to identify it in the attributes of a
+    checkpoint"""
+    if function is None:
+        return None
+    module = getattr(function, "__module__", "")
+    return f"{module}.{getattr(function, '__qualname__', repr(function))}"
+
+
+class PolarTemplateBank:
+    """
+    The templates of a simulation on a polar grid, prepared for orientation mapping.
+
+    Flattening the simulations to polar coordinates and integrating the templates
+    is repeated for every call to
+    :meth:`pyxem.signals.PolarDiffraction2D.get_orientation`. A bank holds the
+    result for one polar grid in compact dtypes, so that it can be reused, saved
+    with :meth:`save` and loaded with :meth:`load`. Banks loaded from .npz files
+    are memory mapped, so several processes can share one read-only copy.
+
+    Parameters
+    ----------
+    r_templates, theta_templates : 2D numpy.ndarray
+        The radial and azimuthal pixel of the spots of each template, of shape
+        (N, R) with N the number of templates and R the maximum number of spots.
+    intensities_templates : 2D numpy.ndarray
+        The intensities of the spots, normalized if ``normalize_templates``.
+    integrated_templates : 2D numpy.ndarray
+        The azimuthally integrated templates of shape (N, n_r).
+    template_norms : 1D numpy.ndarray
+        The norm of the intensities of each template before normalization.
+    radial_axis, azimuthal_axis : 1D numpy.ndarray
+        The polar grid of the templates.
+    simulation_fingerprint : 1D numpy.ndarray
+        Hash of the phases and rotations of the simulation the templates were
+        built from, used to check that a bank matches a simulation.
+    normalize_templates : bool
+        Whether the templates are normalized.
+    """
+
+    _array_names = (
+        "r_templates",
+        "theta_templates",
+        "intensities_templates",
+        "integrated_templates",
+        "template_norms",
+        "radial_axis",
+        "azimuthal_axis",
+        "simulation_fingerprint",
+    )
+
+    def __init__(
+        self,
+        r_templates,
+        theta_templates,
+        intensities_templates,
+        integrated_templates,
+        template_norms,
+        radial_axis,
+        azimuthal_axis,
+        simulation_fingerprint,
+        normalize_templates=True,
+    ):
+        self.r_templates = r_templates
+        self.theta_templates = theta_templates
+        self.intensities_templates = intensities_templates
+        self.integrated_templates = integrated_templates
+        self.template_norms = template_norms
+        self.radial_axis = radial_axis
+        self.azimuthal_axis = azimuthal_axis
+        self.simulation_fingerprint = simulation_fingerprint
+        self.normalize_templates = bool(normalize_templates)
+
+    @classmethod
+    def from_simulation(
+        cls,
+        simulation,
+        radial_axis,
+        azimuthal_axis,
+        normalize_templates=True,
+        index_dtype=np.int16,
+        intensity_dtype=np.float32,
+    ):
+        """
+        Build the template bank of a simulation for a polar grid.
+
+        Parameters
+        ----------
+        simulation : diffsims.simulations.Simulation2D
+            The simulated diffraction patterns.
+        radial_axis, azimuthal_axis : 1D numpy.ndarray
+            The radial and azimuthal axes of the polar signal, for example
+            ``signal.axes_manager.signal_axes[1].axis`` and
+            ``signal.axes_manager.signal_axes[0].axis``.
+        normalize_templates : bool
+            Normalize the template intensities.
+        index_dtype : numpy.dtype
+            The dtype of the spot pixel indexes.
+        intensity_dtype : numpy.dtype
+            The dtype of the intensities and integrated templates.
+
+        Returns
+        -------
+        PolarTemplateBank
+        """
+        radial_axis = np.asarray(radial_axis, dtype=np.float64)
+        azimuthal_axis = np.asarray(azimuthal_axis, dtype=np.float64)
+        (
+            r_templates,
+            theta_templates,
+            intensities_templates,
+        ) = simulation.polar_flatten_simulations(
+            radial_axes=radial_axis,
+            azimuthal_axes=azimuthal_axis,
+        )
+        max_index = max(radial_axis.size, azimuthal_axis.size)
+        if max_index > np.iinfo(index_dtype).max:
+            raise ValueError(
+                f"The polar grid is too large for the index dtype {index_dtype}"
+            )
+        integrated_templates = _get_integrated_polar_templates(
+            radial_axis.size, r_templates, intensities_templates, normalize_templates
+        )
+        template_norms = _get_row_norms(intensities_templates)
+        if normalize_templates:
+            intensities_templates = _norm_rows(intensities_templates)
+        return cls(
+            r_templates.astype(index_dtype),
+            theta_templates.astype(index_dtype),
+            intensities_templates.astype(intensity_dtype),
+            integrated_templates.astype(intensity_dtype),
+            template_norms.astype(intensity_dtype),
+            radial_axis,
+            azimuthal_axis,
+            _get_simulation_fingerprint(simulation),
+            normalize_templates=normalize_templates,
+        )
+
+    def __repr__(self):
+        n_templates, n_spots = self.r_templates.shape
+        return (
+            f"<{self.__class__.__name__}, {n_templates} templates, {n_spots} spots, "
+            f"polar grid: ({self.azimuthal_axis.size}, {self.radial_axis.size})>"
+        )
+
+    @property
+    def n_templates(self):
+        """The number of templates in the bank."""
+        return self.r_templates.shape[0]
+
+    def check_simulation(self, simulation, normalize_templates=None):
+        """
+        Raise a ValueError if the bank was not built from a simulation.
+
+        Parameters
+        ----------
+        simulation : diffsims.simulations.Simulation2D
+            The simulated diffraction patterns.
+        normalize_templates : bool, optional
+            If given, also raise if the normalization of the bank differs.
+        """
+        n_templates = sum(
+            np.size(rotations)
+            for rotations in (
+                simulation.rotations
+                if isinstance(simulation.rotations, (list, tuple, np.ndarray))
+                else [simulation.rotations]
+            )
+        )
+        if n_templates != self.n_templates:
+            raise ValueError(
+                f"The template bank has {self.n_templates} templates but the "
+                f"simulation has {n_templates}."
+            )
+        if not np.array_equal(
+            _get_simulation_fingerprint(simulation), self.simulation_fingerprint
+        ):
+            raise ValueError(
+                "The phases or rotations of the simulation do not match the template "
+                "bank."
+            )
+        if (
+            normalize_templates is not None
+            and bool(normalize_templates) != self.normalize_templates
+        ):
+            raise ValueError(
+                f"normalize_templates is {normalize_templates} but the template bank "
+                f"was built with normalize_templates={self.normalize_templates}."
+            )
+
+    def check_axes(self, radial_axis, azimuthal_axis):
+        """
+        Raise a ValueError if the polar grid of a signal differs from the bank.
+
+        Parameters
+        ----------
+        radial_axis, azimuthal_axis : 1D numpy.ndarray
+            The radial and azimuthal axes of the polar signal.
+        """
+        for name, axis, bank_axis in (
+            ("radial", radial_axis, self.radial_axis),
+            ("azimuthal", azimuthal_axis, self.azimuthal_axis),
+        ):
+            if np.shape(axis) != bank_axis.shape or not np.allclose(axis, bank_axis):
+                raise ValueError(
+                    f"The {name} axis of the signal does not match the template bank."
+                )
+
+    def save(self, filename):
+        """
+        Save the bank to an uncompressed .npz file or a zarr directory.
+
+        Parameters
+        ----------
+        filename : str
+            Files ending with ".zarr" are saved with zarr, otherwise with
+            :func:`numpy.savez`.
+        """
+        arrays = {name: np.asarray(getattr(self, name)) for name in self._array_names}
+        arrays["normalize_templates"] = np.array(self.normalize_templates)
+        if str(filename).endswith(".zarr"):
+            import zarr
+
+            group = zarr.open_group(str(filename), mode="w")
+            for name, array in arrays.items():
+                group.array(name, array)
+        else:
+            np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename, mmap_mode="r"):
+        """
+        Load a bank saved with :meth:`save`.
+
+        Parameters
+        ----------
+        filename : str
+            The .npz file or .zarr directory.
+        mmap_mode : str or None
+            How the arrays of .npz files are memory mapped, see
+            :class:`numpy.memmap`. If None, they are read into memory. Arrays in
+            zarr directories are always read into memory.
+
+        Returns
+        -------
+        PolarTemplateBank
+        """
+        if str(filename).endswith(".zarr"):
+            import zarr
+
+            group = zarr.open_group(str(filename), mode="r")
+            arrays = {name: group[name][...] for name in group.array_keys()}
+        elif mmap_mode is None:
+            with np.load(filename) as f:
+                arrays = {name: f[name] for name in f.files}
+        else:
+            arrays = _memmap_npz(filename, mmap_mode)
+        normalize_templates = bool(arrays.pop("normalize_templates"))
+        return cls(
+            **{name: arrays[name] for name in cls._array_names},
+            normalize_templates=normalize_templates,
+        )
+
+
+def _get_neighbourhood_candidates(coarse_hits, neighbour_ptr, neighbour_indexes, n_min):
+    """
+    Get the union of the neighbourhoods of the coarse hits of each image
+
+    Parameters
+    ----------
+    coarse_hits : 2D numpy.ndarray
+        The best coarse templates (positions in ``coarse_indexes``) of each image,
+        of shape (P, k)
+    neighbour_ptr, neighbour_indexes : 1D numpy.ndarray
+        The neighbourhoods, see :func:`get_template_search_index`
+    n_min : int
+        The minimum number of columns of the output
+
+    Returns
+    -------
+    candidates : 2D numpy.ndarray
+        The sorted candidate templates of each image, padded with -1
+    """
+    sizes = neighbour_ptr[coarse_hits + 1] - neighbour_ptr[coarse_hits]
+    n_columns = max(sizes.sum(axis=1).max(), n_min)
+    candidates = np.full((coarse_hits.shape[0], n_columns), -1, dtype=np.int64)
+    for image in range(coarse_hits.shape[0]):
+        hits = coarse_hits[image]
+        members = np.concatenate(
+            [neighbour_indexes[neighbour_ptr[c] : neighbour_ptr[c + 1]] for c in hits]
+        )
+        members = np.unique(members)
+        candidates[image, : members.size] = members
+    return candidates
+
+
+def _hierarchical_matching_lib_to_polar_chunk(
+    polar_images,
+    integrated_templates,
+    r_templates,
+    theta_templates,
+    intensities_templates,
+    search_index,
+    n_keep,
+    frac_keep,
+    n_best,
+    n_coarse_best=3,
+    transpose=False,
+    correlation="auto",
+    template_spectra=None,
+    precision=np.float64,
+):
+    """
+    Match a chunk of polar images with a coarse-to-fine search over the templates
+
+    The images are first matched to the coarse templates, using the ``n_keep`` or
+    ``frac_keep`` prefilter. Then they are fully matched to the templates in the
+    neighbourhoods of the ``n_coarse_best`` best coarse templates.
+
+    Parameters
+    ----------
+    polar_images : numpy.ndarray
+        images in polar coordinates of shape (..., theta, r), or (..., r, theta)
+        if ``transpose`` is True
+    integrated_templates, r_templates, theta_templates, intensities_templates : 2D ndarray
+        All of the templates, see :func:`_mixed_matching_lib_to_polar_chunk`
+    search_index : TemplateSearchIndex
+        The search index, see :func:`get_template_search_index`
+    n_keep, frac_keep : float
+        The number or fraction of the coarse templates to fully match
+    n_best : int
+        number of solutions to return in decending order of fit. Must not be larger
+        than the smallest neighbourhood of ``search_index``.
+    n_coarse_best : int
+        The number of best coarse templates whose neighbourhoods are searched.
+    transpose : bool
+        Whether the last two axes of ``polar_images`` are (r, theta)
+    correlation : str
+        "auto", "direct" or "fft", see :func:`_mixed_matching_lib_to_polar_chunk`
+    template_spectra : tuple, optional
+        The spectra of all of the templates, see :func:`_get_template_spectra`
+    precision : np.float32 or np.float64
+        The floating point type of the matching, see
+        :func:`_mixed_matching_lib_to_polar_chunk`
+
+    Returns
+    -------
+    answer : numpy.ndarray, (..., n_best, 4)
+        See :func:`_mixed_matching_lib_to_polar_chunk`
+    """
+    _check_n_best_search_index(n_best, search_index)
+    nav_shape, polar_images = _prepare_polar_chunk(polar_images, transpose, precision)
+    integrated_templates, intensities_templates = _cast_templates(
+        integrated_templates, intensities_templates, precision
+    )
+    coarse_indexes = search_index.coarse_indexes
+    correlation = _check_correlation_method(
+        correlation, r_templates, polar_images.shape[2]
+    )
+    if correlation == "fft" and template_spectra is None:
+        template_spectra = _get_template_spectra(
+            r_templates, theta_templates, intensities_templates, polar_images.shape[2]
+        )
+    coarse = _mixed_matching_lib_to_polar_chunk(
+        polar_images,
+        integrated_templates[coarse_indexes],
+        r_templates[coarse_indexes],
+        theta_templates[coarse_indexes],
+        intensities_templates[coarse_indexes],
+        n_keep,
+        frac_keep,
+        n_coarse_best,
+        transpose=True,
+        correlation=correlation,
+        template_spectra=(
+            None
+            if template_spectra is None
+            else _take_template_spectra(template_spectra, coarse_indexes)
+        ),
+        precision=precision,
+    )
+    coarse_hits = coarse[:, :, 0].astype(np.int64)
+    candidates = _get_neighbourhood_candidates(
+        coarse_hits, search_index.neighbour_ptr, search_index.neighbour_indexes, n_best
+    )
+    batch_size = _get_batch_size(
+        candidates.shape[1], polar_images.shape[2], correlation
+    )
+    answer = np.empty((polar_images.shape[0], n_best, 4), dtype=np.float64)
+    for start in range(0, polar_images.shape[0], batch_size):
+        template_indexes = candidates[start : start + batch_size]
+        correlations = _correlate_kept_templates(
+            polar_images[start : start + batch_size],
+            template_indexes,
+            r_templates,
+            theta_templates,
+            intensities_templates,
+            correlation,
+            template_spectra,
+        )
+        answer[start : start + batch_size] = _get_n_best_batch(
+            template_indexes, *correlations, n_best
+        )
+    return answer.reshape(nav_shape + (n_best, 4))
+
+
+def _get_seed_neighbours(nav_shape, seed_step):
+    """
+    Find the seed positions of a chunk and the neighbouring seeds of the others
+
+    The seeds are the positions where every navigation index is a multiple of
+    ``seed_step``. The neighbouring seeds of a position are the corners of the
+    cell of the seed grid containing it.
+
+    Returns
+    -------
+    is_seed : 1D numpy.ndarray
+        Whether each (flattened) position is a seed
+    neighbours : 2D numpy.ndarray
+        The flat positions of the neighbouring seeds of the positions which are not
+        seeds, of shape (n_other, 2**ndim). Missing neighbours (at the end of the
+        chunk) are replaced by the first neighbour.
+    """
+    nav_shape = tuple(nav_shape) or (1,)
+    grid = np.indices(nav_shape).reshape(len(nav_shape), -1).T
+    is_seed = np.all(grid % seed_step == 0, axis=1)
+    others = grid[~is_seed]
+    lower = others - others % seed_step
+    upper = lower + seed_step
+    neighbours = []
+    for corner in np.ndindex((2,) * len(nav_shape)):
+        position = np.where(np.array(corner, dtype=bool), upper, lower)
+        outside = np.any(position >= np.array(nav_shape), axis=1)
+        position[outside] = lower[outside]
+        neighbours.append(np.ravel_multi_index(position.T, nav_shape))
+    return is_seed, np.stack(neighbours, axis=1)
+
+
+def _seeded_matching_lib_to_polar_chunk(
+    polar_images,
+    integrated_templates,
+    r_templates,
+    theta_templates,
+    intensities_templates,
+    search_index,
+    n_keep,
+    frac_keep,
+    n_best,
+    seed_step=4,
+    fallback_threshold=0.9,
+    transpose=False,
+    correlation="auto",
+    template_spectra=None,
+    precision=np.float64,
+):
+    """
+    Match a chunk of polar images using the results of neighbouring positions
+
+    A sparse grid of seed positions is matched with the full search. The other
+    positions are matched to the templates in the neighbourhoods of the best
+    templates of the surrounding seeds. When the best correlation of a position is
+    less than ``fallback_threshold`` times the best correlation of the surrounding
+    seeds, it is matched again with the full search.
+
+    Parameters
+    ----------
+    polar_images : numpy.ndarray
+        images in polar coordinates of shape (..., theta, r), or (..., r, theta)
+        if ``transpose`` is True
+    integrated_templates, r_templates, theta_templates, intensities_templates : 2D ndarray
+        All of the templates, see :func:`_mixed_matching_lib_to_polar_chunk`
+    search_index : TemplateSearchIndex
+        The neighbourhoods of the templates, see :func:`get_template_search_index`
+    n_keep, frac_keep : float
+        The number or fraction of templates fully matched in the full search
+    n_best : int
+        number of solutions to return in decending order of fit. Must not be larger
+        than the smallest neighbourhood of ``search_index``.
+    seed_step : int
+        The spacing of the seed positions along each navigation axis
+    fallback_threshold : float
+        The fraction of the correlation of the neighbouring seeds below which the
+        full search is used
+    transpose : bool
+        Whether the last two axes of ``polar_images`` are (r, theta)
+    correlation : str
+        "auto", "direct" or "fft", see :func:`_mixed_matching_lib_to_polar_chunk`
+    template_spectra : tuple, optional
+        The spectra of the templates, see :func:`_get_template_spectra`
+    precision : np.float32 or np.float64
+        The floating point type of the matching, see
+        :func:`_mixed_matching_lib_to_polar_chunk`
+
+    Returns
+    -------
+    answer : numpy.ndarray, (..., n_best, 5)
+        The first four columns as in :func:`_mixed_matching_lib_to_polar_chunk`.
+        The last column is how the position was matched: 0 for a seed, 1 for the
+        seeded search and 2 for a fallback to the full search.
+    """
+    _check_n_best_search_index(n_best, search_index)
+    nav_shape, polar_images = _prepare_polar_chunk(polar_images, transpose, precision)
+    integrated_templates, intensities_templates = _cast_templates(
+        integrated_templates, intensities_templates, precision
+    )
+    correlation = _check_correlation_method(
+        correlation, r_templates, polar_images.shape[2]
+    )
+    if correlation == "fft" and template_spectra is None:
+        template_spectra = _get_template_spectra(
+            r_templates, theta_templates, intensities_templates, polar_images.shape[2]
+        )
+    templates = (
+        integrated_templates,
+        r_templates,
+        theta_templates,
+        intensities_templates,
+    )
+    n_best = max(min(n_best, _get_max_n(r_templates.shape[0], n_keep, frac_keep)), 1)
+    answer = np.empty((polar_images.shape[0], n_best, 5), dtype=np.float64)
+    is_seed, neighbours = _get_seed_neighbours(nav_shape, seed_step)
+    answer[is_seed, :, :4] = _mixed_matching_lib_to_polar_chunk(
+        polar_images[is_seed],
+        *templates,
+        n_keep,
+        frac_keep,
+        n_best,
+        transpose=True,
+        correlation=correlation,
+        template_spectra=template_spectra,
+        precision=precision,
+    )
+    answer[is_seed, :, 4] = 0
+    if is_seed.all():
+        return answer.reshape(nav_shape + (n_best, 5))
+
+    others = np.flatnonzero(~is_seed)
+    seed_templates = answer[neighbours, 0, 0].astype(np.int64)
+    candidates = _get_neighbourhood_candidates(
+        search_index.template_cells[seed_templates],
+        search_index.neighbour_ptr,
+        search_index.neighbour_indexes,
+        n_best,
+    )
+    batch_size = _get_batch_size(
+        candidates.shape[1], polar_images.shape[2], correlation
+    )
+    for start in range(0, others.size, batch_size):
+        batch = others[start : start + batch_size]
+        template_indexes = candidates[start : start + batch_size]
+        correlations = _correlate_kept_templates(
+            polar_images[batch],
+            template_indexes,
+            *templates[1:],
+            correlation,
+            template_spectra,
+        )
+        answer[batch, :, :4] = _get_n_best_batch(
+            template_indexes, *correlations, n_best
+        )
+    answer[others, :, 4] = 1
+
+    reference = answer[neighbours, 0, 1].max(axis=1)
+    fallback = others[answer[others, 0, 1] < fallback_threshold * reference]
+    if fallback.size > 0:
+        answer[fallback, :, :4] = _mixed_matching_lib_to_polar_chunk(
+            polar_images[fallback],
+            *templates,
+            n_keep,
+            frac_keep,
+            n_best,
+            transpose=True,
+            correlation=correlation,
+            template_spectra=template_spectra,
+            precision=precision,
+        )
+        answer[fallback, :, 4] = 2
+    return answer.reshape(nav_shape + (n_best, 5))
+
+
+def _get_polar_sampling(
+    image_shape, center, max_radius, output_shape, radial_indexes, precision
+):
+    """
+    Get the sparse interpolation of the radial indexes (columns) of the polar
+    images which are used, see :func:`_sample_polar_rings`
+
+    Returns
+    -------
+    radial_indexes : 1D numpy.ndarray
+        The sorted radial indexes of the polar images which are interpolated
+    interpolation : scipy.sparse.csr_matrix
+        See :func:`pyxem.utils.polar_transform_utils._get_polar_interpolation_matrix`,
+        with the rows in (r, theta) order
+    """
+    radial_indexes = np.unique(radial_indexes)
+    interpolation = _get_polar_interpolation_matrix(
+        image_shape,
+        center,
+        max_radius,
+        output_shape,
+        radial_indexes=radial_indexes,
+        precision=precision,
+    )
+    rows = np.arange(interpolation.shape[0])
+    rows = rows.reshape(output_shape[0], radial_indexes.size).T.ravel()
+    return radial_indexes, interpolation[rows]
+
+
+def _sample_polar_rings(images, output_shape, radial_indexes, interpolation):
+    """
+    Convert a chunk of images to polar coordinates, only interpolating the radial
+    indexes in ``radial_indexes``. The other radial indexes are 0.
+
+    Parameters
+    ----------
+    images : numpy.ndarray
+        The images of shape (scan_x, scan_y, row, col)
+    output_shape : tuple
+        The shape (theta, r) of the polar images
+    radial_indexes, interpolation
+        See :func:`_get_polar_sampling`
+
+    Returns
+    -------
+    polar_images : numpy.ndarray
+        The polar images transposed to the shape (scan_x, scan_y, r, theta)
+    """
+    nav_shape = images.shape[:-2]
+    frames = images.reshape((-1, images.shape[-2] * images.shape[-1]))
+    rings = frames.astype(interpolation.dtype, copy=False) @ interpolation.T
+    polar_images = np.zeros(
+        nav_shape + tuple(output_shape[::-1]), dtype=interpolation.dtype
+    )
+    polar_images[..., radial_indexes, :] = rings.reshape(
+        nav_shape + (radial_indexes.size, output_shape[0])
+    )
+    return polar_images
+
+
+def _index_chunk(
+    images,
+    center,
+    max_radius,
+    output_shape,
+    precision,
+    integrated_templates,
+    r_templates,
+    theta_templates,
+    intensities_templates,
+    n_keep,
+    frac_keep,
+    n_best,
+    norm_images,
+    order=1,
+    correlation="auto",
+    search_index=None,
+    n_coarse_best=3,
+    template_spectra=None,
+    polar_sampling=None,
+):
+    dispatcher = get_array_module(images)
+    # whether the polar images are (r, theta)
+    transpose = polar_sampling is not None and not is_cupy_array(images)
+    if transpose:
+        polar_images = _sample_polar_rings(images, output_shape, *polar_sampling)
+        if norm_images:
+            norms = np.linalg.norm(polar_images, axis=(-2, -1))
+            polar_images /= norms[..., np.newaxis, np.newaxis]
+    else:
+        polar_images = dispatcher.empty(
+            images.shape[:2] + tuple(output_shape), dtype=precision
+        )
+        for index in np.ndindex(images.shape[:2]):
+            polar_image = _warp_polar_custom(
+                images[index],
+                center,
+                max_radius,
+                output_shape,
+                order=order,
+                precision=precision,
+            )
+            if norm_images:
+                polar_image = polar_image / dispatcher.linalg.norm(polar_image)
+            polar_images[index] = polar_image
+    # prepare an empty results chunk
+    indexation_result_chunk = dispatcher.empty(
+        (images.shape[0], images.shape[1], n_best, 4),
+        dtype=precision,
+    )
+    if search_index is not None:
+        indexation_result_chunk[:] = _hierarchical_matching_lib_to_polar_chunk(
+            polar_images,
+            integrated_templates,
+            r_templates,
+            theta_templates,
+            intensities_templates,
+            search_index,
+            n_keep,
+            frac_keep,
+            n_best,
+            n_coarse_best=n_coarse_best,
+            transpose=transpose,
+            correlation=correlation,
+            template_spectra=template_spectra,
+            precision=precision,
+        )
+        return indexation_result_chunk
+    if not is_cupy_array(polar_images):
+        # match all of the patterns in the chunk at once
+        indexation_result_chunk[:] = _mixed_matching_lib_to_polar_chunk(
+            polar_images,
+            integrated_templates,
+            r_templates,
+            theta_templates,
+            intensities_templates,
+            n_keep,
+            frac_keep,
+            n_best,
+            transpose=transpose,
+            correlation=correlation,
+            template_spectra=template_spectra,
+            precision=precision,
+        )
+        return indexation_result_chunk
+    for index in np.ndindex(images.shape[:2]):
+        indexation_result_chunk[index] = _mixed_matching_lib_to_polar(
+            polar_images[index],
+            integrated_templates,
+            r_templates,
+            theta_templates,
+            intensities_templates,
+            n_keep,
+            frac_keep,
+            n_best,
+            precision=precision,
+        )
+    return indexation_result_chunk
+
+
+def _index_chunk_gpu(images, *args, **kwargs):
+    gpu_im = cp.asarray(images)
+    indexed_chunk = _index_chunk(gpu_im, *args, **kwargs)
+    return cp.asnumpy(indexed_chunk)
+
+
+def get_in_plane_rotation_correlation(
+    image,
+    simulation,
+    intensity_transform_function=None,
+    delta_r=1,
+    delta_theta=1,
+    max_r=None,
+    find_direct_beam=False,
+    direct_beam_position=None,
+    normalize_image=True,
+    normalize_template=True,
+):
+    """
+    Correlate a single image and simulation over the in-plane rotation angle
+
+    Parameters
+    ----------
+    image : 2D numpy.ndarray
+        The image of the diffraction pattern
+    simulation : diffsims.sims.diffraction_simulation.DiffractionSimulation
+        The diffraction pattern simulation
+    intensity_transform_function : Callable, optional
+        Function to apply to both image and template intensities on an
+        element by element basis prior to comparison
+    delta_r : float, optional
+        The sampling interval of the radial coordinate in pixels
+    delta_theta : float, optional
+        The sampling interval of the azimuthal coordinate in degrees
+    max_r : float, optional
+        Maximum radius to consider in pixel units. By default it is the
+        distance from the center of the image to a corner
+    find_direct_beam : bool, optional
+        Whether to optimize the direct beam, otherwise the center of the image
+        is chosen
+    direct_beam_position : 2-tuple of floats, optional
+        (x, y) coordinate of the direct beam in pixel units. Overrides other
+        settings for finding the direct beam
+    normalize_image : bool, optional
+        normalize the image to calculate the correlation coefficient
+    normalize_template : bool, optional
+        normalize the template to calculate the correlation coefficient
+
+    Returns
+    -------
+    angle_array : 1D np.ndarray
+        The in-plane angles at which the correlation is calculated in degrees
+    correlation_array : 1D np.ndarray
+        The correlation corresponding to these angles
+    """
+    polar_image = image_to_polar(
+        image,
+        delta_r,
+        delta_theta,
+        max_r=max_r,
+        find_direct_beam=find_direct_beam,
+        direct_beam_position=direct_beam_position,
+    )
+    r, theta, intensity = get_template_polar_coordinates(
+        simulation,
+        in_plane_angle=0.0,
+        delta_r=delta_r,
+        delta_theta=delta_theta,
+        max_r=polar_image.shape[1],
+    )
+    if is_cupy_array(polar_image):
+        dispatcher = cp
+        r = cp.asarray(r)
+        theta = cp.asarray(theta)
+        intensity = cp.asarray(intensity)
+    else:
+        dispatcher = np
+    if intensity_transform_function is not None:
+        intensity = intensity_transform_function(intensity)
+        polar_image = intensity_transform_function(polar_image)
+    if normalize_image:
+        polar_image = polar_image / dispatcher.linalg.norm(polar_image)
+    if normalize_template:
+        intensity = intensity / dispatcher.linalg.norm(intensity)
+    correlation_array = _match_polar_to_polar_template(
+        polar_image,
+        r,
+        theta,
+        intensity,
+    )
+    angle_array = dispatcher.arange(correlation_array.shape[0]) * delta_theta
+    return angle_array, correlation_array
+
+
+def _get_fast_correlation_index(
+    polar_image,
+    r,
+    intensities,
+    normalize_image,
+    normalize_templates,
+):
+    dispatcher = get_array_module(polar_image)
+    integrated_polar = polar_image.sum(axis=0)
+    rrr = dispatcher.arange(integrated_polar.shape[0]) / integrated_polar.shape[0]
+    integrated_polar = integrated_polar * rrr
+    integrated_templates = _get_integrated_polar_templates(
+        integrated_polar.shape[0],
+        r,
+        intensities,
+        normalize_templates,
+    )
+    if normalize_image:
+        integrated_polar = integrated_polar / np.linalg.norm(integrated_polar)
+    correlations = _match_library_to_polar_fast(
+        integrated_polar,
+        integrated_templates,
+    )
+    return correlations
+
+
+def correlate_library_to_pattern_fast(
+    image,
+    simulations,
+    delta_r=1,
+    delta_theta=1,
+    max_r=None,
+    intensity_transform_function=None,
+    find_direct_beam=False,
+    direct_beam_position=None,
+    normalize_image=True,
+    normalize_templates=True,
+):
+    """
+    Get the correlation between azimuthally integrated templates and patterns
+
+    Parameters
+    ----------
+    image : 2D numpy.ndarray
+        The image of the diffraction pattern
+    simulations : list of diffsims.sims.diffraction_simulation.DiffractionSimulation
+        The diffraction pattern simulation
+    delta_r : float, optional
+        The sampling interval of the radial coordinate in pixels
+    delta_theta : float, optional
+        The sampling interval of the azimuthal coordinate in degrees
+    max_r : float, optional
+        Maximum radius to consider in pixel units. By default it is the
+        distance from the center of the image to a corner
+    intensity_transform_function : Callable, optional
+        Function to apply to both image and template intensities on an
+        element by element basis prior to comparison
+    find_direct_beam : bool, optional
+        Whether to optimize the direct beam, otherwise the center of the image
+        is chosen
+    direct_beam_position : 2-tuple of floats, optional
         (x, y) coordinate of the direct beam in pixel units. Overrides other
         settings for finding the direct beam
     normalize_image : bool, optional
@@ -1372,6 +3181,10 @@ def index_dataset_with_template_rotation(
     target="cpu",
     scheduler="threads",
     precision=np.float64,
+    correlation="auto",
+    search="exhaustive",
+    n_coarse_best=3,
+    checkpoint=None,
 ):
     """
     Index a dataset with template_matching while simultaneously optimizing in-plane rotation angle of the templates
@@ -1427,6 +3240,31 @@ def index_dataset_with_template_rotation(
         recommended.
     precision: np.float32 or np.float64
         The level of precision to work with on internal calculations
+    correlation: str, optional
+        How the in-plane correlation is computed on the CPU. "direct" sums the
+        shifted image rows for every template spot, "fft" multiplies the Fourier
+        transforms of the image rings and of the templates, which is faster for
+        templates with many spots on few rings and a fine ``delta_theta``. By
+        default ("auto") the cheaper one is chosen from the number of spots and
+        azimuthal pixels. Both give the same result.
+    search: str, optional
+        "exhaustive" (default) fully matches all templates passing the ``n_keep``
+        or ``frac_keep`` filter. "hierarchical" first matches a coarse subset of the
+        templates of each phase, with the ``n_keep`` or ``frac_keep`` filter applied
+        to the coarse templates, and then only the templates in the neighbourhood
+        of the ``n_coarse_best`` best coarse templates. The neighbourhoods are
+        found from the orientations of the templates, taken as Bunge Euler angles
+        in degrees, and are built for each call without modifying the library.
+        Only available on the CPU.
+    n_coarse_best: int, optional
+        The number of coarse templates whose neighbourhoods are searched when
+        ``search="hierarchical"``.
+    checkpoint: str or pathlib.Path, optional
+        A zarr directory to which the result of each chunk is written as soon as
+        it is computed. If the indexation is interrupted, calling this function
+        again with the same ``checkpoint`` only indexes the chunks which are not
+        done yet. A ValueError is raised if the store was written with different
+        templates, polar grid or parameters.
 
     Returns
     -------
@@ -1465,6 +3303,12 @@ def index_dataset_with_template_rotation(
         dispatcher = cp
     else:
         dispatcher = np
+    if search not in ("exhaustive", "hierarchical"):
+        raise ValueError(
+            f"search must be 'exhaustive' or 'hierarchical', not '{search}'"
+        )
+    if search == "hierarchical" and target == "gpu":
+        raise ValueError("The hierarchical search is only available on the CPU.")
 
     # get the dataset as a dask array
     data = _get_dask_array(signal)
@@ -1511,6 +3355,7 @@ def index_dataset_with_template_rotation(
     phase_index = []  # array to indicate the phase index of each template
     original_index = []  # index of the template in that phase library
     phase_key_dict = {}  # mapping the phase index to a phase name
+    search_indexes = []  # coarse-to-fine search index of each phase
     maximum_spot_number = 0  # to know the number of columns in template arrays
     total_template_number = 0  # to know number of rows in template arrays
     for index, phase_key in enumerate(phases):
@@ -1533,6 +3378,12 @@ def index_dataset_with_template_rotation(
         phase_index.append(np.full((r.shape[0]), index, dtype=np.int8))
         original_index.append(np.arange(r.shape[0]))
         phase_key_dict[index] = phase_key
+        if search == "hierarchical":
+            # built for every call, so that the library is not modified and the
+            # index always matches its orientations
+            rotations = Rotation.from_euler(np.deg2rad(phase_library["orientations"]))
+            directions = (rotations * Vector3d.zvector()).unit.data
+            search_indexes.append(_build_search_index(directions))
         # update number of spots
         if r.shape[1] > maximum_spot_number:
             maximum_spot_number = r.shape[1]
@@ -1570,6 +3421,31 @@ def index_dataset_with_template_rotation(
     if n_best > max_n:
         n_best = max_n
 
+    if search == "hierarchical":
+        search_index = _combine_search_indexes(
+            search_indexes, [rr.shape[0] for rr in r_list]
+        )
+        # every pattern is compared to at least one full neighbourhood
+        n_best = min(n_best, _get_min_neighbourhood_size(search_index))
+    else:
+        search_index = None
+
+    template_spectra = None
+    polar_sampling = None
+    if target == "cpu":
+        # the FFT of the templates is computed once for all chunks
+        correlation = _check_correlation_method(correlation, r, output_shape[0])
+        if correlation == "fft":
+            template_spectra = _get_template_spectra(
+                r, theta, intensities, output_shape[0]
+            )
+        # the polar images are interpolated with one sparse product per chunk,
+        # only at the radii used by the templates unless the norm is needed
+        radial_indexes = np.arange(r_dim) if normalize_images else r
+        polar_sampling = _get_polar_sampling(
+            data.shape[-2:], center, max_radius, output_shape, radial_indexes, precision
+        )
+
     # copy relevant data to GPU memory if necessary
     if target == "gpu":
         integrated_templates = cp.asarray(integrated_templates)
@@ -1594,6 +3470,11 @@ def index_dataset_with_template_rotation(
         frac_keep,
         n_best,
         normalize_images,
+        correlation=correlation,
+        search_index=search_index,
+        n_coarse_best=n_coarse_best,
+        template_spectra=template_spectra,
+        polar_sampling=polar_sampling,
         dtype=precision,
         drop_axis=signal.axes_manager.signal_indices_in_array,
         chunks=(data.chunks[0], data.chunks[1], n_best, 4),
@@ -1615,9 +3496,39 @@ def index_dataset_with_template_rotation(
                 parallel_workers = max_workers
 
     with ProgressBar():
-        res_index = indexation.compute(
-            scheduler=scheduler, num_workers=parallel_workers, optimize_graph=True
-        )
+        if checkpoint is None:
+            res_index = indexation.compute(
+                scheduler=scheduler, num_workers=parallel_workers, optimize_graph=True
+            )
+        else:
+            # the templates identify the library, the polar grid and the
+            # transformed and normalized intensities
+            attrs = dict(
+                phases=[str(phase) for phase in phase_key_dict.values()],
+                n_templates=r.shape[0],
+                templates=_get_array_fingerprint(r, theta, intensities),
+                n_keep=n_keep,
+                frac_keep=frac_keep,
+                n_best=n_best,
+                delta_r=delta_r,
+                delta_theta=delta_theta,
+                max_r=max_r,
+                intensity_transform_function=_get_function_name(
+                    intensity_transform_function
+                ),
+                normalize_images=normalize_images,
+                normalize_templates=normalize_templates,
+                search=search,
+                n_coarse_best=n_coarse_best,
+                precision=np.dtype(precision).name,
+            )
+            res_index = _store_with_checkpoint(
+                indexation,
+                checkpoint,
+                attrs=attrs,
+                scheduler=scheduler,
+                num_workers=parallel_workers,
+            ).compute()
 
     # cupy retains memory on the GPU even after garbage collection
     # see https://docs.cupy.dev/en/stable/user_guide/memory.html